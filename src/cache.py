@@ -0,0 +1,170 @@
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+import threading
+from time import monotonic
+import logging
+
+
+logger = logging.getLogger("cache")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+class LRUCache:
+    """
+    A thread-safe, in-memory LRU cache whose entries expire after `ttl` seconds.
+
+    The cache holds at most `max_entries` entries and, when a `sizeof` function is given, at most `max_bytes` bytes
+    as estimated by `sizeof(value)`. When a limit is exceeded, the least recently used entries are evicted.
+    """
+
+    def __init__(self, max_entries: int, ttl: float = None, max_bytes: int = None, sizeof=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, insertion time)
+        self._num_bytes = 0
+
+        self._num_hits = 0
+        self._num_misses = 0
+        self._num_evictions = 0
+        self._num_expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None and self.ttl is not None and monotonic() - entry[2] > self.ttl:
+                self._remove(key)
+                self._num_expirations += 1
+                entry = None
+
+            if entry is None:
+                self._num_misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self._num_hits += 1
+            return entry[0]
+
+    def put(self, key, value, age: float = 0.):
+        """
+        Store `value` under `key`. `age` is the number of seconds the value has already lived, and is subtracted from
+        its time to live.
+        """
+
+        size = self.sizeof(value) if self.sizeof is not None else 0
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            if self.max_bytes is not None and size > self.max_bytes:
+                logger.info(f"Not caching an entry of {size} bytes, exceeding the cache capacity of {self.max_bytes} bytes")
+                return
+
+            self._entries[key] = (value, size, monotonic() - age)
+            self._num_bytes += size
+
+            while len(self._entries) > self.max_entries or \
+                    (self.max_bytes is not None and self._num_bytes > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self._num_evictions += 1
+
+    def invalidate(self, predicate=None):
+        """
+        Remove the entries whose key satisfies `predicate`, or all the entries if it isn't given.
+
+        Returns:
+            The number of removed entries.
+        """
+
+        with self._lock:
+            keys = [key for key in self._entries if predicate is None or predicate(key)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._num_bytes,
+                'hits': self._num_hits,
+                'misses': self._num_misses,
+                'evictions': self._num_evictions,
+                'expirations': self._num_expirations,
+            }
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._num_bytes -= size
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls computing the same key: the first call runs the computation while the following ones
+    wait for it and share its result, or its exception.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}  # key -> Future of the computation in flight
+
+        self._num_calls = 0
+        self._num_coalesced = 0
+        self._num_timeouts = 0
+
+    def do(self, key, fn, timeout: float = None):
+        """
+        Return `fn()`, unless a computation of `key` is already in flight, in which case wait for its result for at
+        most `timeout` seconds.
+
+        Raises:
+            The exception raised by the computation, or `concurrent.futures.TimeoutError` if waiting timed out.
+
+        Returns:
+            A 2d-tuple containing the result and whether it has been shared with another call.
+        """
+
+        with self._lock:
+            self._num_calls += 1
+
+            future = self._calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self._num_coalesced += 1
+
+        if not leader:
+            try:
+                return future.result(timeout), True
+            except FutureTimeoutError:
+                with self._lock:
+                    self._num_timeouts += 1
+                raise
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'calls': self._num_calls,
+                'coalesced': self._num_coalesced,
+                'timeouts': self._num_timeouts,
+            }
@@ -0,0 +1,106 @@
+import numpy as np
+import functools
+
+
+# The probability threshold under which a day is unplayable, for every month (see `weather.is_unplayable_day`)
+UNPLAYABLE_DAY_THRESHOLDS = np.array([0.9, 0.8, 0.6, 0.38, 0.3, 0.1, 0.08, 0.07, 0.1, 0.3, 0.79, 0.9])
+
+
+def noise(n: np.ndarray) -> np.ndarray:
+    """
+    Vectorized version of `weather.noise`.
+    """
+
+    return np.abs(np.modf(np.sin(n) * 43758.5453123)[0])
+
+
+@functools.lru_cache(maxsize=32)
+def _calendar(first_year: int, last_year: int):
+    """
+    Compute the day features of every day from the beginning of `first_year` to the end of `last_year`. Since the
+    calendar doesn't depend on the basket, the result is shared by all the callers.
+
+    Returns:
+        A dict of read-only arrays, one item per day.
+    """
+
+    days = np.arange(np.datetime64(f'{first_year:04d}-01-01'), np.datetime64(f'{last_year + 1:04d}-01-01'))
+
+    year = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    month = days.astype('datetime64[M]').astype(np.int64) % 12 + 1
+    day = (days - days.astype('datetime64[M]')).astype(np.int64) + 1
+    weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday; Monday is 0 like `datetime.weekday()`
+
+    unplayable = noise((year * 365 + month * 31 + day).astype(np.float64)) <= UNPLAYABLE_DAY_THRESHOLDS[month - 1]
+
+    # School and work days, which the sample data generator also follows (see `sample_data_generator.BusyDay`)
+    busy = ((1 <= month) & (month <= 5)) | ((9 <= month) & (month <= 12))  # January to May OR September to December
+    busy &= weekday != 6  # Sunday
+    busy &= ~((month == 12) & (23 <= day) & (day <= 31))  # Christmas holiday
+    busy &= ~((month == 1) & (1 <= day) & (day <= 6))
+
+    features = {
+        'day': days,
+        'weekday': weekday,
+        'unplayable': unplayable,
+        'busy': busy,
+    }
+
+    for array in features.values():
+        array.flags.writeable = False
+
+    return features
+
+
+def day_features(days) -> dict:
+    """
+    Compute the calendar features of the given days in one pass.
+
+    Parameters:
+        - `days`: The days, as an array of `datetime64` (truncated to the day) or anything convertible to it.
+
+    Returns:
+        A dict mapping the name of every feature to the array holding its value for every day of `days`:
+            - `weekday`: The day of the week, Monday being 0.
+            - `unplayable`: Whether the day is unplayable because of the weather (see `weather.is_unplayable_day`).
+            - `busy`: Whether the day is a school or work day: from September to May, except on Sundays and during
+                the Christmas holidays.
+    """
+
+    days = np.atleast_1d(np.asarray(days, dtype='datetime64[D]'))
+
+    if len(days) == 0:
+        return {
+            'weekday': np.empty(0, dtype=np.int64),
+            'unplayable': np.empty(0, dtype=bool),
+            'busy': np.empty(0, dtype=bool),
+        }
+
+    years = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    calendar = _calendar(int(np.amin(years)), int(np.amax(years)))
+
+    idx = (days - calendar['day'][0]).astype(np.int64)
+
+    return {
+        'weekday': calendar['weekday'][idx],
+        'unplayable': calendar['unplayable'][idx],
+        'busy': calendar['busy'][idx],
+    }
+
+
+def unplayable_days(days) -> np.ndarray:
+    """
+    Returns:
+        The boolean array telling, for every day of `days`, whether it's unplayable.
+    """
+
+    return day_features(days)['unplayable']
+
+
+def busy_days(days) -> np.ndarray:
+    """
+    Returns:
+        The boolean array telling, for every day of `days`, whether it's a busy day.
+    """
+
+    return day_features(days)['busy']
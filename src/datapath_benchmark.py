@@ -0,0 +1,130 @@
+from occupation import evaluate_occupation_from_measurements, to_epoch_ns, OCCUPATION_CONTRIBUTIONS
+from calendar_features import unplayable_days
+import weather
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+import argparse
+import json
+import time
+import tracemalloc
+
+
+def object_path(present: datetime, num_history_days: int, num_predicted_days: int, measurements: dict):
+    """
+    The data path of the forecast as it used to be: python `datetime(s)`, object arrays and per-element conversions.
+    """
+
+    t = pd.date_range(end=present, periods=num_history_days * 24 * 2, freq='30min').to_pydatetime()
+    occupation_t = evaluate_occupation_from_measurements(to_epoch_ns(list(t)), measurements).tolist()
+
+    df = pd.DataFrame(np.array([t, occupation_t]).transpose(), columns = ['ds', 'y'])
+
+    past_days = df['ds'] \
+        .map(lambda date: date.date()) \
+        .drop_duplicates() \
+        .to_list()
+    past_holidays = [day for day in past_days if weather.is_unplayable_day(day)]
+
+    future_days = pd.date_range(present + timedelta(days=1), present + timedelta(days=num_predicted_days), freq='1d').to_pydatetime()
+    future_holidays = [day.date() for day in future_days if weather.is_unplayable_day(day)]
+
+    holidays = pd.DataFrame({
+        'holiday': 'unplayable_day',
+        'ds': past_holidays + future_holidays
+    })
+
+    # Stand-in for the prediction of the model
+    future_t = pd.date_range(start=present, periods=num_predicted_days * 24 * 2, freq='30min').to_pydatetime()
+    future_occupation_t = df['y'][-len(future_t):].to_numpy(dtype=np.float64)
+
+    min_future_t = np.amin(future_t)
+    occupation = [
+        np.interp(
+            (t - min_future_t).total_seconds(),
+            [dt.total_seconds() for dt in future_t - min_future_t],
+            future_occupation_t
+        )
+        for t in future_t[::2 * 24]
+    ]
+
+    return df, holidays, occupation
+
+
+def typed_path(present: datetime, num_history_days: int, num_predicted_days: int, measurements: dict):
+    """
+    The current data path of the forecast: `datetime64[ns]` and `float64` columns all along.
+    """
+
+    t = pd.date_range(end=present, periods=num_history_days * 24 * 2, freq='30min').to_numpy(dtype='datetime64[ns]')
+    occupation_t = evaluate_occupation_from_measurements(to_epoch_ns(t), measurements)
+
+    df = pd.DataFrame({'ds': t, 'y': occupation_t})
+
+    days = np.arange(t[0].astype('datetime64[D]'), np.datetime64(present, 'D') + num_predicted_days + 1)
+    holidays = pd.DataFrame({
+        'holiday': 'unplayable_day',
+        'ds': days[unplayable_days(days)],
+    })
+
+    # Stand-in for the prediction of the model
+    future_t = pd.date_range(start=present, periods=num_predicted_days * 24 * 2, freq='30min').to_numpy(dtype='datetime64[ns]')
+    future_occupation_t = occupation_t[-len(future_t):]
+
+    occupation = np.interp(to_epoch_ns(future_t[::2 * 24]), to_epoch_ns(future_t), future_occupation_t)
+
+    return df, holidays, occupation
+
+
+def measure(path, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    df, _, _ = path(*args)
+
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'seconds': elapsed,
+        'peak_traced_bytes': peak,
+        'history_dataframe_bytes': int(df.memory_usage(deep=True).sum()),
+        'history_dtypes': {column: str(dtype) for column, dtype in df.dtypes.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-np", "--num_history_days", type=int, default=365)
+    parser.add_argument("-nf", "--num_predicted_days", type=int, default=14)
+    parser.add_argument("-e", "--events_per_day", type=int, default=300)
+
+    args = parser.parse_args()
+
+    present = datetime(2016, 8, 1, 17, 30)
+
+    # Synthetic measurements spread over the history
+    rng = np.random.default_rng(0)
+    history_start_ns = to_epoch_ns(present - timedelta(days=args.num_history_days + 1))[0]
+    measurements = {
+        source: np.sort(rng.integers(history_start_ns, to_epoch_ns(present)[0], args.events_per_day * args.num_history_days))
+        for source in OCCUPATION_CONTRIBUTIONS
+    }
+
+    path_args = (present, args.num_history_days, args.num_predicted_days, measurements)
+
+    # Warm up imports and caches before measuring
+    object_path(*path_args)
+    typed_path(*path_args)
+
+    print(json.dumps({
+        'num_history_days': args.num_history_days,
+        'object': measure(object_path, *path_args),
+        'typed': measure(typed_path, *path_args),
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
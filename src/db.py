@@ -4,28 +4,255 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-import mysql.connector
 import os
 import logging
+import threading
+from time import monotonic
 
 
 logger = logging.getLogger('db')
 #logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
 
-db_host = os.environ['DB_HOST']
-db_port = os.environ['DB_PORT']
-db_username = os.environ['DB_USERNAME']
-db_password = os.environ['DB_PASSWORD']
-db_database = os.environ['DB_DATABASE']
+# The connection settings (`DB_HOST`, `DB_PORT`, `DB_USERNAME`, `DB_PASSWORD` and `DB_DATABASE`) are only read when
+# the first connection is opened, so that the modules importing this one also work with a non-MySQL measurement store
+
+db_pool_size = int(os.environ.get('DB_POOL_SIZE', 16))
+db_pool_timeout = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+db_pool_health_check_interval = float(os.environ.get('DB_POOL_HEALTH_CHECK_INTERVAL', 30))
+
+
+class PoolTimeoutError(Exception):
+    pass
+
+
+class PooledConnection:
+    """
+    A DB connection checked out from a `ConnectionPool`. It behaves like the wrapped connection, except that
+    `close()` gives it back to the pool instead of closing it.
+    """
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def close(self):
+        if self._connection is not None:
+            connection, self._connection = self._connection, None
+            self._pool.release(connection)
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            import mysql.connector
+
+            raise mysql.connector.errors.OperationalError("The connection has already been given back to the pool")
+        return getattr(self._connection, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ConnectionPool:
+    """
+    A thread-safe pool of DB connections shared by the whole process.
+
+    Connections are opened lazily up to `size`; once the limit is reached, callers wait for a connection to be given
+    back for at most `timeout` seconds. Connections that stayed idle for longer than `health_check_interval` seconds
+    are pinged (and reconnected if needed) before being handed out.
+    """
+
+    def __init__(self, size: int, timeout: float, health_check_interval: float, **connection_kwargs):
+        self.size = size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connection_kwargs = connection_kwargs
+
+        self._condition = threading.Condition()
+        self._idle = []  # (connection, last_used) pairs, the most recently used one last
+
+        self._num_open = 0
+        self._num_in_use = 0
+        self._num_waiting = 0
+
+        self._num_checkouts = 0
+        self._num_timeouts = 0
+        self._num_reconnects = 0
+        self._total_checkout_time = 0.
+        self._max_checkout_time = 0.
+
+    def acquire(self, timeout: float = None):
+        """
+        Check out a connection from the pool, opening a new one if none is idle and the pool isn't full.
+
+        Raises:
+            `PoolTimeoutError` if no connection became available within `timeout` seconds (or the pool's default).
+        """
+
+        timeout = self.timeout if timeout is None else timeout
+        start = monotonic()
+
+        with self._condition:
+            self._num_waiting += 1
+            try:
+                while not self._idle and self._num_open >= self.size:
+                    remaining = start + timeout - monotonic()
+                    if remaining <= 0:
+                        self._num_timeouts += 1
+                        raise PoolTimeoutError(f"No DB connection became available within {timeout}s")
+                    self._condition.wait(remaining)
+
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                else:
+                    connection, last_used = None, None
+                    self._num_open += 1
+
+                self._num_in_use += 1
+            finally:
+                self._num_waiting -= 1
+
+        # Connecting and pinging happen outside the lock so that they don't hold back the other callers
+        try:
+            if connection is None:
+                connection = self._connect()
+            elif monotonic() - last_used > self.health_check_interval:
+                connection = self._check_health(connection)
+        except Exception:
+            with self._condition:
+                self._num_open -= 1
+                self._num_in_use -= 1
+                self._condition.notify()
+            raise
+
+        checkout_time = monotonic() - start
+
+        with self._condition:
+            self._num_checkouts += 1
+            self._total_checkout_time += checkout_time
+            self._max_checkout_time = max(self._max_checkout_time, checkout_time)
+
+        return PooledConnection(self, connection)
+
+    def release(self, connection):
+        """
+        Give back a connection to the pool. Any pending transaction is rolled back, so that the next user doesn't
+        read from a stale snapshot; broken connections are discarded.
+        """
+
+        try:
+            connection.rollback()
+            reusable = True
+        except Exception as e:
+            logger.warning(f"Discarding a broken DB connection: {e}")
+            reusable = False
+
+        if not reusable:
+            try:
+                connection.close()
+            except Exception:
+                pass
+
+        with self._condition:
+            self._num_in_use -= 1
+            if reusable:
+                self._idle.append((connection, monotonic()))
+            else:
+                self._num_open -= 1
+            self._condition.notify()
+
+    def stats(self):
+        """
+        Returns:
+            A dict describing the current state of the pool and the checkouts served so far.
+        """
+
+        with self._condition:
+            return {
+                'size': self.size,
+                'open': self._num_open,
+                'in_use': self._num_in_use,
+                'idle': len(self._idle),
+                'waiting': self._num_waiting,
+                'checkouts': self._num_checkouts,
+                'timeouts': self._num_timeouts,
+                'reconnects': self._num_reconnects,
+                'avg_checkout_ms': (self._total_checkout_time / self._num_checkouts * 1000) if self._num_checkouts else 0.,
+                'max_checkout_ms': self._max_checkout_time * 1000,
+            }
+
+    def _connect(self):
+        import mysql.connector
+
+        logger.debug(f"Opening a new DB connection ({self._num_open}/{self.size})")
+        return mysql.connector.connect(**self.connection_kwargs)
+
+    def _check_health(self, connection):
+        try:
+            connection.ping(reconnect=False)
+            return connection
+        except Exception as e:
+            logger.info(f"Reconnecting a stale DB connection: {e}")
+
+        with self._condition:
+            self._num_reconnects += 1
+
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+        return self._connect()
+
+
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+
+
+def get_db_pool():
+    """
+    Returns:
+        The `ConnectionPool` of the current process, creating it on first use (or after a fork).
+    """
+
+    global _db_pool, _db_pool_pid
+
+    with _db_pool_lock:
+        if _db_pool is None or _db_pool_pid != os.getpid():
+            _db_pool = ConnectionPool(
+                db_pool_size,
+                db_pool_timeout,
+                db_pool_health_check_interval,
+                host=os.environ['DB_HOST'],
+                port=os.environ['DB_PORT'],
+                user=os.environ['DB_USERNAME'],
+                password=os.environ['DB_PASSWORD'],
+                database=os.environ['DB_DATABASE'],
+                # Instants are always exchanged in UTC, also when converted to UNIX timestamps on the DB side
+                time_zone='+00:00',
+            )
+            _db_pool_pid = os.getpid()
+
+        return _db_pool
 
 
 def create_db_connection():
-    db_connection = mysql.connector.connect(
-        host=db_host,
-        port=db_port,
-        user=db_username,
-        password=db_password,
-        database=db_database,
-        pool_size=16,
-    )
-    return db_connection
+    """
+    Check out a connection from the process-wide pool. Calling `close()` on it gives it back to the pool.
+    """
+
+    return get_db_pool().acquire()
+
+
+def db_pool_stats():
+    """
+    Returns:
+        The stats of the pool of the current process, or `None` if no connection has been opened yet.
+    """
+
+    with _db_pool_lock:
+        pool = _db_pool if _db_pool_pid == os.getpid() else None
+
+    return pool.stats() if pool is not None else None
@@ -0,0 +1,240 @@
+import numpy as np
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import shutil
+import time
+
+
+logger = logging.getLogger("event_archive")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# The directory the sealed days of measurements are archived to. The archive is disabled if empty
+event_archive_dir = os.environ.get('EVENT_ARCHIVE_DIR', '')
+
+# The number of seconds after the end of a day its measurements are considered all ingested, and the day archived
+event_archive_ingestion_lag = float(os.environ.get('EVENT_ARCHIVE_INGESTION_LAG', 60 * 60))
+
+DAY_NS = 24 * 60 * 60 * 10**9
+
+# The number of days fetched from the measurement store at once while archiving
+ARCHIVE_CHUNK_DAYS = 30
+
+
+class EventArchive:
+    """
+    An append-only archive of the instants of the measurements of every basket, one day at a time. For every basket,
+    the directory `<path>/<basket_id>` holds:
+        - `<source>.bin`: The sorted `int64` instants of the measurements of the source, as nanoseconds since the
+            UNIX epoch.
+        - `days.bin`: The day index, one `int64` row per archived day holding the day (as days since the UNIX epoch)
+            and, for every source, the number of its measurements up to the end of the day.
+
+    Days are archived contiguously, once sealed, so that the files are never rewritten: readers memory map them and
+    only trust what the day index covers, even while days are being appended.
+    """
+
+    def __init__(self, path: str, sources):
+        self.path = path
+        self.sources = tuple(sources)
+
+    def read_index(self, basket_id: int) -> np.ndarray:
+        """
+        Returns:
+            The day index of the basket, one row per archived day.
+        """
+
+        index_path = os.path.join(self._basket_dir(basket_id), 'days.bin')
+        if not os.path.exists(index_path):
+            return np.empty((0, 1 + len(self.sources)), dtype=np.int64)
+
+        index = np.fromfile(index_path, dtype='<i8')
+
+        # Drop a row partially written by an interrupted append
+        return index[:len(index) - len(index) % (1 + len(self.sources))].reshape(-1, 1 + len(self.sources))
+
+    def archived_days(self, basket_id: int):
+        """
+        Returns:
+            A 2d-tuple containing the first archived day and the day following the last archived one, as
+            `datetime64[D]`, or `None` if no day of the basket has been archived.
+        """
+
+        index = self.read_index(basket_id)
+        if len(index) == 0:
+            return None
+
+        return np.datetime64(int(index[0, 0]), 'D'), np.datetime64(int(index[-1, 0]) + 1, 'D')
+
+    def append_days(self, basket_id: int, first_day: np.datetime64, num_days: int, measurements: dict):
+        """
+        Archive `num_days` days of measurements of a basket, starting from `first_day`, which must follow the last
+        archived day (unless the basket has never been archived).
+
+        Parameters:
+            - `measurements`: A dict mapping every source to the sorted `int64` array of the instants of its
+                measurements during those days, as nanoseconds since the UNIX epoch.
+        """
+
+        first_day = int(np.datetime64(first_day, 'D').astype(np.int64))
+        index = self.read_index(basket_id)
+
+        if len(index) > 0 and first_day != index[-1, 0] + 1:
+            raise ValueError(f"Basket {basket_id} is archived until day {index[-1, 0]}, can't append day {first_day}")
+
+        basket_dir = self._basket_dir(basket_id)
+        os.makedirs(basket_dir, exist_ok=True)
+
+        days = first_day + np.arange(num_days, dtype=np.int64)
+        rows = np.empty((num_days, 1 + len(self.sources)), dtype=np.int64)
+        rows[:, 0] = days
+
+        for source_idx, source in enumerate(self.sources):
+            num_archived = int(index[-1, 1 + source_idx]) if len(index) > 0 else 0
+
+            measurement_ns = np.asarray(measurements[source], dtype=np.int64)
+            measurement_ns = measurement_ns[(measurement_ns >= days[0] * DAY_NS) & (measurement_ns < (days[-1] + 1) * DAY_NS)]
+
+            with open(os.path.join(basket_dir, f'{source}.bin'), 'ab') as f:
+                # Drop the measurements of an interrupted append, that the day index doesn't cover
+                f.truncate(num_archived * 8)
+                f.write(measurement_ns.astype('<i8').tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            rows[:, 1 + source_idx] = num_archived + np.searchsorted(measurement_ns, (days + 1) * DAY_NS, side='left')
+
+        # The day index is written last, so that the appended measurements become visible at once
+        with open(os.path.join(basket_dir, 'days.bin'), 'ab') as f:
+            f.truncate(len(index) * index.shape[1] * 8)
+            f.write(rows.astype('<i8').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+
+    def read(self, basket_id: int, from_ns: int, to_ns: int):
+        """
+        Read the archived measurements of a basket in the range [`from_ns`, `to_ns`]. The arrays are read-only views
+        of the memory mapped files, served from the page cache without copying.
+
+        Returns:
+            `None` if no archived day overlaps the range, otherwise a 3d-tuple containing the covered range
+            [`lo_ns`, `hi_ns`) and the dict mapping every source to the array of the instants of its measurements in
+            that range.
+        """
+
+        index = self.read_index(basket_id)
+        if len(index) == 0:
+            return None
+
+        first_day = int(index[0, 0])
+
+        lo_ns = max(int(from_ns), first_day * DAY_NS)
+        hi_ns = min(int(to_ns) + 1, (int(index[-1, 0]) + 1) * DAY_NS)
+        if lo_ns >= hi_ns:
+            return None
+
+        # The rows of the days the range begins and ends in
+        first_row = lo_ns // DAY_NS - first_day
+        last_row = (hi_ns - 1) // DAY_NS - first_day
+
+        measurements = {}
+
+        for source_idx, source in enumerate(self.sources):
+            start = int(index[first_row - 1, 1 + source_idx]) if first_row > 0 else 0
+            end = int(index[last_row, 1 + source_idx])
+
+            if end == 0:
+                measurements[source] = np.empty(0, dtype=np.int64)
+                continue
+
+            events = np.memmap(os.path.join(self._basket_dir(basket_id), f'{source}.bin'), dtype='<i8', mode='r', shape=(end,)).view(np.ndarray)
+
+            day_events = events[start:end]
+            measurements[source] = day_events[np.searchsorted(day_events, lo_ns, side='left'):np.searchsorted(day_events, hi_ns, side='left')]
+
+        return lo_ns, hi_ns, measurements
+
+    def delete(self, basket_id: int):
+        shutil.rmtree(self._basket_dir(basket_id), ignore_errors=True)
+
+    def _basket_dir(self, basket_id: int):
+        return os.path.join(self.path, str(int(basket_id)))
+
+
+def sealed_day(now: datetime = None) -> np.datetime64:
+    """
+    Returns:
+        The day following the last sealed one, i.e. whose measurements can't change anymore.
+    """
+
+    now = now or datetime.utcnow()
+    return np.datetime64(now - timedelta(seconds=event_archive_ingestion_lag), 'D')
+
+
+def archive_baskets(archive: EventArchive, store, basket_ids=None, initial_days: int = 365, now: datetime = None):
+    """
+    Archive the days of every basket sealed since its last archived day, or in the last `initial_days` days if it
+    has never been archived, reading them from the given `MeasurementStore`.
+
+    Returns:
+        The number of archived measurements.
+    """
+
+    until = sealed_day(now)
+
+    if basket_ids is None:
+        basket_ids = store.fetch_basket_ids()
+
+    num_measurements = 0
+
+    for basket_id in basket_ids:
+        archived_days = archive.archived_days(basket_id)
+        day = archived_days[1] if archived_days is not None else until - initial_days
+
+        while day < until:
+            num_days = int(min(ARCHIVE_CHUNK_DAYS, (until - day).astype(np.int64)))
+
+            measurements = store.fetch_measurements_for_baskets(
+                [basket_id],
+                day.astype('datetime64[us]').item(),
+                (day + num_days).astype('datetime64[us]').item() - timedelta(microseconds=1),
+            )[basket_id]
+
+            archive.append_days(basket_id, day, num_days, measurements)
+
+            num_measurements += sum(len(measurement_ns) for measurement_ns in measurements.values())
+            day += num_days
+
+        logger.info(f"Archived basket {basket_id} until {until}")
+
+    return num_measurements
+
+
+def main():
+    from measurements import create_measurement_store, measurement_store_kind, measurement_store_path, MEASUREMENT_SOURCES
+
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-b", "--basket", type=int, action='append')
+    parser.add_argument("-i", "--initial_days", type=int, default=365)
+
+    args = parser.parse_args()
+
+    if not event_archive_dir:
+        print("EVENT_ARCHIVE_DIR isn't set")
+        exit(1)
+
+    # The measurements are read from the store itself, not through the archive
+    store = create_measurement_store(measurement_store_kind, measurement_store_path)
+    archive = EventArchive(event_archive_dir, MEASUREMENT_SOURCES)
+
+    start = time.monotonic()
+    num_measurements = archive_baskets(archive, store, args.basket, args.initial_days)
+
+    print(f"Archived {num_measurements} measurement(s) in {time.monotonic() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+from occupation_forecast import forecast_engine, forecasters, get_forecaster
+from occupation_rollup import evaluate_occupation_history
+from calendar_features import unplayable_days
+import numpy as np
+from datetime import datetime, timedelta
+import argparse
+import itertools
+import json
+import os
+import resource
+import sys
+import threading
+import time
+import traceback
+
+
+SAMPLES_PER_DAY = 24 * 2
+
+# The seconds between two samples of the resident memory while a forecast is fitted
+MEMORY_SAMPLING_INTERVAL = 0.005
+
+MEMORY_METHOD = (
+    "The fit is timed on its own, then run again while the resident memory of the process is sampled every "
+    f"{MEMORY_SAMPLING_INTERVAL * 1000:g}ms from /proc/self/statm: `peak_rss_bytes` is the highest sample above the "
+    "resident memory before the fit. `children_max_rss_bytes` is `getrusage(RUSAGE_CHILDREN).ru_maxrss`, the largest "
+    "resident memory of a child process (e.g. the Stan process fitting Prophet models) since the backtest started."
+)
+
+
+def backtest_presents(start: datetime, end: datetime, step: timedelta):
+    """
+    Returns:
+        The list of the `present` dates replayed, every `step` from `start` to `end`.
+    """
+
+    presents = [start]
+    while presents[-1] + step <= end:
+        presents.append(presents[-1] + step)
+
+    return presents
+
+
+def evaluate_backtest_history(basket_id: int, presents, max_num_history_days: int, num_predicted_days: int):
+    """
+    Evaluate the occupation of a basket every 30min over the whole span covered by the backtest, so that every
+    configuration and `present` slices it rather than evaluating it again.
+
+    Returns:
+        A 2d-tuple containing the `datetime64[ns]` array of the time samples and the array of their occupation.
+    """
+
+    first = np.datetime64(presents[0], 'ns') - (max_num_history_days * SAMPLES_PER_DAY - 1) * np.timedelta64(30, 'm')
+    num_samples = ((np.datetime64(presents[-1], 'ns') - first) // np.timedelta64(30, 'm')) + num_predicted_days * SAMPLES_PER_DAY + 1
+
+    t = first + np.arange(num_samples) * np.timedelta64(30, 'm')
+
+    return t, evaluate_occupation_history(basket_id, t)
+
+
+def resident_memory() -> int:
+    """
+    Returns:
+        The resident memory of the process in bytes, or `None` if `/proc` isn't available.
+    """
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        return None
+
+
+def children_max_rss() -> int:
+    """
+    Returns:
+        The largest resident memory, in bytes, of the child processes waited for so far.
+    """
+
+    max_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # In KiB, except on macOS
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def sample_peak_rss(fn, interval: float = MEMORY_SAMPLING_INTERVAL):
+    """
+    Call `fn` while sampling the resident memory of the process from another thread.
+
+    Returns:
+        A 2d-tuple containing the result of `fn` and the peak resident memory sampled while it ran above the resident
+        memory before the call, in bytes, or `None` if the resident memory can't be read.
+    """
+
+    baseline = resident_memory()
+    if baseline is None:
+        return fn(), None
+
+    peak = baseline
+    done = threading.Event()
+
+    def sample():
+        nonlocal peak
+        while not done.wait(interval):
+            peak = max(peak, resident_memory())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+
+    try:
+        result = fn()
+    finally:
+        done.set()
+        sampler.join()
+
+    return result, max(peak, resident_memory()) - baseline
+
+
+def backtest_forecast(config: dict, t: np.ndarray, occupation_t: np.ndarray, present_idx: int, num_history_days: int, num_predicted_days: int, measure_memory: bool = True):
+    """
+    Fit a forecast on the `num_history_days` before the time sample `present_idx` of `t`, and compare its prediction
+    with the occupation that followed.
+
+    The fit is timed on its own and, if `measure_memory`, run a second time to sample the memory it takes (see
+    `sample_peak_rss`), so that the sampling doesn't inflate the time.
+
+    Returns:
+        A 3d-tuple containing the seconds spent fitting, the peak resident memory added while fitting (or `None`) and
+        the array of the absolute errors of the prediction, one row per predicted day.
+    """
+
+    history = slice(present_idx - num_history_days * SAMPLES_PER_DAY + 1, present_idx + 1)
+    future = slice(present_idx + 1, present_idx + num_predicted_days * SAMPLES_PER_DAY + 1)
+
+    days = np.arange(t[history][0].astype('datetime64[D]'), t[present_idx].astype('datetime64[D]') + num_predicted_days + 1)
+
+    def fit():
+        return get_forecaster(config['engine']).fit(
+            config,
+            t[history],
+            occupation_t[history],
+            days,
+            unplayable_days(days),
+            num_predicted_days,
+        )
+
+    start = time.perf_counter()
+    _, _, predicted_occupation_t = fit()
+    fit_seconds = time.perf_counter() - start
+
+    peak = sample_peak_rss(fit)[1] if measure_memory else None
+
+    # The served forecasts are clipped to [0, 1] (see `interpolate_forecast`)
+    predicted_occupation_t = np.clip(predicted_occupation_t[-num_predicted_days * SAMPLES_PER_DAY:], 0, 1)
+    errors = np.abs(predicted_occupation_t - occupation_t[future])
+
+    return fit_seconds, peak, errors.reshape(num_predicted_days, SAMPLES_PER_DAY)
+
+
+def backtest_configuration(config: dict, num_history_days: int, num_predicted_days: int, histories: dict, presents, measure_memory: bool = True):
+    """
+    Replay the forecast of every basket of `histories` from every date of `presents` with a configuration.
+
+    Returns:
+        A dict holding the errors per horizon day and the costs of the configuration.
+    """
+
+    start = time.perf_counter()
+
+    errors = []
+    fit_seconds = []
+    peak_rss_bytes = None
+    failures = []
+
+    for basket_id, (t, occupation_t) in histories.items():
+        for present in presents:
+            present_idx = int((np.datetime64(present, 'ns') - t[0]) // np.timedelta64(30, 'm'))
+
+            try:
+                seconds, peak, present_errors = backtest_forecast(config, t, occupation_t, present_idx, num_history_days, num_predicted_days, measure_memory)
+            except Exception:
+                failures.append({
+                    'basket': basket_id,
+                    'present': present.isoformat(),
+                    'error': traceback.format_exc(),
+                })
+                continue
+
+            errors.append(present_errors)
+            fit_seconds.append(seconds)
+            if peak is not None:
+                peak_rss_bytes = max(peak_rss_bytes or 0, peak)
+
+    report = {
+        'num_history_days': num_history_days,
+        'config': config,
+        'forecasts': len(errors),
+        'failures': failures,
+        'wall_seconds': time.perf_counter() - start,
+        'fit_seconds': {
+            'total': float(np.sum(fit_seconds)),
+            'mean': float(np.mean(fit_seconds)) if fit_seconds else None,
+            'max': float(np.max(fit_seconds)) if fit_seconds else None,
+        },
+        'peak_rss_bytes': peak_rss_bytes,
+        'children_max_rss_bytes': children_max_rss() if measure_memory else None,
+    }
+
+    if errors:
+        errors = np.stack(errors)  # forecast, horizon day, sample
+
+        report['mae'] = float(np.mean(errors))
+        report['rmse'] = float(np.sqrt(np.mean(errors ** 2)))
+        report['mae_per_day'] = np.mean(errors, axis=(0, 2)).tolist()
+        report['rmse_per_day'] = np.sqrt(np.mean(errors ** 2, axis=(0, 2))).tolist()
+
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-b", "--basket", type=int, action='append', required=True)
+    parser.add_argument("-s", "--start", type=datetime.fromisoformat, required=True)
+    parser.add_argument("-x", "--end", type=datetime.fromisoformat)
+    parser.add_argument("-d", "--step_days", type=int, default=7)
+    parser.add_argument("-np", "--num_history_days", type=int, nargs='+', default=[90])
+    parser.add_argument("-nf", "--num_predicted_days", type=int, default=14)
+    parser.add_argument("-e", "--engine", choices=sorted(forecasters), nargs='+', default=[forecast_engine])
+    parser.add_argument("-c", "--config", type=json.loads, action='append')
+    parser.add_argument("-m", "--skip_memory", action='store_true')
+    parser.add_argument("-o", "--output", type=str)
+
+    args = parser.parse_args()
+
+    presents = backtest_presents(args.start, args.end or args.start, timedelta(days=args.step_days))
+
+    start = time.perf_counter()
+    histories = {
+        basket_id: evaluate_backtest_history(basket_id, presents, max(args.num_history_days), args.num_predicted_days)
+        for basket_id in args.basket
+    }
+    history_seconds = time.perf_counter() - start
+
+    configurations = []
+    for engine, num_history_days, overrides in itertools.product(args.engine, args.num_history_days, args.config or [{}]):
+        config = {**get_forecaster(engine).config(num_history_days), **overrides}
+
+        # Progress goes to stderr, so that the report printed to stdout stays valid JSON
+        print(f"Backtesting {config} on {num_history_days} day(s) of history...", file=sys.stderr, flush=True)
+
+        configurations.append(backtest_configuration(config, num_history_days, args.num_predicted_days, histories, presents, not args.skip_memory))
+
+    report = json.dumps({
+        'baskets': args.basket,
+        'presents': [present.isoformat() for present in presents],
+        'num_predicted_days': args.num_predicted_days,
+        'history_seconds': history_seconds,
+        'memory_method': None if args.skip_memory else MEMORY_METHOD,
+        'configurations': configurations,
+    }, indent=4)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+from occupation_forecast import (
+    fit_occupation_forecast,
+    forecast_cache,
+    forecast_cache_key,
+    forecast_model_config,
+    forecast_store_dir,
+    interpolate_forecast,
+    store_forecast,
+    truncate_present,
+)
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+import multiprocessing
+import logging
+import os
+import threading
+import uuid
+from time import monotonic
+
+
+logger = logging.getLogger("forecast_jobs")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# The number of processes fitting forecasts in parallel
+forecast_job_workers = int(os.environ.get('FORECAST_JOB_WORKERS', 0)) or os.cpu_count() or 1
+
+# The maximum number of jobs waiting for or being fitted at once. Further submissions are rejected
+forecast_job_max_pending = int(os.environ.get('FORECAST_JOB_MAX_PENDING', 64))
+
+# The number of seconds the result of a job is kept after it has finished
+forecast_job_result_ttl = float(os.environ.get('FORECAST_JOB_RESULT_TTL', 60 * 10))
+
+
+class TooManyJobsError(Exception):
+    pass
+
+
+def fit_forecast_job(basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, engine: str = None):
+    """
+    Fit a forecast in a worker process. The forecast is persisted from the worker itself and its model is detached,
+    so that it can be sent back to the webservice.
+    """
+
+    forecast = fit_occupation_forecast(basket_id, present, num_history_days, num_predicted_days, engine=engine)
+
+    if forecast_store_dir:
+        store_forecast(forecast)
+
+    forecast.detach_model()
+
+    return forecast
+
+
+class ForecastJob:
+    id: str
+    basket_id: int
+    present: datetime
+    num_history_days: int
+    num_predicted_days: int
+    t: np.ndarray  # The instants the forecast is interpolated at, or `None` for the whole horizon
+    resolution: timedelta
+
+    future: Future  # Resolves to the `OccupationForecast`
+    finished_at: float
+
+    def __init__(self, basket_id, present, num_history_days, num_predicted_days, t, resolution, future):
+        self.id = uuid.uuid4().hex
+        self.basket_id = basket_id
+        self.present = present
+        self.num_history_days = num_history_days
+        self.num_predicted_days = num_predicted_days
+        self.t = t
+        self.resolution = resolution
+        self.future = future
+        self.finished_at = None
+
+    @property
+    def status(self):
+        if not self.future.done():
+            return 'running' if self.future.running() else 'pending'
+        return 'failed' if self.future.exception() is not None else 'done'
+
+    def result(self):
+        """
+        Returns:
+            A 2d-tuple containing the `datetime64` array of the forecasted instants and the array of their forecasted
+            occupation.
+        """
+
+        forecast = self.future.result()
+
+        if self.t is not None:
+            t = self.t
+        elif len(forecast.t) > 0:
+            t = np.arange(forecast.t[0], forecast.t[-1] + np.timedelta64(1, 'ns'), np.timedelta64(self.resolution))
+        else:
+            t = forecast.t
+
+        return t, interpolate_forecast(forecast.t, forecast.occupation, t)
+
+
+class ForecastJobs:
+    """
+    Forecasts fitted in the background by a pool of `forecast_job_workers` processes, so that fitting doesn't hold
+    the threads serving the requests. Fitted forecasts are added to the `forecast_cache`.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._fitting = {}  # cache key -> future of the job fitting the forecast
+        self._executor = None
+
+    def submit(self, basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, t=None, resolution: timedelta = timedelta(minutes=30), engine: str = None):
+        """
+        Start forecasting the occupation of a basket, either at the instants `t` or over the whole horizon every
+        `resolution`, with the `engine` forecaster (defaults to `FORECAST_ENGINE`).
+
+        Raises:
+            `TooManyJobsError` if `forecast_job_max_pending` jobs are already pending.
+
+        Returns:
+            The submitted `ForecastJob`.
+        """
+
+        present = truncate_present(present)
+        key = forecast_cache_key(basket_id, present, num_history_days, num_predicted_days, forecast_model_config(num_history_days, engine))
+
+        with self._lock:
+            self._purge()
+
+            forecast = forecast_cache.get(key)
+            fitting = forecast is None and key not in self._fitting
+
+            if forecast is not None:
+                future = Future()
+                future.set_result(forecast)
+            elif not fitting:
+                # Share the fit of the job already fitting the same forecast
+                future = self._fitting[key]
+            else:
+                # Jobs sharing a fit count once
+                num_pending = len({job.future for job in self._jobs.values() if not job.future.done()})
+                if num_pending >= forecast_job_max_pending:
+                    raise TooManyJobsError(f"{num_pending} forecast jobs are already pending")
+
+                fit_args = (fit_forecast_job, basket_id, present, num_history_days, num_predicted_days, engine)
+
+                try:
+                    future = self._get_executor().submit(*fit_args)
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed when out of memory), which breaks the whole pool: start a new one
+                    logger.warning("The forecast job workers died, restarting them")
+                    self._reset_executor()
+                    future = self._get_executor().submit(*fit_args)
+
+                self._fitting[key] = future
+
+            job = ForecastJob(basket_id, present, num_history_days, num_predicted_days, t, resolution, future)
+            self._jobs[job.id] = job
+
+        future.add_done_callback(lambda future: self._on_done(job, key if fitting else None))
+
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            self._purge()
+            return self._jobs.get(job_id)
+
+    def stats(self):
+        with self._lock:
+            statuses = [job.status for job in self._jobs.values()]
+
+        return {
+            'workers': forecast_job_workers,
+            **{status: statuses.count(status) for status in ('pending', 'running', 'done', 'failed')},
+        }
+
+    def _on_done(self, job: ForecastJob, key):
+        job.finished_at = monotonic()
+
+        if job.future.exception() is not None:
+            logger.warning(f"Forecast job {job.id} for basket {job.basket_id} failed: {job.future.exception()}")
+        elif key is not None:
+            forecast_cache.put(key, job.future.result())
+
+        # Once cached, the forecast is served from the cache rather than from the job that fitted it. The key may
+        # already be fitted by another job if the pool of this one broke
+        if key is not None:
+            with self._lock:
+                if self._fitting.get(key) is job.future:
+                    del self._fitting[key]
+
+    def _purge(self):
+        now = monotonic()
+
+        for job_id in [
+            job.id for job in self._jobs.values()
+            if job.finished_at is not None and now - job.finished_at > forecast_job_result_ttl
+        ]:
+            del self._jobs[job_id]
+
+    def _get_executor(self):
+        # Workers are spawned rather than forked, so that they don't inherit the threads and DB connections of the
+        # webservice
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=forecast_job_workers,
+                mp_context=multiprocessing.get_context('spawn'),
+            )
+
+        return self._executor
+
+    def _reset_executor(self):
+        # The jobs of the broken pool fail with `BrokenProcessPool`, the forecasts they were fitting have to be
+        # fitted again by the new one
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = None
+        self._fitting.clear()
+
+
+forecast_jobs = ForecastJobs()
@@ -0,0 +1,137 @@
+from occupation_forecast import fit_occupation_forecast, truncate_present
+from forecast_table import ensure_forecast_table_schema, write_precomputed_forecast
+from measurements import fetch_basket_ids
+from db import create_db_connection
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+
+
+def precompute_forecast(basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int):
+    """
+    Fit the forecast of a basket and store it in the `occupation_forecast` table. Runs in a worker process: errors are
+    returned rather than raised, so that a failing basket doesn't affect the others.
+
+    Returns:
+        A 3d-tuple containing the `basket_id`, the seconds spent and the error message if the forecast failed.
+    """
+
+    start = time.monotonic()
+
+    try:
+        # The precomputed forecasts are served in place of the Prophet ones only
+        forecast = fit_occupation_forecast(basket_id, present, num_history_days, num_predicted_days, engine='prophet')
+
+        write_precomputed_forecast(
+            basket_id,
+            present,
+            num_history_days,
+            num_predicted_days,
+            forecast.t,
+            forecast.occupation,
+            forecast.fit_time,
+        )
+
+        return basket_id, time.monotonic() - start, None
+
+    except Exception:
+        return basket_id, time.monotonic() - start, traceback.format_exc()
+
+
+def precompute_forecasts(basket_ids, present: datetime, num_history_days: int, num_predicted_days: int, num_workers: int):
+    """
+    Precompute the forecast of every basket in `basket_ids`, fitting `num_workers` of them in parallel.
+
+    A basket is only submitted once a worker is free, so that if a worker process dies (e.g. killed when out of
+    memory) only the baskets being fitted fail: the pool is started again for the others.
+
+    Returns:
+        The list of the baskets whose forecast failed.
+    """
+
+    failed_basket_ids = []
+    pending = list(basket_ids)
+    num_finished = 0
+
+    while pending:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            running = {}
+            broken = False
+
+            while pending or running:
+                # Once the pool is broken, all the baskets being fitted fail and no other basket is submitted to it
+                while pending and len(running) < num_workers and not broken:
+                    try:
+                        running[executor.submit(precompute_forecast, pending[0], present, num_history_days, num_predicted_days)] = pending[0]
+                        pending.pop(0)
+                    except BrokenProcessPool:
+                        broken = True
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    basket_id = running.pop(future)
+                    num_finished += 1
+
+                    try:
+                        _, elapsed, error = future.result()
+                    except BrokenProcessPool as e:
+                        elapsed, error = None, f"The worker process died: {e}"
+                        broken = True
+
+                    if error is None:
+                        print(f"[{num_finished}/{len(basket_ids)}] Forecasted basket {basket_id} in {elapsed:.1f}s")
+                    else:
+                        print(f"[{num_finished}/{len(basket_ids)}] Couldn't forecast basket {basket_id}:\n{error}")
+                        failed_basket_ids.append(basket_id)
+
+            if broken and pending:
+                print(f"Restarting the workers for the {len(pending)} remaining basket(s)...")
+
+    return failed_basket_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-b", "--basket", type=int, action='append')
+    parser.add_argument("-p", "--present", type=datetime.fromisoformat)
+    parser.add_argument("-np", "--num_history_days", type=int, default=90)
+    parser.add_argument("-nf", "--num_predicted_days", type=int, default=14)
+    parser.add_argument("-a", "--active_days", type=int, default=30)
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count() or 1)
+
+    args = parser.parse_args()
+
+    present = truncate_present(args.present or datetime.utcnow())
+
+    db_connection = create_db_connection()
+    try:
+        ensure_forecast_table_schema(db_connection)
+
+        # Only the baskets that sent measurements recently are worth forecasting
+        basket_ids = args.basket or fetch_basket_ids(present - timedelta(days=args.active_days))
+    finally:
+        db_connection.close()
+
+    print(f"Forecasting {len(basket_ids)} basket(s) from {present} with {args.workers} worker(s)...")
+
+    start = time.monotonic()
+    failed_basket_ids = precompute_forecasts(basket_ids, present, args.num_history_days, args.num_predicted_days, args.workers)
+
+    print(f"Forecasted {len(basket_ids) - len(failed_basket_ids)}/{len(basket_ids)} basket(s) in {time.monotonic() - start:.1f}s")
+
+    if failed_basket_ids:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
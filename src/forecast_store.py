@@ -0,0 +1,154 @@
+import numpy as np
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+logger = logging.getLogger("forecast_store")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# The version of the on-disk layout of a stored forecast. Entries written with a different version are ignored
+FORMAT_VERSION = 1
+
+META_FILE = 'meta.json'
+CURVE_FILE = 'curve.npz'
+MODEL_FILE = 'model.json'
+
+
+def forecast_dir(store_dir: str, basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, config: dict):
+    """
+    Returns:
+        The directory the forecast identified by the given parameters is stored in.
+    """
+
+    digest = hashlib.sha1(json.dumps(
+        [present.isoformat(), num_history_days, num_predicted_days, config],
+        sort_keys=True,
+    ).encode()).hexdigest()
+
+    return os.path.join(store_dir, str(basket_id), digest)
+
+
+def save_forecast(store_dir: str, meta: dict, t: np.ndarray, occupation: np.ndarray, model_json: str):
+    """
+    Write a fitted forecast to the store, replacing any previous version of it.
+
+    Parameters:
+        - `store_dir`: The root directory of the store.
+        - `meta`: The metadata of the forecast: `basket_id`, `present`, `num_history_days`, `num_predicted_days`,
+            `config`, `fit_time` and `data_watermark` (`datetime(s)` are serialized as ISO 8601 strings).
+        - `t`: The `datetime64` array of the predicted time samples.
+        - `occupation`: The predicted occupation at the time samples.
+        - `model_json`: The fitted model serialized as JSON.
+    """
+
+    target_dir = forecast_dir(
+        store_dir,
+        meta['basket_id'],
+        meta['present'],
+        meta['num_history_days'],
+        meta['num_predicted_days'],
+        meta['config'],
+    )
+    os.makedirs(os.path.dirname(target_dir), exist_ok=True)
+
+    # Write everything in a temporary directory first and then move it in place, so that readers never see a
+    # partially written forecast
+    tmp_dir = tempfile.mkdtemp(dir=os.path.dirname(target_dir), prefix='.tmp-')
+    try:
+        with open(os.path.join(tmp_dir, META_FILE), 'w') as f:
+            json.dump({
+                'format_version': FORMAT_VERSION,
+                **{key: value.isoformat() if isinstance(value, datetime) else value for key, value in meta.items()},
+            }, f)
+
+        np.savez(
+            os.path.join(tmp_dir, CURVE_FILE),
+            t=t.astype('datetime64[ns]').astype(np.int64),
+            occupation=occupation.astype(np.float64),
+        )
+
+        with open(os.path.join(tmp_dir, MODEL_FILE), 'w') as f:
+            f.write(model_json)
+
+        if os.path.exists(target_dir):
+            shutil.rmtree(target_dir)
+        os.rename(tmp_dir, target_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    logger.debug(f"Stored the forecast for basket {meta['basket_id']} in {target_dir}")
+
+
+def load_forecasts(store_dir: str, max_age: float = None, retention: float = None):
+    """
+    Read the forecasts held by the store, skipping the ones older than `max_age` seconds and deleting the ones older
+    than `retention` seconds.
+
+    Parameters:
+        - `store_dir`: The root directory of the store.
+        - `max_age`: The maximum number of seconds elapsed since a forecast has been fitted for it to be loaded.
+        - `retention`: The number of seconds after which a forecast is deleted from the store, never if `None`.
+
+    Returns:
+        A generator of `(meta, t, occupation, load_model_json, model_json_nbytes)` tuples, where `meta` holds the
+        metadata given to `save_forecast` (with `datetime(s)` parsed back), `t` and `occupation` are the predicted
+        curve, `load_model_json` is a function reading the serialized model on demand and `model_json_nbytes` is the
+        size of the serialized model.
+    """
+
+    if not os.path.isdir(store_dir):
+        return
+
+    now = datetime.utcnow()
+
+    for basket_dir in os.scandir(store_dir):
+        if not basket_dir.is_dir():
+            continue
+
+        for entry_dir in os.scandir(basket_dir.path):
+            if not entry_dir.is_dir() or entry_dir.name.startswith('.'):
+                continue
+
+            try:
+                with open(os.path.join(entry_dir.path, META_FILE)) as f:
+                    meta = json.load(f)
+
+                if meta.pop('format_version', None) != FORMAT_VERSION:
+                    logger.info(f"Skipping the stored forecast {entry_dir.path} written with a different format")
+                    continue
+
+                for key in ('present', 'fit_time', 'data_watermark'):
+                    if meta.get(key) is not None:
+                        meta[key] = datetime.fromisoformat(meta[key])
+
+                age = (now - meta['fit_time']).total_seconds()
+
+                if retention is not None and age > retention:
+                    shutil.rmtree(entry_dir.path, ignore_errors=True)
+                    continue
+
+                if max_age is not None and age > max_age:
+                    continue
+
+                with np.load(os.path.join(entry_dir.path, CURVE_FILE)) as curve:
+                    t = curve['t'].astype('datetime64[ns]')
+                    occupation = curve['occupation']
+
+                model_json_nbytes = os.path.getsize(os.path.join(entry_dir.path, MODEL_FILE))
+
+            except Exception as e:
+                logger.warning(f"Skipping the unreadable stored forecast {entry_dir.path}: {e}")
+                continue
+
+            def load_model_json(path=os.path.join(entry_dir.path, MODEL_FILE)):
+                with open(path) as f:
+                    return f.read()
+
+            yield meta, t, occupation, load_model_json, model_json_nbytes
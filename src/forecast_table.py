@@ -0,0 +1,165 @@
+from db import create_db_connection
+from measurements import measurement_store_kind, FETCH_BATCH_SIZE
+import numpy as np
+from datetime import datetime, timedelta
+import logging
+import os
+
+
+logger = logging.getLogger("forecast_table")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# Whether the forecasts precomputed by `forecast_precompute` are served instead of fitting a model
+precomputed_forecast_enabled = os.environ.get('PRECOMPUTED_FORECAST_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# The precomputed forecasts table lives in the MySQL DB, next to the measurements
+if precomputed_forecast_enabled and measurement_store_kind != 'mysql':
+    logger.warning(f"Precomputed forecasts are only available with the mysql measurement store, not {measurement_store_kind}: disabling them")
+    precomputed_forecast_enabled = False
+
+# The maximum number of seconds between the `present` a forecast has been precomputed for and the one it's served for
+precomputed_forecast_max_age = float(os.environ.get('PRECOMPUTED_FORECAST_MAX_AGE', 60 * 60 * 24))
+
+
+def ensure_forecast_table_schema(db_connection):
+    db_cursor = db_connection.cursor()
+
+    db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS occupation_forecast (
+            basket_id BIGINT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            occupation DOUBLE NOT NULL,
+            PRIMARY KEY (basket_id, timestamp)
+        )
+    """)
+
+    # The parameters of the latest forecast precomputed for every basket
+    db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS occupation_forecast_run (
+            basket_id BIGINT NOT NULL PRIMARY KEY,
+            present DATETIME NOT NULL,
+            num_history_days INT NOT NULL,
+            num_predicted_days INT NOT NULL,
+            fit_time DATETIME NOT NULL
+        )
+    """)
+
+    db_cursor.close()
+    db_connection.commit()
+
+
+def write_precomputed_forecast(basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, t: np.ndarray, occupation: np.ndarray, fit_time: datetime, db_connection=None):
+    """
+    Replace the precomputed forecast of a basket with the given one, in a single transaction.
+
+    Parameters:
+        - `basket_id`: The ID of the basket.
+        - `present`: The date from which the forecast has been performed.
+        - `num_history_days`: The number of days prior the `present` date the model has been fitted on.
+        - `num_predicted_days`: The number of days past the `present` date predicted.
+        - `t`: The `datetime64` array of the predicted time samples.
+        - `occupation`: The predicted occupation at the time samples.
+        - `fit_time`: When the model has been fitted.
+    """
+
+    own_connection = db_connection is None
+    if own_connection:
+        db_connection = create_db_connection()
+
+    try:
+        db_cursor = db_connection.cursor()
+
+        db_cursor.execute("DELETE FROM occupation_forecast WHERE basket_id = %s", (basket_id,))
+
+        db_cursor.executemany("""
+            INSERT INTO occupation_forecast
+                (basket_id, timestamp, occupation)
+            VALUES
+                (%s, %s, %s)
+        """, list(zip(
+            [basket_id] * len(t),
+            t.astype('datetime64[us]').tolist(),
+            np.clip(occupation, 0, 1).tolist(),
+        )))
+
+        db_cursor.execute("""
+            INSERT INTO occupation_forecast_run
+                (basket_id, present, num_history_days, num_predicted_days, fit_time)
+            VALUES
+                (%s, %s, %s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                present = VALUES(present),
+                num_history_days = VALUES(num_history_days),
+                num_predicted_days = VALUES(num_predicted_days),
+                fit_time = VALUES(fit_time)
+        """, (basket_id, present, num_history_days, num_predicted_days, fit_time,))
+
+        db_cursor.close()
+        db_connection.commit()
+
+    finally:
+        if own_connection:
+            db_connection.close()
+
+
+def fetch_precomputed_forecast(basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, db_connection=None):
+    """
+    Fetch the precomputed forecast of a basket, if it has been fitted on `num_history_days` days before a `present`
+    at most `PRECOMPUTED_FORECAST_MAX_AGE` seconds older than the given one, and covers the `num_predicted_days`
+    after the given `present`.
+
+    Returns:
+        `None` if there's no such forecast, otherwise a 2d-tuple containing the `datetime64` array of the predicted time
+        samples after `present` and the array of their predicted occupation.
+    """
+
+    own_connection = db_connection is None
+    if own_connection:
+        db_connection = create_db_connection()
+
+    try:
+        db_cursor = db_connection.cursor()
+
+        db_cursor.execute("""
+            SELECT present, num_predicted_days FROM occupation_forecast_run
+            WHERE
+                basket_id = %s AND
+                num_history_days = %s AND
+                present BETWEEN %s AND %s
+        """, (basket_id, num_history_days, present - timedelta(seconds=precomputed_forecast_max_age), present,))
+        run = db_cursor.fetchone()
+
+        if run is None or run[0] + timedelta(days=run[1]) < present + timedelta(days=num_predicted_days):
+            db_cursor.close()
+            return None
+
+        db_cursor.execute("""
+            SELECT CAST(UNIX_TIMESTAMP(timestamp) * 1000000 AS SIGNED), occupation FROM occupation_forecast
+            WHERE
+                basket_id = %s AND
+                timestamp > %s AND
+                timestamp <= %s
+            ORDER BY
+                timestamp ASC
+        """, (basket_id, present, present + timedelta(days=num_predicted_days),))
+
+        batches = []
+        while True:
+            rows = db_cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            batches.append(np.array(rows, dtype=np.float64))
+
+        db_cursor.close()
+
+    finally:
+        if own_connection:
+            db_connection.close()
+
+    if not batches:
+        return None
+
+    rows = np.concatenate(batches)
+
+    return (rows[:, 0].astype(np.int64) * 1000).astype('datetime64[ns]'), rows[:, 1]
@@ -0,0 +1,138 @@
+from measurements import fetch_measurements, MEASUREMENT_SOURCES
+from occupation import evaluate_occupation_from_measurements, to_datetime, OCCUPATION_WINDOW
+import numpy as np
+from bisect import insort
+from collections import Counter, deque
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger("live_occupation")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# Whether the current occupation is served from the measurements kept in memory. This is only correct if every
+# measurement is ingested through this process
+live_occupation_enabled = os.environ.get('LIVE_OCCUPATION_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+OCCUPATION_WINDOW_NS = OCCUPATION_WINDOW * 1_000_000_000
+
+
+class LiveOccupation:
+    """
+    The measurements of the last `OCCUPATION_WINDOW` seconds of every basket, kept in memory so that the current
+    occupation can be evaluated without querying the DB.
+
+    The window of a basket is loaded from the DB the first time its occupation is requested; from then on it's kept
+    up to date by `add_measurements`. The measurements added while the window is being loaded are buffered and
+    merged into it once loaded, since the DB may have been read before they were committed.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._windows = {}  # basket_id -> {source -> deque of sorted instants in nanoseconds}
+        self._loading = {}  # basket_id -> list of (source, instant in nanoseconds) added while loading the window
+
+    def add_measurements(self, basket_id: int, source: str, t_ns):
+        """
+        Add the measurements of a source happened at the instants `t_ns` (nanoseconds since the UNIX epoch) to the
+        window of a basket. Baskets whose window isn't loaded nor being loaded are ignored, since their measurements
+        will be read from the DB when needed.
+        """
+
+        with self._lock:
+            window = self._windows.get(basket_id)
+            if window is None:
+                if basket_id in self._loading:
+                    self._loading[basket_id].extend((source, int(t)) for t in t_ns)
+                return
+
+            self._insert(window[source], t_ns)
+
+    def evaluate(self, basket_id: int, now_ns: int):
+        """
+        Returns:
+            The occupation of a basket at the instant `now_ns`, expressed as nanoseconds since the UNIX epoch.
+        """
+
+        with self._lock:
+            window = self._windows.get(basket_id)
+
+        if window is None:
+            window = self._load_window(basket_id, now_ns)
+
+        with self._lock:
+            measurements = {}
+            for source, source_window in window.items():
+                # Measurements can't contribute to the occupation anymore once they're older than the window
+                while source_window and source_window[0] < now_ns - OCCUPATION_WINDOW_NS:
+                    source_window.popleft()
+                measurements[source] = np.fromiter(source_window, dtype=np.int64, count=len(source_window))
+
+            if all(len(source_window) == 0 for source_window in window.values()):
+                # Forget about idle baskets, their window will be loaded again if needed
+                self._windows.pop(basket_id, None)
+
+        # Measurements ingested after `now_ns` don't count
+        measurements = {
+            source: measurement_ns[:np.searchsorted(measurement_ns, now_ns, side='right')]
+            for source, measurement_ns in measurements.items()
+        }
+
+        return evaluate_occupation_from_measurements(np.array([now_ns], dtype=np.int64), measurements)[0]
+
+    def _load_window(self, basket_id: int, now_ns: int):
+        logger.debug(f"Loading the measurements window of basket {basket_id}")
+
+        with self._lock:
+            # Another request may have loaded it meanwhile
+            window = self._windows.get(basket_id)
+            if window is not None:
+                return window
+
+            # Buffer the measurements added from now on, the DB read below may or may not see them
+            self._loading.setdefault(basket_id, [])
+
+        measurements = fetch_measurements(
+            basket_id,
+            to_datetime(now_ns - OCCUPATION_WINDOW_NS),
+            to_datetime(now_ns + OCCUPATION_WINDOW_NS),
+        )
+
+        with self._lock:
+            window = self._windows.get(basket_id)
+            if window is not None:
+                return window
+
+            window = {source: deque(measurements[source].tolist()) for source in MEASUREMENT_SOURCES}
+
+            # Merge the buffered measurements the DB read didn't see: every buffered instant already read counts once
+            read = {source: Counter(source_window) for source, source_window in window.items()}
+            for source, t in self._loading.pop(basket_id, []):
+                if read[source][t] > 0:
+                    read[source][t] -= 1
+                else:
+                    self._insert(window[source], [t])
+
+            self._windows[basket_id] = window
+
+            return window
+
+    @staticmethod
+    def _insert(source_window: deque, t_ns):
+        for t in sorted(int(t) for t in t_ns):
+            if not source_window or source_window[-1] <= t:
+                source_window.append(t)
+            else:
+                insort(source_window, t)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'baskets': len(self._windows),
+                'measurements': sum(len(w) for window in self._windows.values() for w in window.values()),
+            }
+
+
+live_occupation = LiveOccupation()
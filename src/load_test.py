@@ -0,0 +1,230 @@
+import numpy as np
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+import argparse
+import http.client
+import itertools
+import json
+import threading
+import time
+
+
+MOCK_BASKET_ID = 0x23232323
+
+ENDPOINTS = ('occupation', 'forecast_occupation')
+
+
+class RequestGenerator:
+    """
+    Draws the requests sent by the load test: the endpoint, the basket (following a Zipf distribution over the
+    given baskets, so that a few of them are hot) and the instant, uniformly distributed over the given range and
+    optionally snapped to a grid like dashboards do.
+    """
+
+    def __init__(self, args):
+        self.args = args
+
+        self._lock = threading.Lock()
+        self._rng = np.random.default_rng(args.seed)
+
+        ranks = np.arange(1, len(args.basket) + 1, dtype=np.float64)
+        weights = 1 / ranks ** args.zipf
+        self._basket_p = weights / np.sum(weights)
+
+    def draw(self):
+        """
+        Returns:
+            A 2d-tuple containing the name of the endpoint and the path of the request.
+        """
+
+        args = self.args
+
+        with self._lock:
+            endpoint = args.endpoint[self._rng.integers(len(args.endpoint))]
+            basket_id = args.basket[self._rng.choice(len(args.basket), p=self._basket_p)]
+            u = self._rng.random()
+
+        if endpoint == 'occupation':
+            t = self._instant(args.from_date, args.to_date, u)
+            return endpoint, "/api/occupation?" + urlencode({'basket': basket_id, 't': t.isoformat()})
+
+        present = args.present
+        t = self._instant(present, present + timedelta(days=args.num_predicted_days), u)
+        return endpoint, "/api/forecast_occupation?" + urlencode({
+            'basket': basket_id,
+            't': t.isoformat(),
+            'present': present.isoformat(),
+            'num_history_days': args.num_history_days,
+            'num_predicted_days': args.num_predicted_days,
+        })
+
+    def _instant(self, t_from: datetime, t_to: datetime, u: float) -> datetime:
+        t = t_from + (t_to - t_from) * u
+
+        if self.args.t_resolution > 0:
+            resolution = timedelta(minutes=self.args.t_resolution)
+            t = t_from + (t - t_from) // resolution * resolution
+
+        return t
+
+
+def run_worker(base_url, generator: RequestGenerator, schedule, deadline: float, timeout: float, results: list):
+    """
+    Send requests until the `deadline`, one at a time over a keep-alive connection, each one not before its slot of
+    the `schedule`.
+    """
+
+    url = urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=timeout)
+
+    try:
+        while True:
+            scheduled = schedule()
+            if scheduled is None or scheduled >= deadline:
+                break
+
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            endpoint, path = generator.draw()
+
+            start = time.perf_counter()
+            try:
+                connection.request('GET', path)
+                response = connection.getresponse()
+                response.read()
+                status = response.status
+            except Exception as e:
+                connection.close()
+                status = type(e).__name__
+            end = time.perf_counter()
+
+            # The latency from the scheduled instant also counts the time the request waited for a free worker, so
+            # that a slow server doesn't hide its queueing by slowing down the load
+            results.append((endpoint, status, end - start, end - scheduled))
+
+    finally:
+        connection.close()
+
+
+def summarize(results, elapsed: float):
+    """
+    Returns:
+        A dict holding the throughput, the error rate and the latency percentiles of the given results.
+    """
+
+    latencies = np.array([result[2] for result in results]) * 1000
+    scheduled_latencies = np.array([result[3] for result in results]) * 1000
+
+    statuses = {}
+    for result in results:
+        statuses[str(result[1])] = statuses.get(str(result[1]), 0) + 1
+
+    num_errors = sum(1 for result in results if not (isinstance(result[1], int) and 200 <= result[1] < 400))
+
+    def percentiles(values):
+        if len(values) == 0:
+            return None
+        return {
+            'mean': float(np.mean(values)),
+            'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)),
+            'p99': float(np.percentile(values, 99)),
+            'max': float(np.max(values)),
+        }
+
+    return {
+        'requests': len(results),
+        'throughput_rps': len(results) / elapsed if elapsed > 0 else 0.,
+        'errors': num_errors,
+        'error_rate': num_errors / len(results) if results else 0.,
+        'statuses': statuses,
+        'latency_ms': percentiles(latencies),
+        'latency_from_schedule_ms': percentiles(scheduled_latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-u", "--url", type=str, default='http://localhost:5000')
+    parser.add_argument("-e", "--endpoint", choices=ENDPOINTS, action='append')
+    parser.add_argument("-c", "--concurrency", type=int, default=10)
+    parser.add_argument("-r", "--rate", type=float, default=0)
+    parser.add_argument("-d", "--duration", type=float, default=30)
+    parser.add_argument("-b", "--basket", type=int, action='append')
+    parser.add_argument("-z", "--zipf", type=float, default=0)
+    parser.add_argument("-f", "--from_date", type=datetime.fromisoformat, default=datetime(2016, 8, 1))
+    parser.add_argument("-t", "--to_date", type=datetime.fromisoformat, default=datetime(2016, 8, 15))
+    parser.add_argument("--t_resolution", type=int, default=0)
+    parser.add_argument("-p", "--present", type=datetime.fromisoformat, default=datetime(2016, 8, 1))
+    parser.add_argument("-np", "--num_history_days", type=int, default=90)
+    parser.add_argument("-nf", "--num_predicted_days", type=int, default=14)
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("-s", "--seed", type=int)
+    parser.add_argument("-o", "--output", type=str)
+
+    args = parser.parse_args()
+
+    args.endpoint = args.endpoint or ['occupation']
+    args.basket = args.basket or [MOCK_BASKET_ID]
+
+    generator = RequestGenerator(args)
+
+    start = time.perf_counter()
+    deadline = start + args.duration
+
+    # With a rate, request `i` is due at `start + i / rate` whatever the latency of the previous ones (open loop);
+    # otherwise every worker sends its next request as soon as the previous one is answered (closed loop)
+    counter = itertools.count()
+    counter_lock = threading.Lock()
+
+    def schedule():
+        if args.rate <= 0:
+            return time.perf_counter()
+        with counter_lock:
+            return start + next(counter) / args.rate
+
+    results_by_worker = [[] for _ in range(args.concurrency)]
+    workers = [
+        threading.Thread(target=run_worker, args=(args.url, generator, schedule, deadline, args.timeout, results), daemon=True)
+        for results in results_by_worker
+    ]
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    elapsed = time.perf_counter() - start
+    results = [result for results in results_by_worker for result in results]
+
+    report = json.dumps({
+        'config': {
+            'url': args.url,
+            'endpoints': args.endpoint,
+            'concurrency': args.concurrency,
+            'rate': args.rate,
+            'duration': args.duration,
+            'baskets': args.basket,
+            'zipf': args.zipf,
+            't_resolution': args.t_resolution,
+        },
+        'elapsed_seconds': elapsed,
+        **summarize(results, elapsed),
+        'endpoints': {
+            endpoint: summarize([result for result in results if result[0] == endpoint], elapsed)
+            for endpoint in args.endpoint
+        },
+    }, indent=4)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
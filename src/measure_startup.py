@@ -0,0 +1,78 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+
+# The modules that are expected to be imported only when forecasting or plotting
+HEAVY_MODULES = ('prophet', 'pandas', 'matplotlib', 'cmdstanpy')
+
+MEASURE_SCRIPT = """
+import json, sys, time
+
+start = time.perf_counter()
+import {module}
+import_time = time.perf_counter() - start
+
+heavy_modules = [module for module in {heavy_modules!r} if module in sys.modules]
+
+start = time.perf_counter()
+import occupation_forecast
+occupation_forecast.warm_up()
+forecast_import_time = time.perf_counter() - start
+
+print(json.dumps({{
+    'module': {module!r},
+    'import_seconds': import_time,
+    'imported_modules': len(sys.modules),
+    'heavy_modules_at_startup': heavy_modules,
+    'forecast_import_seconds': forecast_import_time,
+}}))
+"""
+
+
+def measure_startup(module: str):
+    """
+    Import `module` in a fresh interpreter and measure how long it takes and which heavy modules it pulls in, then
+    measure how long importing the forecasting modules takes on top of it.
+
+    Returns:
+        A dict holding the measurements.
+    """
+
+    src_dir = os.path.dirname(os.path.abspath(__file__))
+
+    output = subprocess.run(
+        [sys.executable, '-c', MEASURE_SCRIPT.format(module=module, heavy_modules=HEAVY_MODULES)],
+        cwd=src_dir,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-m", "--module", type=str, default='webservice')
+    parser.add_argument("-n", "--runs", type=int, default=3)
+
+    args = parser.parse_args()
+
+    runs = [measure_startup(args.module) for _ in range(args.runs)]
+
+    print(json.dumps({
+        'module': args.module,
+        'runs': args.runs,
+        'min_import_seconds': min(run['import_seconds'] for run in runs),
+        'min_forecast_import_seconds': min(run['forecast_import_seconds'] for run in runs),
+        'imported_modules': runs[-1]['imported_modules'],
+        'heavy_modules_at_startup': runs[-1]['heavy_modules_at_startup'],
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,590 @@
+from event_archive import EventArchive, event_archive_dir
+import numpy as np
+from datetime import datetime
+import logging
+import os
+import sqlite3
+import threading
+
+
+logger = logging.getLogger("measurements")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# The tables the measurements sent by the Basket are stored in. The index of a table is the tag its rows are
+# identified with in the result of the combined query
+MEASUREMENT_SOURCES = (
+    'accelerometer_data',
+    'score_data',
+    'people_detected_data',
+)
+
+# The columns, other than `basket_id` and `timestamp`, every measurement source is stored with
+MEASUREMENT_COLUMNS = {
+    'accelerometer_data': ('accel_x', 'accel_y', 'accel_z', 'gyro_x', 'gyro_y', 'gyro_z', 'temperature'),
+    'score_data': (),
+    'people_detected_data': (),
+}
+
+# The number of rows fetched from the DB at once while converting the query result to arrays
+FETCH_BATCH_SIZE = 16 * 1024
+
+# The number of rows written at once by `bulk_insert_measurements`
+BULK_INSERT_BATCH_SIZE = 4 * 1024
+
+# Where the measurements are stored: `mysql` (the DB configured by `DB_*`) or `sqlite` (the embedded DB file at
+# `MEASUREMENT_STORE_PATH`, which doesn't need a DB server)
+measurement_store_kind = os.environ.get('MEASUREMENT_STORE', 'mysql')
+measurement_store_path = os.environ.get('MEASUREMENT_STORE_PATH', 'measurements.sqlite3')
+
+
+def to_epoch_us(t: datetime) -> int:
+    return int(np.datetime64(t, 'us').astype(np.int64))
+
+
+class MeasurementStore:
+    """
+    Where the measurements sent by the baskets are stored.
+
+    Every method takes an optional `db_connection`, obtained from `connect()`, so that many operations can share a
+    transaction. If not given, a new connection is opened and closed once done; when writing, it's also committed.
+    Otherwise committing is up to the caller.
+    """
+
+    # The placeholder of a positional parameter and the formatter of a named one
+    placeholder: str
+    named_placeholder: str
+
+    # The placeholder of a timestamp given as integer microseconds since the UNIX epoch
+    timestamp_us_placeholder: str
+
+    def connect(self):
+        """
+        Returns:
+            A DB-API connection to the store. Closing it is up to the caller.
+        """
+
+        raise NotImplementedError
+
+    def timestamp_us(self, column: str) -> str:
+        """
+        Returns:
+            The SQL expression of the `column` timestamp as integer microseconds since the UNIX epoch, so that the
+            driver doesn't have to build a `datetime` per row.
+        """
+
+        raise NotImplementedError
+
+    def timestamp_param(self, t: datetime):
+        """
+        Returns:
+            The query parameter the `t` timestamp is compared with or stored as.
+        """
+
+        raise NotImplementedError
+
+    def fetch_measurements_for_baskets(self, basket_ids, t_from: datetime, t_to: datetime, db_connection=None):
+        """
+        See `fetch_measurements_for_baskets`.
+        """
+
+        basket_ids = list(dict.fromkeys(int(basket_id) for basket_id in basket_ids))
+
+        measurements = {
+            basket_id: {source: np.empty(0, dtype=np.int64) for source in MEASUREMENT_SOURCES}
+            for basket_id in basket_ids
+        }
+
+        if not basket_ids:
+            return measurements
+
+        # Every table is tagged with its index in MEASUREMENT_SOURCES
+        basket_placeholders = ', '.join([self.placeholder] * len(basket_ids))
+        query = "\nUNION ALL\n".join(f"""
+            SELECT {source_idx}, basket_id, {self.timestamp_us('timestamp')} FROM {source}
+            WHERE
+                basket_id IN ({basket_placeholders}) AND
+                timestamp BETWEEN {self.placeholder} AND {self.placeholder}
+        """ for source_idx, source in enumerate(MEASUREMENT_SOURCES))
+
+        params = (*basket_ids, self.timestamp_param(t_from), self.timestamp_param(t_to),) * len(MEASUREMENT_SOURCES)
+
+        own_connection = db_connection is None
+        if own_connection:
+            db_connection = self.connect()
+
+        try:
+            db_cursor = db_connection.cursor()
+            db_cursor.execute(query, params)
+
+            batches = []
+            while True:
+                rows = db_cursor.fetchmany(FETCH_BATCH_SIZE)
+                if not rows:
+                    break
+                batches.append(np.array(rows, dtype=np.int64))
+
+            db_cursor.close()
+
+        finally:
+            if own_connection:
+                db_connection.close()
+
+        rows = np.concatenate(batches) if batches else np.empty((0, 3), dtype=np.int64)
+
+        # Sort by (basket, source, timestamp) and split the rows by basket and then by source
+        rows = rows[np.lexsort((rows[:, 2], rows[:, 0], rows[:, 1]))]
+
+        row_basket_ids, basket_starts = np.unique(rows[:, 1], return_index=True)
+        basket_ends = np.append(basket_starts[1:], len(rows))
+
+        for basket_id, basket_start, basket_end in zip(row_basket_ids.tolist(), basket_starts, basket_ends):
+            basket_rows = rows[basket_start:basket_end]
+            bounds = np.searchsorted(basket_rows[:, 0], np.arange(len(MEASUREMENT_SOURCES) + 1), side='left')
+
+            measurements[basket_id] = {
+                source: basket_rows[bounds[source_idx]:bounds[source_idx + 1], 2] * 1000
+                for source_idx, source in enumerate(MEASUREMENT_SOURCES)
+            }
+
+        logger.debug(f"Queried {len(rows)} measurements for {len(basket_ids)} basket(s)")
+
+        return measurements
+
+    def fetch_latest_measurement(self, basket_id: int, t_to: datetime, db_connection=None):
+        """
+        See `fetch_latest_measurement`.
+        """
+
+        query = "\nUNION ALL\n".join(f"""
+            SELECT {self.timestamp_us('MAX(timestamp)')} FROM {source}
+            WHERE
+                basket_id = {self.placeholder} AND
+                timestamp <= {self.placeholder}
+        """ for source in MEASUREMENT_SOURCES)
+
+        own_connection = db_connection is None
+        if own_connection:
+            db_connection = self.connect()
+
+        try:
+            db_cursor = db_connection.cursor()
+            db_cursor.execute(query, (basket_id, self.timestamp_param(t_to),) * len(MEASUREMENT_SOURCES))
+            latest = [row[0] for row in db_cursor.fetchall() if row[0] is not None]
+            db_cursor.close()
+
+        finally:
+            if own_connection:
+                db_connection.close()
+
+        return np.datetime64(max(latest), 'us').item() if latest else None
+
+    def fetch_basket_ids(self, t_from: datetime = None, db_connection=None):
+        """
+        See `fetch_basket_ids`.
+        """
+
+        query = "\nUNION\n".join(f"""
+            SELECT DISTINCT basket_id FROM {source}
+            {f'WHERE timestamp >= {self.placeholder}' if t_from is not None else ''}
+        """ for source in MEASUREMENT_SOURCES)
+
+        own_connection = db_connection is None
+        if own_connection:
+            db_connection = self.connect()
+
+        try:
+            db_cursor = db_connection.cursor()
+            db_cursor.execute(query, (self.timestamp_param(t_from),) * len(MEASUREMENT_SOURCES) if t_from is not None else ())
+            basket_ids = sorted(row[0] for row in db_cursor.fetchall())
+            db_cursor.close()
+
+        finally:
+            if own_connection:
+                db_connection.close()
+
+        return basket_ids
+
+    def insert_measurements(self, source: str, rows, db_connection=None):
+        """
+        See `insert_measurements`.
+        """
+
+        if source not in MEASUREMENT_SOURCES:
+            raise ValueError(f"Unknown measurement source: \"{source}\"")
+
+        columns = ('basket_id', *MEASUREMENT_COLUMNS[source], 'timestamp')
+
+        own_connection = db_connection is None
+        if own_connection:
+            db_connection = self.connect()
+
+        try:
+            db_cursor = db_connection.cursor()
+            db_cursor.executemany(f"""
+                INSERT INTO {source}
+                    ({', '.join(columns)})
+                VALUES
+                    ({', '.join(self.named_placeholder.format(column) for column in columns)})
+            """, [{**row, 'timestamp': self.timestamp_param(row['timestamp'])} for row in rows])
+            db_cursor.close()
+
+            if own_connection:
+                db_connection.commit()
+
+        finally:
+            if own_connection:
+                db_connection.close()
+
+    def bulk_insert_measurements(self, source: str, basket_ids, t_ns, values: dict = None, db_connection=None):
+        """
+        See `bulk_insert_measurements`.
+        """
+
+        if source not in MEASUREMENT_SOURCES:
+            raise ValueError(f"Unknown measurement source: \"{source}\"")
+
+        columns = ('basket_id', *MEASUREMENT_COLUMNS[source], 'timestamp')
+        values = values or {}
+
+        t_us = np.asarray(t_ns, dtype=np.int64) // 1000
+        data = [
+            np.broadcast_to(np.asarray(basket_ids, dtype=np.int64), t_us.shape),
+            *(np.broadcast_to(np.asarray(values.get(column, 0), dtype=np.float64), t_us.shape) for column in MEASUREMENT_COLUMNS[source]),
+            t_us,
+        ]
+
+        row_placeholder = f"({', '.join([self.placeholder] * (len(columns) - 1) + [self.timestamp_us_placeholder])})"
+
+        own_connection = db_connection is None
+        if own_connection:
+            db_connection = self.connect()
+
+        try:
+            db_cursor = db_connection.cursor()
+
+            for start in range(0, len(t_us), BULK_INSERT_BATCH_SIZE):
+                rows = list(zip(*(column[start:start + BULK_INSERT_BATCH_SIZE].tolist() for column in data)))
+                self._insert_rows(db_cursor, source, columns, row_placeholder, rows)
+
+            db_cursor.close()
+
+            if own_connection:
+                db_connection.commit()
+
+        finally:
+            if own_connection:
+                db_connection.close()
+
+        return len(t_us)
+
+    def _insert_rows(self, db_cursor, source: str, columns, row_placeholder: str, rows):
+        # A single multi-row statement per batch
+        db_cursor.execute(f"""
+            INSERT INTO {source}
+                ({', '.join(columns)})
+            VALUES
+                {', '.join([row_placeholder] * len(rows))}
+        """, [value for row in rows for value in row])
+
+    def delete_measurements(self, basket_id: int, db_connection=None):
+        """
+        See `delete_measurements`.
+        """
+
+        own_connection = db_connection is None
+        if own_connection:
+            db_connection = self.connect()
+
+        try:
+            db_cursor = db_connection.cursor()
+            for source in MEASUREMENT_SOURCES:
+                db_cursor.execute(f"DELETE FROM {source} WHERE basket_id = {self.placeholder}", (basket_id,))
+            db_cursor.close()
+
+            if own_connection:
+                db_connection.commit()
+
+        finally:
+            if own_connection:
+                db_connection.close()
+
+
+class MySQLMeasurementStore(MeasurementStore):
+    """
+    The measurements stored in the MySQL DB configured by `DB_*`, through the connection pool of `db`.
+    """
+
+    placeholder = '%s'
+    named_placeholder = '%({})s'
+
+    # The session time zone is UTC, see `db`
+    timestamp_us_placeholder = "TIMESTAMPADD(MICROSECOND, %s, '1970-01-01 00:00:00')"
+
+    def connect(self):
+        # Imported here so that the other stores don't need the MySQL configuration
+        from db import create_db_connection
+
+        return create_db_connection()
+
+    def timestamp_us(self, column: str) -> str:
+        return f"CAST(UNIX_TIMESTAMP({column}) * 1000000 AS SIGNED)"
+
+    def timestamp_param(self, t: datetime):
+        return t
+
+
+class SQLiteMeasurementStore(MeasurementStore):
+    """
+    The measurements stored in an embedded SQLite DB file, created if missing, so that the service and its
+    benchmarks run without a DB server. Timestamps are stored as integer microseconds since the UNIX epoch.
+    """
+
+    placeholder = '?'
+    named_placeholder = ':{}'
+    timestamp_us_placeholder = '?'
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._lock = threading.Lock()
+        self._schema_ready = False
+
+    def connect(self):
+        # SQLite connections are cheap and can't be shared among threads, so every caller opens its own
+        db_connection = sqlite3.connect(self.path, timeout=30)
+
+        with self._lock:
+            if not self._schema_ready:
+                self._ensure_schema(db_connection)
+                self._schema_ready = True
+
+        return db_connection
+
+    def timestamp_us(self, column: str) -> str:
+        return column
+
+    def timestamp_param(self, t: datetime):
+        return to_epoch_us(t)
+
+    def _insert_rows(self, db_cursor, source: str, columns, row_placeholder: str, rows):
+        # The number of parameters of a statement is limited, while a prepared statement executed many times is as fast
+        db_cursor.executemany(f"INSERT INTO {source} ({', '.join(columns)}) VALUES {row_placeholder}", rows)
+
+    def _ensure_schema(self, db_connection):
+        # Readers don't block the writer, like with MySQL
+        db_connection.execute("PRAGMA journal_mode=WAL")
+
+        for source in MEASUREMENT_SOURCES:
+            columns = ''.join(f"{column} REAL, " for column in MEASUREMENT_COLUMNS[source])
+
+            db_connection.execute(f"""
+                CREATE TABLE IF NOT EXISTS {source} (
+                    basket_id INTEGER NOT NULL,
+                    {columns}
+                    timestamp INTEGER NOT NULL
+                )
+            """)
+            db_connection.execute(f"CREATE INDEX IF NOT EXISTS {source}_basket_timestamp ON {source} (basket_id, timestamp)")
+
+        db_connection.commit()
+
+
+class ArchivedMeasurementStore(MeasurementStore):
+    """
+    Wraps a store, serving the measurements of the days already archived in an `EventArchive` from the memory mapped
+    archive. Only the rest of the requested range, usually the recent tail, is fetched from the wrapped store.
+    """
+
+    def __init__(self, store: MeasurementStore, archive: EventArchive):
+        self.store = store
+        self.archive = archive
+
+    def connect(self):
+        return self.store.connect()
+
+    def fetch_measurements_for_baskets(self, basket_ids, t_from: datetime, t_to: datetime, db_connection=None):
+        basket_ids = list(dict.fromkeys(int(basket_id) for basket_id in basket_ids))
+        from_ns, to_ns = to_epoch_us(t_from) * 1000, to_epoch_us(t_to) * 1000
+
+        archived = {basket_id: self.archive.read(basket_id, from_ns, to_ns) for basket_id in basket_ids}
+
+        # A single query covers what isn't archived for any basket: from the end of the shortest archived range (or
+        # from `t_from` if it isn't archived) to `t_to`
+        db_from_ns = min(
+            archived[basket_id][1] if archived[basket_id] is not None and archived[basket_id][0] == from_ns else from_ns
+            for basket_id in basket_ids
+        ) if basket_ids else from_ns
+
+        if db_from_ns <= to_ns:
+            measurements = self.store.fetch_measurements_for_baskets(basket_ids, np.datetime64(db_from_ns, 'ns').astype('datetime64[us]').item(), t_to, db_connection)
+        else:
+            measurements = {
+                basket_id: {source: np.empty(0, dtype=np.int64) for source in MEASUREMENT_SOURCES}
+                for basket_id in basket_ids
+            }
+
+        for basket_id, basket_archived in archived.items():
+            if basket_archived is None:
+                continue
+
+            lo_ns, hi_ns, archived_measurements = basket_archived
+
+            for source in MEASUREMENT_SOURCES:
+                measurement_ns = measurements[basket_id][source]
+
+                if len(measurement_ns) == 0:
+                    measurements[basket_id][source] = archived_measurements[source]
+                else:
+                    measurements[basket_id][source] = np.concatenate([
+                        measurement_ns[measurement_ns < lo_ns],
+                        archived_measurements[source],
+                        measurement_ns[measurement_ns >= hi_ns],
+                    ])
+
+        return measurements
+
+    def fetch_latest_measurement(self, basket_id: int, t_to: datetime, db_connection=None):
+        return self.store.fetch_latest_measurement(basket_id, t_to, db_connection)
+
+    def fetch_basket_ids(self, t_from: datetime = None, db_connection=None):
+        return self.store.fetch_basket_ids(t_from, db_connection)
+
+    def insert_measurements(self, source: str, rows, db_connection=None):
+        self.store.insert_measurements(source, rows, db_connection)
+
+    def bulk_insert_measurements(self, source: str, basket_ids, t_ns, values: dict = None, db_connection=None):
+        return self.store.bulk_insert_measurements(source, basket_ids, t_ns, values, db_connection)
+
+    def delete_measurements(self, basket_id: int, db_connection=None):
+        self.store.delete_measurements(basket_id, db_connection)
+        self.archive.delete(basket_id)
+
+
+def create_measurement_store(kind: str, path: str = None) -> MeasurementStore:
+    """
+    Returns:
+        The `MeasurementStore` of the given `kind`: `mysql` or `sqlite` (stored at `path`).
+    """
+
+    if kind == 'mysql':
+        return MySQLMeasurementStore()
+    if kind == 'sqlite':
+        return SQLiteMeasurementStore(path)
+
+    raise ValueError(f"Unknown measurement store: \"{kind}\"")
+
+
+# The store every function of this module reads and writes, chosen by `MEASUREMENT_STORE` and served from the
+# archive in `EVENT_ARCHIVE_DIR` for the archived days
+measurement_store = create_measurement_store(measurement_store_kind, measurement_store_path)
+
+if event_archive_dir:
+    measurement_store = ArchivedMeasurementStore(measurement_store, EventArchive(event_archive_dir, MEASUREMENT_SOURCES))
+
+
+def fetch_measurements(basket_id: int, t_from: datetime, t_to: datetime, db_connection=None):
+    """
+    Fetch the instants of the measurements of every source that happened in the range [`t_from`, `t_to`] for the
+    given `basket_id`, in a single round trip to the DB.
+
+    Parameters:
+        - `basket_id`: The basket whose measurements have to be fetched.
+        - `t_from`: The beginning of the range, expressed as a python `datetime` (in UTC timezone).
+        - `t_to`: The end of the range, expressed as a python `datetime` (in UTC timezone).
+        - `db_connection`: The DB connection to use. If not given, a new one is created and closed once done.
+
+    Returns:
+        A dict mapping every name in `MEASUREMENT_SOURCES` to the sorted `int64` array of the instants of its
+        measurements, expressed as nanoseconds since the UNIX epoch.
+    """
+
+    return fetch_measurements_for_baskets([basket_id], t_from, t_to, db_connection)[basket_id]
+
+
+def fetch_measurements_for_baskets(basket_ids, t_from: datetime, t_to: datetime, db_connection=None):
+    """
+    Fetch the instants of the measurements of every source that happened in the range [`t_from`, `t_to`] for all
+    the given `basket_ids`, in a single round trip to the DB.
+
+    Parameters:
+        - `basket_ids`: The baskets whose measurements have to be fetched.
+        - `t_from`: The beginning of the range, expressed as a python `datetime` (in UTC timezone).
+        - `t_to`: The end of the range, expressed as a python `datetime` (in UTC timezone).
+        - `db_connection`: The DB connection to use. If not given, a new one is created and closed once done.
+
+    Returns:
+        A dict mapping every basket of `basket_ids` to a dict that maps every name in `MEASUREMENT_SOURCES` to the
+        sorted `int64` array of the instants of its measurements, expressed as nanoseconds since the UNIX epoch.
+    """
+
+    return measurement_store.fetch_measurements_for_baskets(basket_ids, t_from, t_to, db_connection)
+
+
+def fetch_latest_measurement(basket_id: int, t_to: datetime, db_connection=None):
+    """
+    Returns:
+        The instant, as a python `datetime`, of the most recent measurement of any source not after `t_to` for the
+        given `basket_id`, or `None` if the basket has no measurements.
+    """
+
+    return measurement_store.fetch_latest_measurement(basket_id, t_to, db_connection)
+
+
+def fetch_basket_ids(t_from: datetime = None, db_connection=None):
+    """
+    Returns:
+        The sorted list of the baskets having measurements of any source, optionally only considering the ones that
+        happened since `t_from`.
+    """
+
+    return measurement_store.fetch_basket_ids(t_from, db_connection)
+
+
+def insert_measurements(source: str, rows, db_connection=None):
+    """
+    Insert the given measurements of a single source.
+
+    Parameters:
+        - `source`: The name of the source, one of `MEASUREMENT_SOURCES`.
+        - `rows`: The sequence of measurements, every one being a dict holding `basket_id`, `timestamp` (as a python
+            `datetime` in UTC timezone) and the `MEASUREMENT_COLUMNS` of the source.
+        - `db_connection`: The DB connection to use. If not given, a new one is created, committed and closed once
+            done; otherwise committing is up to the caller.
+    """
+
+    measurement_store.insert_measurements(source, rows, db_connection)
+
+
+def bulk_insert_measurements(source: str, basket_ids, t_ns, values: dict = None, db_connection=None):
+    """
+    Insert many measurements of a single source at once, given as arrays rather than one dict per row, in batches of
+    `BULK_INSERT_BATCH_SIZE` rows.
+
+    Parameters:
+        - `source`: The name of the source, one of `MEASUREMENT_SOURCES`.
+        - `basket_ids`: The basket of every measurement, or a single basket for all of them.
+        - `t_ns`: The `int64` array of the instants of the measurements, as nanoseconds since the UNIX epoch.
+        - `values`: A dict mapping the `MEASUREMENT_COLUMNS` of the source to the array of their values, or to a single
+            value for all the measurements. Missing columns are set to `0`.
+        - `db_connection`: The DB connection to use. If not given, a new one is created, committed and closed once
+            done; otherwise committing is up to the caller.
+
+    Returns:
+        The number of inserted measurements.
+    """
+
+    return measurement_store.bulk_insert_measurements(source, basket_ids, t_ns, values, db_connection)
+
+
+def delete_measurements(basket_id: int, db_connection=None):
+    """
+    Delete all the measurements of every source of the given basket.
+
+    Parameters:
+        - `basket_id`: The basket whose measurements have to be deleted.
+        - `db_connection`: The DB connection to use. If not given, a new one is created, committed and closed once
+            done; otherwise committing is up to the caller.
+    """
+
+    measurement_store.delete_measurements(basket_id, db_connection)
@@ -0,0 +1,216 @@
+import contextlib
+import threading
+import time
+
+
+# The upper bounds, in seconds, of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def format_labels(labels) -> str:
+    """
+    Returns:
+        The labels, given as (name, value) pairs, in the Prometheus text format.
+    """
+
+    if not labels:
+        return ''
+
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in labels
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    name: str
+    help: str
+    kind: str
+    label_names: tuple
+
+    def __init__(self, name: str, help: str, label_names=()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(label_names)
+
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict):
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric {self.name} expects the labels {self.label_names}, got {tuple(labels)}")
+        return tuple(labels[name] for name in self.label_names)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        with self._lock:
+            values = list(self._values.items())
+
+        for key, value in values:
+            lines.extend(self._render_sample(tuple(zip(self.label_names, key)), value))
+
+        return lines
+
+    def _render_sample(self, labels, value):
+        return [f"{self.name}{format_labels(labels)} {format_value(value)}"]
+
+
+class Counter(Metric):
+    """
+    A monotonically increasing count, e.g. of requests or fetched rows.
+    """
+
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Histogram(Metric):
+    """
+    The distribution of observed values, e.g. latencies, in cumulative buckets.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, label_names=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # One count per bucket, plus the sum of the values
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.]
+
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[len(self.buckets)] += 1
+
+            counts[-1] += value
+
+    @contextlib.contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_sample(self, labels, counts):
+        lines = []
+
+        cumulative = 0
+        for bound, count in zip((*self.buckets, float('inf')), counts):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{format_labels((*labels, ('le', format_value(bound))))} {cumulative}")
+
+        lines.append(f"{self.name}_sum{format_labels(labels)} {format_value(counts[-1])}")
+        lines.append(f"{self.name}_count{format_labels(labels)} {cumulative}")
+
+        return lines
+
+
+class CollectedMetric(Metric):
+    """
+    A value read when rendered, from the statistics some component already keeps (e.g. `LRUCache.stats`).
+    """
+
+    def __init__(self, name: str, help: str, kind: str, collect):
+        super().__init__(name, help)
+        self.kind = kind
+        self._collect = collect
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+        try:
+            lines.append(f"{self.name} {format_value(self._collect())}")
+        except Exception:
+            # A component failing to report its statistics mustn't break the whole endpoint
+            pass
+
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric: Metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns:
+            All the registered metrics in the Prometheus text exposition format.
+        """
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+
+registry = Registry()
+
+
+def counter(name: str, help: str, label_names=()) -> Counter:
+    return registry.register(Counter(name, help, label_names))
+
+
+def histogram(name: str, help: str, label_names=(), buckets=LATENCY_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, help, label_names, buckets))
+
+
+def collected(name: str, help: str, kind: str, collect) -> CollectedMetric:
+    return registry.register(CollectedMetric(name, help, kind, collect))
+
+
+# The time spent in every stage of serving a request, shared by all the modules so that the stages of a request can
+# be compared with each other
+stage_seconds = histogram('occupation_stage_seconds', "Time spent in every stage of evaluating and forecasting the occupation", ('stage',))
+
+
+# The functions called with the stage, the start and the end (as `time.perf_counter` values) of every timed stage.
+# Empty unless some component registers itself (see `profiling`), so that timing stages costs nothing more
+stage_observers = []
+
+
+@contextlib.contextmanager
+def stage_timer(stage: str):
+    """
+    Returns:
+        A context manager observing the time spent in its block as `stage` in `stage_seconds`.
+    """
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end = time.perf_counter()
+        stage_seconds.observe(end - start, stage=stage)
+
+        for observer in stage_observers:
+            observer(stage, start, end)
@@ -1,13 +1,210 @@
-from db import create_db_connection
+from measurements import fetch_measurements, fetch_measurements_for_baskets
+from metrics import collected, counter, stage_timer
+from cache import LRUCache
 import numpy as np
 from math import *
+from datetime import datetime, timedelta
 import logging
+import os
+import threading
 
 
 logger = logging.getLogger("occupation")
 #logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
 
 
+# The maximum distance, in seconds, at which a measurement can still contribute to the occupation
+OCCUPATION_WINDOW = 60 * 30
+
+# The maximum number of (time sample, measurement) pairs evaluated at once by the occupation kernel
+OCCUPATION_KERNEL_CHUNK_SIZE = 1 << 20
+
+# The contribution given by the measurements of every source, expressed as the `p` and `d` parameters of the
+# probability curve (see `accumulate_occupation_contribution`)
+OCCUPATION_CONTRIBUTIONS = {
+    'accelerometer_data': (0.1, 60 * 10),
+    'score_data': (0.4, 60 * 20),
+    'people_detected_data': (0.06, 60),
+}
+
+
+measurements_fetched = counter('occupation_measurements_fetched_total', "Measurements fetched to evaluate the occupation", ('source',))
+samples_evaluated = counter('occupation_samples_evaluated_total', "Time samples the occupation has been evaluated at")
+
+
+# The number of seconds after which the measurements are considered all ingested. The occupation at an instant older
+# than `OCCUPATION_WINDOW` plus this lag can't change anymore, unless late measurements are ingested
+occupation_cache_ingestion_lag = float(os.environ.get('OCCUPATION_CACHE_INGESTION_LAG', 60 * 5))
+
+# The occupation evaluated at single past instants, by (basket, instant as nanoseconds since the UNIX epoch). The
+# cache is disabled if `OCCUPATION_CACHE_MAX_ENTRIES` is 0
+occupation_cache = LRUCache(
+    max_entries=int(os.environ.get('OCCUPATION_CACHE_MAX_ENTRIES', 64 * 1024)),
+    ttl=float(os.environ.get('OCCUPATION_CACHE_TTL', 24 * 60 * 60)),
+)
+
+collected('occupation_cache_hits_total', "Lookups of the occupation cache that found the occupation", 'counter', lambda: occupation_cache.stats()['hits'])
+collected('occupation_cache_misses_total', "Lookups of the occupation cache that didn't find the occupation", 'counter', lambda: occupation_cache.stats()['misses'])
+collected('occupation_cache_entries', "Occupations held by the occupation cache", 'gauge', lambda: occupation_cache.stats()['entries'])
+
+# The number of times late measurements have been ingested for every basket by this process (see
+# `invalidate_cached_occupation`), which versions the occupation at its sealed instants
+_ingest_generations = {}
+_ingest_generations_lock = threading.Lock()
+
+
+def to_epoch_ns(t) -> np.ndarray:
+    """
+    Convert an instant or a sequence of instants (python `datetime(s)`, `datetime64` or pandas timestamps) to an
+    `int64` array of nanoseconds since the UNIX epoch.
+    """
+
+    return np.atleast_1d(np.asarray(t, dtype='datetime64[ns]')).astype(np.int64)
+
+
+def to_datetime(t_ns: int) -> datetime:
+    """
+    Convert an instant expressed as nanoseconds since the UNIX epoch to a naive python `datetime`.
+    """
+
+    return np.datetime64(int(t_ns), 'ns').astype('datetime64[us]').item()
+
+
+def occupation_sealed_until(now: datetime = None) -> int:
+    """
+    Returns:
+        The latest instant, as nanoseconds since the UNIX epoch, whose occupation can't change anymore (see
+        `OCCUPATION_CACHE_INGESTION_LAG`).
+    """
+
+    now_ns = int(to_epoch_ns(now or datetime.utcnow())[0])
+    return now_ns - int((OCCUPATION_WINDOW + occupation_cache_ingestion_lag) * 1_000_000_000)
+
+
+def occupation_generation(basket_id: int) -> int:
+    """
+    Returns:
+        The number of times late measurements of the basket have been ingested by this process, bumped whenever the
+        occupation at its sealed instants may have changed.
+    """
+
+    return _ingest_generations.get(int(basket_id), 0)
+
+
+def invalidate_cached_occupation(basket_id: int, from_t) -> int:
+    """
+    Remove from the `occupation_cache` the occupation of a basket at the instants following `from_t`, the instant of
+    the earliest measurement just ingested for the basket.
+
+    Returns:
+        The number of removed entries.
+    """
+
+    from_ns = int(to_epoch_ns(from_t)[0])
+
+    # Measurements ingested in time only contribute to instants that aren't sealed, hence never cached
+    if from_ns > occupation_sealed_until():
+        return 0
+
+    basket_id = int(basket_id)
+    with _ingest_generations_lock:
+        _ingest_generations[basket_id] = _ingest_generations.get(basket_id, 0) + 1
+
+    num_removed = occupation_cache.invalidate(lambda key: key[0] == basket_id and key[1] >= from_ns)
+
+    logger.info(f"Late measurements of basket {basket_id}: invalidated {num_removed} cached occupation(s)")
+
+    return num_removed
+
+
+def accumulate_occupation_contribution(t_ns: np.ndarray, measurement_ns: np.ndarray, p: float, d: float, occupation_array: np.ndarray):
+    """
+    Add to `occupation_array` the contribution given by the measurements happened at `measurement_ns` to the
+    occupation at the instants `t_ns`.
+
+    Every measurement happened at `t0` contributes to the occupation at `t` with the negative parable
+    `max(p - p / d^2 * (t - t0)^2, 0)`, as long as `t0 <= t` and `t - t0` is within `OCCUPATION_WINDOW`.
+
+    Parameters:
+        - `t_ns`: The instants to evaluate, expressed as nanoseconds since the UNIX epoch.
+        - `measurement_ns`: The sorted instants of the measurements, expressed as nanoseconds since the UNIX epoch.
+        - `p`: The contribution given by a measurement at the instant it happened.
+        - `d`: The number of seconds after which the contribution of a measurement vanishes.
+        - `occupation_array`: The array, as long as `t_ns`, the contributions are accumulated to.
+    """
+
+    if len(t_ns) == 0 or len(measurement_ns) == 0:
+        return
+
+    a = -p / d**2
+    c = p
+
+    # Only the measurements in the range [t - window, t] contribute to the occupation at t: find such ranges for
+    # every time sample at once
+    window_ns = int(min(d, OCCUPATION_WINDOW) * 1_000_000_000)
+
+    lo = np.searchsorted(measurement_ns, t_ns - window_ns, side='left')
+    hi = np.searchsorted(measurement_ns, t_ns, side='right')
+    counts = hi - lo
+
+    max_count = int(np.amax(counts))
+    if max_count == 0:
+        return
+
+    # Broadcast every time sample against the measurements within its range, taking a bounded number of rows at
+    # once so that the (rows x max_count) matrices stay within `OCCUPATION_KERNEL_CHUNK_SIZE` elements
+    offsets = np.arange(max_count)
+    chunk_rows = max(1, OCCUPATION_KERNEL_CHUNK_SIZE // max_count)
+    last_idx = len(measurement_ns) - 1
+
+    for begin in range(0, len(t_ns), chunk_rows):
+        end = min(begin + chunk_rows, len(t_ns))
+
+        chunk_count = int(np.amax(counts[begin:end]))
+        if chunk_count == 0:
+            continue
+
+        idx = lo[begin:end, None] + offsets[None, :chunk_count]
+        in_range = offsets[None, :chunk_count] < counts[begin:end, None]
+
+        x = (t_ns[begin:end, None] - measurement_ns[np.minimum(idx, last_idx)]) / 1_000_000_000
+        y = np.maximum(a * (x ** 2) + c, 0)
+
+        occupation_array[begin:end] += np.sum(y, axis=1, where=in_range)
+
+
+
+def evaluate_occupation_from_measurements(t_ns: np.ndarray, measurements: dict) -> np.ndarray:
+    """
+    Evaluate the occupation probability at the instants `t_ns` given the measurements of a basket.
+
+    Parameters:
+        - `t_ns`: The instants to evaluate, expressed as nanoseconds since the UNIX epoch.
+        - `measurements`: A dict mapping every measurement source to the sorted array of the instants of its
+            measurements, expressed as nanoseconds since the UNIX epoch (see `fetch_measurements`).
+
+    Returns:
+        The array of occupations at the instants `t_ns`
+    """
+
+    o_t = np.zeros(len(t_ns))
+
+    with stage_timer('occupation_kernel'):
+        for source, (p, d) in OCCUPATION_CONTRIBUTIONS.items():
+            logger.debug(f"Evaluating occupation contribution from {source}...")
+
+            accumulate_occupation_contribution(t_ns, measurements[source], p, d, o_t)
+
+    samples_evaluated.inc(len(t_ns))
+
+    return np.minimum(o_t, 1)
+
+
+def count_fetched_measurements(measurements: dict):
+    for source, measurement_ns in measurements.items():
+        measurements_fetched.inc(len(measurement_ns), source=source)
+
+
 def evaluate_occupation(basket_id: int, t):
     """
     Evaluate the occupation probability for a given instant or array of instants `t` based on the measurements stored for the given `basket_id`.
@@ -18,112 +215,78 @@ def evaluate_occupation(basket_id: int, t):
             for which the occupation should be evaluated
 
     Returns:
-        A single or an array of occupations depending if the input was a scalar or an array
+        A single occupation or a `float64` array of occupations depending if the input was a scalar or an array
     """
 
-    if not (type(t) == list or type(t) == np.ndarray):
+    if np.ndim(t) == 0:
         logger.debug(f"Evaluating the occupation at {t}")
         t = np.array([t])
     else:
         logger.debug(f"Evaluation the occupation on a sequence of {len(t)} time samples starting from {t[0]} ending at {t[-1]}")
     
-    t_min, t_max = np.amin(t), np.amax(t)
+    t_ns = to_epoch_ns(t)
+    t_min, t_max = to_datetime(np.amin(t_ns)), to_datetime(np.amax(t_ns))
 
-    # Query data
-    db_connection = create_db_connection()
-
-    db_cursor = db_connection.cursor()
-
-    db_cursor.execute("""
-        SELECT timestamp FROM accelerometer_data
-        WHERE
-            basket_id = %s AND
-            timestamp BETWEEN %s - INTERVAL 30 MINUTE AND %s
-        ORDER BY
-            timestamp ASC
-    """, (basket_id, t_min, t_max,))
-    accelerometer_data = [row[0] for row in db_cursor.fetchall()]
-
-    logger.debug(f"Queried {len(accelerometer_data)} AccelerometerData measurements")
-
-    db_cursor.execute("""
-        SELECT timestamp FROM score_data
-        WHERE
-            basket_id = %s AND
-            timestamp BETWEEN %s - INTERVAL 30 MINUTE AND %s
-        ORDER BY
-            timestamp ASC
-    """, (basket_id, t_min, t_max,))
-    basket_data = [row[0] for row in db_cursor.fetchall()]
-
-    logger.debug(f"Queried {len(accelerometer_data)} BasketData measurements")
-
-    db_cursor.execute("""
-        SELECT timestamp FROM people_detected_data
-        WHERE
-            basket_id = %s AND
-            timestamp BETWEEN %s - INTERVAL 30 MINUTE AND %s
-        ORDER BY
-            timestamp ASC
-    """, (basket_id, t_min, t_max,))
-    people_detected_data = [row[0] for row in db_cursor.fetchall()]
-
-    logger.debug(f"Queried {len(accelerometer_data)} PeopleDetectedData measurements")
-
-    db_cursor.close()
-    db_connection.close()
+    # The occupation at a single sealed instant is cached, since it can't change anymore
+    cache_key = (int(basket_id), int(t_ns[0]))
+    cacheable = occupation_cache.max_entries > 0 and len(t_ns) == 1 and t_ns[0] <= occupation_sealed_until()
 
-    # Occupation evaluation
-    o_t = np.zeros(len(t))
+    if cacheable:
+        o_t = occupation_cache.get(cache_key)
+        if o_t is not None:
+            return o_t
 
-    def evaluate_occupation(t_array, measurement_data, contribution, occupation_array):
-        base_idx = 0
+    # Query data
+    with stage_timer('measurements_fetch'):
+        measurements = fetch_measurements(basket_id, t_min - timedelta(seconds=OCCUPATION_WINDOW), t_max)
 
-        for i, t in enumerate(t_array):
-            offset = 0
+    count_fetched_measurements(measurements)
 
-            while True:
-                if (base_idx + offset) >= len(measurement_data):
-                    break
+    # Occupation evaluation
+    o_t = evaluate_occupation_from_measurements(t_ns, measurements)
 
-                measure_t = measurement_data[base_idx + offset]
-                if measure_t > t:
-                    # The current measure is more recent, we go on with the next time sample
-                    break
+    logger.debug(f"Evaluated a sequence of {len(o_t)} occupation samples (avg={np.average(o_t)})")
 
-                t_delta = t - measure_t
-                if t_delta.total_seconds() <= (60 * 30):
-                    # If it's within the 30 minutes range, then it could contribute to the final occupation
-                    occupation_array[i] += contribution(t, measure_t)
-                    offset += 1
-                else:
-                    base_idx += 1
-                    offset = 0
+    if cacheable:
+        occupation_cache.put(cache_key, o_t[0])
 
-    def probability_curve(t, t0, p, d):
-        a = -p / d**2
-        b = 0
-        c = p
+    return o_t[0] if len(o_t) == 1 else o_t
 
-        x = (t - t0).total_seconds()
-        y = max(a * (x ** 2) + b * x + c, 0)
 
-        return y
+def evaluate_occupation_for_baskets(basket_ids, t):
+    """
+    Evaluate the occupation probability for many baskets at a given instant or array of instants `t`, fetching the
+    measurements of all the baskets at once.
 
-    logger.debug(f"Evaluating occupation contribution from AccelerometerData...")
+    Parameters:
+      - `basket_ids`: The baskets to evaluate the occupation for
+      - `t`: The list of instants in time, expressed as a python `datetime` (in UTC timezone) or as an array of `datetime(s)`,
+            for which the occupation should be evaluated
 
-    evaluate_occupation(t, accelerometer_data, lambda t, event_t: probability_curve(t, event_t, 0.1, 60 * 10), o_t)
+    Returns:
+        A dict mapping every basket to a single occupation or a `float64` array of occupations depending if the input was a scalar or an array
+    """
 
-    logger.debug(f"Evaluating occupation contribution from BasketData...")
+    if np.ndim(t) == 0:
+        t = np.array([t])
 
-    evaluate_occupation(t, basket_data, lambda t, event_t: probability_curve(t, event_t, 0.4, 60 * 20), o_t)
+    logger.debug(f"Evaluating the occupation of {len(basket_ids)} basket(s) on {len(t)} time sample(s)")
 
-    logger.debug(f"Evaluating occupation contribution from PeopleDetectedData...")
+    t_ns = to_epoch_ns(t)
+    t_min, t_max = to_datetime(np.amin(t_ns)), to_datetime(np.amax(t_ns))
 
-    evaluate_occupation(t, people_detected_data, lambda t, event_t: probability_curve(t, event_t, 0.06, 60), o_t)
+    # Query data
+    with stage_timer('measurements_fetch'):
+        measurements = fetch_measurements_for_baskets(basket_ids, t_min - timedelta(seconds=OCCUPATION_WINDOW), t_max)
 
-    o_t = np.minimum(o_t, 1)
+    for basket_measurements in measurements.values():
+        count_fetched_measurements(basket_measurements)
 
-    logger.debug(f"Evaluated a sequence of {len(o_t)} occupation samples (avg={np.average(o_t)})")
+    # Occupation evaluation
+    occupations = {}
+
+    for basket_id, basket_measurements in measurements.items():
+        o_t = evaluate_occupation_from_measurements(t_ns, basket_measurements)
+        occupations[basket_id] = o_t[0] if len(o_t) == 1 else o_t
 
-    return o_t[0] if len(o_t) == 1 else o_t.tolist()
+    return occupations
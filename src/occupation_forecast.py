@@ -1,10 +1,360 @@
-from prophet import Prophet
-import pandas as pd
-from occupation import evaluate_occupation
+from occupation import evaluate_occupation, to_epoch_ns
+from occupation_rollup import evaluate_occupation_history
 import numpy as np
-from datetime import timedelta
-import matplotlib.pyplot as plt
-import weather
+from datetime import datetime, timedelta
+from calendar_features import unplayable_days
+from seasonal_forecast import SeasonalProfile, fit_seasonal_profile
+from cache import LRUCache, SingleFlight
+from metrics import collected, counter, stage_timer
+from measurements import fetch_latest_measurement
+import forecast_store
+from forecast_table import fetch_precomputed_forecast, precomputed_forecast_enabled
+import os
+import logging
+import functools
+import threading
+
+
+logger = logging.getLogger("occupation_forecast")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# Prophet, pandas and matplotlib take seconds to import and are only needed to fit models and plot, so they're
+# imported on first use. `FORECAST_WARMUP` imports them in the background as soon as the module is loaded
+forecast_warmup = os.environ.get('FORECAST_WARMUP', 'false').lower() in ('1', 'true', 'yes')
+
+# The granularity `present` is truncated to when forecasting with the cache enabled, so that nearby requests share
+# the same fitted model
+forecast_present_bucket = timedelta(minutes=int(os.environ.get('FORECAST_PRESENT_BUCKET', 30)))
+
+# The directory fitted forecasts are persisted to, so that they survive restarts. Persistence is disabled if empty
+forecast_store_dir = os.environ.get('FORECAST_STORE_DIR', '')
+
+# The number of seconds after which a persisted forecast is deleted from the `FORECAST_STORE_DIR`, never if 0
+forecast_store_retention = int(os.environ.get('FORECAST_STORE_RETENTION', 7 * 24 * 60 * 60))
+
+# The engine forecasting the occupation when none is requested: `prophet` or `seasonal` (see `forecasters`)
+forecast_engine = os.environ.get('FORECAST_ENGINE', 'prophet')
+
+# The number of weeks after which the weight of the history is halved by the `seasonal` engine
+forecast_seasonal_half_life = float(os.environ.get('FORECAST_SEASONAL_HALF_LIFE', 4))
+
+# The number of seconds a request waits for the identical forecast being fitted by a concurrent request
+forecast_coalesce_timeout = float(os.environ.get('FORECAST_COALESCE_TIMEOUT', 120))
+
+
+class OccupationForecast:
+    """
+    A fitted forecast model together with the occupation it predicts for the days following `present`.
+    """
+
+    basket_id: int
+    present: datetime
+    num_history_days: int
+    num_predicted_days: int
+    config: dict
+
+    t: np.ndarray  # datetime64[ns]
+    occupation: np.ndarray  # float64
+
+    fit_time: datetime
+    data_watermark: datetime  # The instant of the latest measurement the model has been fitted on
+
+    def __init__(self, basket_id, present, num_history_days, num_predicted_days, config, t, occupation, model, fit_time, data_watermark, model_nbytes=0):
+        self.basket_id = basket_id
+        self.present = present
+        self.num_history_days = num_history_days
+        self.num_predicted_days = num_predicted_days
+        self.config = config
+        self.t = t
+        self.occupation = occupation
+        self.fit_time = fit_time
+        self.data_watermark = data_watermark
+
+        # The model is either given or a function loading it on first access, together with an estimate of the memory
+        # it will take once loaded, so that the cache accounts for it before it's loaded
+        self._model = None if callable(model) else model
+        self._load_model = model if callable(model) else None
+        self._model_nbytes = model_nbytes
+
+    @property
+    def engine(self) -> str:
+        # Forecasts stored before the engine could be chosen have all been fitted by Prophet
+        return self.config.get('engine', 'prophet')
+
+    @property
+    def model(self):
+        if self._model is None and self._load_model is not None:
+            self._model = self._load_model()
+        return self._model
+
+    def detach_model(self):
+        """
+        Replace the model with its JSON serialization, deserialized again on first access, so that the forecast can
+        be pickled and sent to another process.
+        """
+
+        if self._model is not None:
+            self._model_nbytes = sizeof_model(self._model)
+            self._load_model = functools.partial(load_model, get_forecaster(self.engine).model_to_json(self._model), self.engine)
+            self._model = None
+
+    @property
+    def cache_key(self):
+        return forecast_cache_key(self.basket_id, self.present, self.num_history_days, self.num_predicted_days, self.config)
+
+    @property
+    def nbytes(self):
+        """
+        An estimate of the memory held by the forecast, including the arrays and DataFrames referenced by its model,
+        or the estimate given for the model if it isn't loaded yet.
+        """
+
+        if self._model is None:
+            return self.t.nbytes + self.occupation.nbytes + self._model_nbytes
+
+        return self.t.nbytes + self.occupation.nbytes + sizeof_model(self._model)
+
+
+def sizeof_model(model) -> int:
+    """
+    Returns:
+        An estimate of the memory held by a fitted model: the arrays and DataFrames it references.
+    """
+
+    nbytes = 0
+
+    for value in vars(model).values():
+        values = value.values() if isinstance(value, dict) else [value]
+        for v in values:
+            if isinstance(v, np.ndarray):
+                nbytes += v.nbytes
+            elif hasattr(v, 'memory_usage'):  # pandas DataFrame or Series
+                nbytes += int(np.sum(v.memory_usage(deep=True)))
+
+    return nbytes
+
+
+forecast_cache = LRUCache(
+    max_entries=int(os.environ.get('FORECAST_CACHE_MAX_ENTRIES', 64)),
+    ttl=float(os.environ.get('FORECAST_CACHE_TTL', 60 * 60)),
+    max_bytes=int(os.environ.get('FORECAST_CACHE_MAX_BYTES', 512 * 1024 * 1024)),
+    sizeof=lambda forecast: forecast.nbytes,
+)
+
+forecasts_served = counter('forecasts_served_total', "Forecasts served, by engine and by where they came from (cache, precomputed, fit or coalesced)", ('engine', 'source'))
+
+collected('forecast_cache_hits_total', "Lookups of the forecast cache that found the forecast", 'counter', lambda: forecast_cache.stats()['hits'])
+collected('forecast_cache_misses_total', "Lookups of the forecast cache that didn't find the forecast", 'counter', lambda: forecast_cache.stats()['misses'])
+collected('forecast_cache_entries', "Forecasts held by the forecast cache", 'gauge', lambda: forecast_cache.stats()['entries'])
+collected('forecast_cache_bytes', "Estimated memory held by the forecast cache", 'gauge', lambda: forecast_cache.stats()['bytes'])
+
+# The forecasts being looked up or fitted, by cache key, so that concurrent requests for the same forecast share a
+# single fit
+forecast_flights = SingleFlight()
+
+collected('forecast_coalesced_total', "Forecast requests that waited for the identical forecast of a concurrent request", 'counter', lambda: forecast_flights.stats()['coalesced'])
+collected('forecast_coalesce_timeouts_total', "Forecast requests that timed out waiting for a concurrent request", 'counter', lambda: forecast_flights.stats()['timeouts'])
+
+
+def load_model(model_json: str, engine: str = 'prophet'):
+    return get_forecaster(engine).model_from_json(model_json)
+
+
+def warm_up():
+    """
+    Import the modules needed to fit models, so that the first forecast doesn't pay for it.
+    """
+
+    import pandas
+    import prophet
+    import prophet.serialize
+
+    logger.info("Forecasting modules imported")
+
+
+if forecast_warmup:
+    threading.Thread(target=warm_up, name='forecast-warmup', daemon=True).start()
+
+
+def forecast_cache_key(basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, config: dict):
+    return (basket_id, present, num_history_days, num_predicted_days, tuple(sorted(config.items())))
+
+
+def truncate_present(present: datetime) -> datetime:
+    """
+    Truncate `present` to the beginning of its `FORECAST_PRESENT_BUCKET` interval.
+    """
+
+    since_midnight = present - present.replace(hour=0, minute=0, second=0, microsecond=0)
+    return present - since_midnight % forecast_present_bucket
+
+
+class Forecaster:
+    """
+    An engine forecasting the occupation of a basket from its history.
+    """
+
+    name: str
+
+    def config(self, num_history_days: int) -> dict:
+        """
+        Returns:
+            The parameters of the model fitted on a history of `num_history_days` days. They're part of the cache key
+            of the forecast, so they must include the `engine`.
+        """
+
+        raise NotImplementedError
+
+    def fit(self, config: dict, t: np.ndarray, occupation_t: np.ndarray, days: np.ndarray, unplayable: np.ndarray, num_predicted_days: int):
+        """
+        Fit a model on the occupation history and predict the occupation in the following days.
+
+        Parameters:
+            - `config`: The parameters of the model, as returned by `config`.
+            - `t`: The `datetime64[ns]` array of the time samples of the history, every 30min up to `present`.
+            - `occupation_t`: The occupation at every time sample of `t`.
+            - `days`: The `datetime64[D]` array of the days from the first one of the history to the last predicted one.
+            - `unplayable`: Whether every day of `days` is unplayable.
+            - `num_predicted_days`: The number of days past the last time sample of `t` to predict.
+
+        Returns:
+            A 3d-tuple containing the fitted model, the `datetime64[ns]` array of the time samples of both the history
+            and the predicted days, and the array of their predicted occupation.
+        """
+
+        raise NotImplementedError
+
+    def model_to_json(self, model) -> str:
+        raise NotImplementedError
+
+    def model_from_json(self, model_json: str):
+        raise NotImplementedError
+
+
+class ProphetForecaster(Forecaster):
+    """
+    Fits a Prophet model, with the unplayable days as holidays. Accurate but takes seconds per basket.
+    """
+
+    name = 'prophet'
+
+    def config(self, num_history_days: int) -> dict:
+        num_time_samples = num_history_days * 24 * 2
+        history_duration = timedelta(minutes=30 * (num_time_samples - 1))
+
+        return {
+            'engine': self.name,
+            'growth': 'flat',
+            'n_changepoints': round((num_time_samples * 0.8) / (24 * 2)) * 7,
+            'changepoint_range': 0.8,
+            'yearly_seasonality': 44 if history_duration >= timedelta(days=365) else 'auto',
+            'weekly_seasonality': 70 if history_duration >= timedelta(weeks=1) else 'auto',
+            'daily_seasonality': 50 if history_duration >= timedelta(days=1) else 'auto',
+            'seasonality_mode': 'additive',
+            #'seasonality_prior_scale': 6.0,
+            #'holidays_prior_scale': 50.0,
+            #'changepoint_prior_scale': 22.0,
+        }
+
+    def fit(self, config, t, occupation_t, days, unplayable, num_predicted_days):
+        from prophet import Prophet
+        import pandas as pd
+
+        with stage_timer('prophet_dataframe'):
+            # Gather (t, o(t)) in a DataFrame so that can be given as an input to FbProphet
+            df = pd.DataFrame({'ds': t, 'y': occupation_t})
+
+            # Define holidays as the days where the weather conditions (or forecasts) aren't suitable for playing,
+            # both in the history and in the predicted days
+            holidays = pd.DataFrame({
+                'holiday': 'unplayable_day',
+                'ds': days[unplayable],
+            })
+
+        # Predict the future!
+        model = Prophet(
+            holidays=holidays,
+            **{name: value for name, value in config.items() if name != 'engine'},
+        )
+
+        with stage_timer('prophet_fit'):
+            model.fit(df)
+
+        with stage_timer('prophet_predict'):
+            future = model.make_future_dataframe(periods=(num_predicted_days * 24 * 2), freq='30min')
+            prediction = model.predict(future)
+
+        prediction['yhat'] = prediction['yhat'].clip(lower=0, upper=1)
+
+        return model, prediction['ds'].to_numpy(dtype='datetime64[ns]'), prediction['yhat'].to_numpy(dtype=np.float64)
+
+    def model_to_json(self, model) -> str:
+        from prophet.serialize import model_to_json
+
+        return model_to_json(model)
+
+    def model_from_json(self, model_json: str):
+        from prophet.serialize import model_from_json
+
+        return model_from_json(model_json)
+
+
+class SeasonalForecaster(Forecaster):
+    """
+    Predicts the weekly profile of the occupation, reduced on unplayable days (see `seasonal_forecast`). Takes
+    milliseconds per basket and doesn't need Prophet, at the cost of ignoring trends and yearly seasonality.
+    """
+
+    name = 'seasonal'
+
+    def config(self, num_history_days: int) -> dict:
+        return {
+            'engine': self.name,
+            'half_life_weeks': forecast_seasonal_half_life,
+        }
+
+    def fit(self, config, t, occupation_t, days, unplayable, num_predicted_days):
+        t_ns = to_epoch_ns(t)
+        predicted_t = np.concatenate([t, t[-1] + np.arange(1, num_predicted_days * 24 * 2 + 1) * np.timedelta64(30, 'm')])
+        predicted_unplayable = unplayable[(predicted_t.astype('datetime64[D]') - days[0]).astype(np.int64)]
+
+        model = fit_seasonal_profile(t_ns, occupation_t, predicted_unplayable[:len(t)], t_ns[-1], config['half_life_weeks'])
+
+        return model, predicted_t, model.predict(to_epoch_ns(predicted_t), predicted_unplayable)
+
+    def model_to_json(self, model) -> str:
+        return model.to_json()
+
+    def model_from_json(self, model_json: str):
+        return SeasonalProfile.from_json(model_json)
+
+
+forecasters = {forecaster.name: forecaster for forecaster in (ProphetForecaster(), SeasonalForecaster())}
+
+
+def get_forecaster(engine: str = None) -> Forecaster:
+    """
+    Returns:
+        The `Forecaster` named `engine`, or the `FORECAST_ENGINE` one if `None`.
+    """
+
+    engine = engine or forecast_engine
+
+    if engine not in forecasters:
+        raise ValueError(f"Unknown forecast engine: \"{engine}\"")
+
+    return forecasters[engine]
+
+
+def forecast_model_config(num_history_days: int, engine: str = None):
+    """
+    Returns:
+        The parameters of the model fitted by `engine` (the `FORECAST_ENGINE` by default) on a history of
+        `num_history_days` days.
+    """
+
+    return get_forecaster(engine).config(num_history_days)
 
 
 def evaluate_occupation_forecast_for_next_days(
@@ -17,6 +367,11 @@ def evaluate_occupation_forecast_for_next_days(
     """
     Forecast the occupation for a certain basket in the future.
 
+    Unless debugging, `present` is truncated to `FORECAST_PRESENT_BUCKET` and the fitted model is kept in the
+    `forecast_cache`, so that following requests for the same basket, history, horizon and engine don't fit it again.
+    Concurrent requests for a forecast that isn't cached yet wait for the first one to fit it, for at most
+    `FORECAST_COALESCE_TIMEOUT` seconds, and share its result or its exception.
+
     Parameters:
         - `basket_id`: The ID of the basket for which evaluate the occupation.
         - `present`: The date from which the forecast is performed.
@@ -24,14 +379,105 @@ def evaluate_occupation_forecast_for_next_days(
         - `num_predicted_days`: The number of days past the `present` date to predict.
 
     Keyword parameters:
+        - `engine`: The name of the `Forecaster` to use (defaults to `FORECAST_ENGINE`).
+        - `use_cache`: Whether to look up and store the fitted model in the `forecast_cache` (defaults to not `debug`).
         - `debug`: Whether to show debug plots.
         - `num_past_days_in_plot`: The number of days prior the `present` date to show on the debug plot.
         - `num_future_days_in_plot`: The number of days past the `present` date to show on the debug plot.
 
     Returns:
-        A 2d-tuple containing the array of future time samples and another array holding respectively their predicted occupancy value
+        A 2d-tuple containing the `datetime64` array of future time samples and the array holding their predicted
+        occupancy value
     """
 
+    use_cache = kwargs.get('use_cache', not kwargs.get('debug', False))
+
+    if not use_cache:
+        forecast = fit_occupation_forecast(basket_id, present, num_history_days, num_predicted_days, **kwargs)
+        return forecast.t, forecast.occupation
+
+    present = truncate_present(present)
+    config = forecast_model_config(num_history_days, kwargs.get('engine'))
+    key = forecast_cache_key(basket_id, present, num_history_days, num_predicted_days, config)
+
+    forecast = forecast_cache.get(key)
+    source = 'cache'
+
+    if forecast is None:
+        (forecast, source), shared = forecast_flights.do(
+            key,
+            lambda: load_occupation_forecast(key, config, basket_id, present, num_history_days, num_predicted_days, **kwargs),
+            timeout=forecast_coalesce_timeout,
+        )
+
+        if shared:
+            source = 'coalesced'
+
+    forecasts_served.inc(engine=config['engine'], source=source)
+
+    return forecast.t, forecast.occupation
+
+
+def load_occupation_forecast(key, config: dict, basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int, **kwargs):
+    """
+    Look up the precomputed forecast, or fit it, and add it to the `forecast_cache` under `key`.
+
+    Returns:
+        A 2d-tuple containing the `OccupationForecast` and where it came from: `cache`, `precomputed` or `fit`.
+    """
+
+    # The caller missed the cache before joining the flight: a flight that has just completed may have filled it since
+    forecast = forecast_cache.get(key)
+    if forecast is not None:
+        return forecast, 'cache'
+
+    # Only Prophet forecasts are precomputed
+    if precomputed_forecast_enabled and config['engine'] == 'prophet':
+        with stage_timer('forecast_precomputed_lookup'):
+            forecast = lookup_precomputed_forecast(basket_id, present, num_history_days, num_predicted_days)
+
+        if forecast is not None:
+            forecast_cache.put(key, forecast)
+            return forecast, 'precomputed'
+
+    forecast = fit_occupation_forecast(basket_id, present, num_history_days, num_predicted_days, **kwargs)
+    forecast_cache.put(key, forecast)
+
+    if forecast_store_dir:
+        with stage_timer('forecast_store'):
+            store_forecast(forecast)
+
+    return forecast, 'fit'
+
+
+def fit_occupation_forecast(
+    basket_id: int,
+    present,
+    num_history_days: int,
+    num_predicted_days: int,
+    **kwargs
+):
+    """
+    Fit a forecast model on the occupation history of a certain basket and predict its occupation in the future.
+
+    Parameters:
+        - `basket_id`: The ID of the basket for which evaluate the occupation.
+        - `present`: The date from which the forecast is performed.
+        - `num_history_days`: The number of days prior the `present` date to take data from.
+        - `num_predicted_days`: The number of days past the `present` date to predict.
+
+    Keyword parameters:
+        - `engine`: The name of the `Forecaster` to use (defaults to `FORECAST_ENGINE`).
+        - `debug`: Whether to show debug plots.
+        - `num_past_days_in_plot`: The number of days prior the `present` date to show on the debug plot.
+        - `num_future_days_in_plot`: The number of days past the `present` date to show on the debug plot.
+
+    Returns:
+        An `OccupationForecast` holding the fitted model and its prediction for the `num_predicted_days` after `present`
+    """
+
+    forecaster = get_forecaster(kwargs.get('engine'))
+
     debug = kwargs.get('debug', False)
     num_past_days_in_plot = kwargs.get('num_past_days_in_plot', 3)
     num_future_days_in_plot = kwargs.get('num_future_days_in_plot', 3)
@@ -39,72 +485,47 @@ def evaluate_occupation_forecast_for_next_days(
     num_time_samples = num_history_days * 24 * 2
     
     # Draw time samples starting from the given date back in the past
-    print(f"Generating {num_time_samples} time samples with a 30min step...")
+    logger.debug(f"Generating {num_time_samples} time samples with a 30min step...")
 
-    t = pd.date_range(end=present, periods=num_time_samples, freq='30min').to_pydatetime()
-    older_date = np.amin(t)
+    t = np.datetime64(present, 'ns') - np.arange(num_time_samples - 1, -1, -1) * np.timedelta64(30, 'm')
+    older_date = t[0].astype('datetime64[us]').item()
     
     # Evaluate the occupation o(t) for those time samples
-    print(f"Generated time samples from {older_date} to {present} ({(present - older_date).days} day(s))")
+    logger.debug(f"Generated time samples from {older_date} to {present} ({(present - older_date).days} day(s))")
     
-    occupation_t = evaluate_occupation(basket_id, t)
-
-    # Gather (t, o(t)) in a DataFrame so that can be given as an input to FbProphet
-    print(f"Predicting {num_predicted_days} days into the future...")
-
-    df = pd.DataFrame(np.array([t, occupation_t]).transpose(), columns = ['ds', 'y'])
+    with stage_timer('forecast_history'):
+        occupation_t = evaluate_occupation_history(basket_id, t)
 
-    # Define holidays as the days where the weather conditions (or forecasts) aren't suitable for playing
-    past_days = df['ds'] \
-        .map(lambda date: date.date()) \
-        .drop_duplicates() \
-        .to_list()
-    past_holidays = [day for day in past_days if weather.is_unplayable_day(day)]
-    
-    future_days = pd.date_range(present + timedelta(days=1), present + timedelta(days=num_predicted_days), freq='1d').to_pydatetime()
-    future_holidays = [day.date() for day in future_days if weather.is_unplayable_day(day)]
+    logger.info(f"Predicting {num_predicted_days} days into the future with {forecaster.name}...")
 
-    holidays = pd.DataFrame({
-        'holiday': 'unplayable_day',
-        'ds': past_holidays + future_holidays
-    })
+    # The days where the weather conditions (or forecasts) aren't suitable for playing, both in the history and in the
+    # predicted days
+    present_day = np.datetime64(present, 'D')
+    days = np.arange(np.datetime64(older_date, 'D'), present_day + num_predicted_days + 1)
 
     # Predict the future!
-    model = Prophet(
-        growth='flat',
-        n_changepoints=round((num_time_samples * 0.8) / (24 * 2)) * 7,
-        changepoint_range=0.8,
-        yearly_seasonality=44 if (present - older_date) >= timedelta(days=365) else 'auto',
-        weekly_seasonality=70 if (present - older_date) >= timedelta(weeks=1) else 'auto',
-        daily_seasonality=50 if (present - older_date) >= timedelta(days=1) else 'auto',
-        holidays=holidays,
-        seasonality_mode='additive',
-        #seasonality_prior_scale=6.0,
-        #holidays_prior_scale=50.0,
-        #changepoint_prior_scale=22.0,
-    )
-    model.fit(df)
-    future = model.make_future_dataframe(periods=(num_predicted_days * 24 * 2), freq='30min')
-    prediction = model.predict(future)
+    config = forecaster.config(num_history_days)
 
-    prediction['yhat'].clip(lower=0, upper=1)
+    with stage_timer('forecast_fit'):
+        model, predicted_t, predicted_occupation_t = forecaster.fit(config, t, occupation_t, days, unplayable_days(days), num_predicted_days)
 
     # Plotting
     if debug:
-        #model.plot_components(prediction)
+        import matplotlib.pyplot as plt
+        import pandas as pd
 
         fig, ax = plt.subplots(sharex=True, figsize=(16, 6))
 
-        df[(-num_past_days_in_plot * 24 * 2):] \
+        pd.DataFrame({'ds': t, 'y': occupation_t})[(-num_past_days_in_plot * 24 * 2):] \
             .plot(ax=ax, x='ds', y='y', c='b', label="Data")
         
-        true_future_t = pd.date_range(start=present, end=(present + timedelta(days=num_future_days_in_plot)), freq='30min').to_pydatetime()
+        true_future_t = pd.date_range(start=present, end=(present + timedelta(days=num_future_days_in_plot)), freq='30min').to_numpy(dtype='datetime64[ns]')
         true_future_occupation_t = evaluate_occupation(basket_id, true_future_t)
 
-        pd.DataFrame(np.array([true_future_t, true_future_occupation_t]).transpose()) \
-            .plot(ax=ax, x=0, y=1, c='g', label="True occupation")
+        pd.DataFrame({'t': true_future_t, 'occupation': true_future_occupation_t}) \
+            .plot(ax=ax, x='t', y='occupation', c='g', label="True occupation")
 
-        prediction[((-num_predicted_days - num_past_days_in_plot) * 24 * 2):(((-num_predicted_days + num_future_days_in_plot) * 24 * 2))] \
+        pd.DataFrame({'ds': predicted_t, 'yhat': predicted_occupation_t})[((-num_predicted_days - num_past_days_in_plot) * 24 * 2):(((-num_predicted_days + num_future_days_in_plot) * 24 * 2))] \
             .plot(ax=ax, x='ds', y='yhat', c='r', label="Prediction")
 
         ax.set_ylim(0, 1.25)
@@ -113,10 +534,133 @@ def evaluate_occupation_forecast_for_next_days(
 
         plt.show()
 
-    predicted_t = prediction['ds'].dt.to_pydatetime()
-    predicted_occupation_t = prediction['yhat']
+    with stage_timer('forecast_watermark'):
+        data_watermark = fetch_latest_measurement(basket_id, present)
 
-    return predicted_t[-num_predicted_days * 24 * 2:], predicted_occupation_t[-num_predicted_days * 24 * 2:]
+    return OccupationForecast(
+        basket_id,
+        present,
+        num_history_days,
+        num_predicted_days,
+        config,
+        predicted_t[-num_predicted_days * 24 * 2:],
+        predicted_occupation_t[-num_predicted_days * 24 * 2:],
+        model,
+        datetime.utcnow(),
+        data_watermark,
+    )
+
+
+def lookup_precomputed_forecast(basket_id: int, present: datetime, num_history_days: int, num_predicted_days: int):
+    """
+    Returns:
+        An `OccupationForecast`, without model, built from the forecast precomputed for the basket by
+        `forecast_precompute`, or `None` if there's no suitable one.
+    """
+
+    try:
+        precomputed = fetch_precomputed_forecast(basket_id, present, num_history_days, num_predicted_days)
+    except Exception as e:
+        logger.warning(f"Couldn't read the precomputed forecast for basket {basket_id}: {e}")
+        return None
+
+    if precomputed is None:
+        return None
+
+    t, occupation = precomputed
+
+    return OccupationForecast(
+        basket_id,
+        present,
+        num_history_days,
+        num_predicted_days,
+        forecast_model_config(num_history_days, 'prophet'),
+        t,
+        occupation,
+        None,
+        datetime.utcnow(),
+        None,
+    )
+
+
+def store_forecast(forecast: OccupationForecast):
+    """
+    Persist a fitted forecast in the `FORECAST_STORE_DIR`. Failures are logged and otherwise ignored, since the
+    forecast can always be fitted again.
+    """
+
+    try:
+        forecast_store.save_forecast(
+            forecast_store_dir,
+            {
+                'basket_id': forecast.basket_id,
+                'present': forecast.present,
+                'num_history_days': forecast.num_history_days,
+                'num_predicted_days': forecast.num_predicted_days,
+                'config': forecast.config,
+                'fit_time': forecast.fit_time,
+                'data_watermark': forecast.data_watermark,
+            },
+            forecast.t,
+            forecast.occupation,
+            get_forecaster(forecast.engine).model_to_json(forecast.model),
+        )
+    except Exception as e:
+        logger.warning(f"Couldn't store the forecast for basket {forecast.basket_id}: {e}")
+
+
+def warm_forecast_cache():
+    """
+    Fill the `forecast_cache` with the forecasts persisted in the `FORECAST_STORE_DIR` that haven't expired yet.
+    Their models are read from disk only when accessed.
+
+    Returns:
+        The number of loaded forecasts.
+    """
+
+    if not forecast_store_dir:
+        return 0
+
+    num_loaded = 0
+    now = datetime.utcnow()
+
+    for meta, t, occupation, load_model_json, model_json_nbytes in forecast_store.load_forecasts(forecast_store_dir, forecast_cache.ttl, forecast_store_retention or None):
+        forecast = OccupationForecast(
+            meta['basket_id'],
+            meta['present'],
+            meta['num_history_days'],
+            meta['num_predicted_days'],
+            meta['config'],
+            t,
+            occupation,
+            lambda load_model_json=load_model_json, engine=meta['config'].get('engine', 'prophet'): load_model(load_model_json(), engine),
+            meta['fit_time'],
+            meta['data_watermark'],
+            # The arrays of a loaded model take about as much memory as their JSON serialization
+            model_json_nbytes,
+        )
+        forecast_cache.put(forecast.cache_key, forecast, age=(now - forecast.fit_time).total_seconds())
+        num_loaded += 1
+
+    logger.info(f"Loaded {num_loaded} forecast(s) from {forecast_store_dir}")
+
+    return num_loaded
+
+
+def interpolate_forecast(future_t: np.ndarray, future_occupation_t: np.ndarray, t) -> np.ndarray:
+    """
+    Interpolate the predicted occupation at the instant or instants `t`, clipping it to [0, 1].
+    """
+
+    # `np.interp` can't handle datetime(s), so both the future - predicted - samples and t are expressed as
+    # nanoseconds since the UNIX epoch
+    interpolated_occupation = np.interp(
+        to_epoch_ns(t),
+        to_epoch_ns(future_t),
+        future_occupation_t
+    )
+
+    return np.clip(interpolated_occupation, 0, 1)
 
 
 def evaluate_occupation_forecast(
@@ -158,28 +702,20 @@ def evaluate_occupation_forecast(
 
     future_t, future_occupation_t = prediction
 
-    min_future_t = np.amin(future_t)
-
-    # Find the interpolated occupation value at the instant t by shifting the future - predicted - samples
-    # and the t to the minimum future date, and scaling the delta to seconds. This is done because `np.interp`
-    # can't handle datetime(s) and avoids the usage of UNIX timestamps 
-    interpolated_occupation = np.interp(
-        (t - min_future_t).total_seconds(),
-        [dt.total_seconds() for dt in future_t - min_future_t],
-        future_occupation_t
-    )
-
-    interpolated_occupation = np.clip(interpolated_occupation, 0, 1)
+    interpolated_occupation = interpolate_forecast(future_t, future_occupation_t, t)[0]
 
     # Plotting
     if debug:
+        import matplotlib.pyplot as plt
+        import pandas as pd
+
         fig, ax = plt.subplots()
 
-        pd.DataFrame(np.array([future_t, future_occupation_t]).transpose()) \
-            .plot(ax=ax, x=0, y=1, c='orange')
+        pd.DataFrame({'t': future_t, 'occupation': future_occupation_t}) \
+            .plot(ax=ax, x='t', y='occupation', c='orange')
         
-        pd.DataFrame(np.array([[t], [interpolated_occupation]]).transpose()) \
-            .plot.scatter(ax=ax, x=0, y=1, c='blue')
+        pd.DataFrame({'t': to_epoch_ns(t).astype('datetime64[ns]'), 'occupation': [interpolated_occupation]}) \
+            .plot.scatter(ax=ax, x='t', y='occupation', c='blue')
 
         ax.set_ylim(0, 1.25)
 
@@ -189,3 +725,76 @@ def evaluate_occupation_forecast(
 
     return interpolated_occupation
 
+
+
+def evaluate_occupation_forecast_at(
+    basket_id: int,
+    present,
+    num_history_days: int,
+    num_future_days: int,
+    t,
+    **kwargs
+):
+    """
+    Forecast the occupation for a certain basket at many instants in the future, fitting the model once.
+
+    Parameters:
+        - `basket_id`: The ID of the basket for which evaluate the occupation.
+        - `present`: The date from which the forecast is performed.
+        - `num_history_days`: The number of days prior the `present` date to take data from.
+        - `num_future_days`: The number of days past the `present` date to predict.
+        - `t`: The sequence of instants in the future, expressed as Python `datetime(s)` or `datetime64`, where we
+            wish to forecast the occupation.
+
+    Returns:
+        The array of the forecasted occupation at every instant of `t`.
+    """
+
+    future_t, future_occupation_t = evaluate_occupation_forecast_for_next_days(
+        basket_id,
+        present,
+        num_history_days,
+        num_future_days,
+        **kwargs
+    )
+
+    return interpolate_forecast(future_t, future_occupation_t, t)
+
+
+def evaluate_occupation_forecast_horizon(
+    basket_id: int,
+    present,
+    num_history_days: int,
+    num_future_days: int,
+    resolution: timedelta = timedelta(minutes=30),
+    **kwargs
+):
+    """
+    Forecast the occupation for a certain basket over the whole predicted horizon, fitting the model once.
+
+    Parameters:
+        - `basket_id`: The ID of the basket for which evaluate the occupation.
+        - `present`: The date from which the forecast is performed.
+        - `num_history_days`: The number of days prior the `present` date to take data from.
+        - `num_future_days`: The number of days past the `present` date to predict.
+        - `resolution`: The interval between two consecutive returned time samples.
+
+    Returns:
+        A 2d-tuple containing the `datetime64` array of the time samples spanning the predicted horizon every
+        `resolution`, and the array of the forecasted occupation at those samples.
+    """
+
+    future_t, future_occupation_t = evaluate_occupation_forecast_for_next_days(
+        basket_id,
+        present,
+        num_history_days,
+        num_future_days,
+        **kwargs
+    )
+
+    if len(future_t) == 0:
+        return future_t, future_occupation_t
+
+    t = np.arange(future_t[0], future_t[-1] + np.timedelta64(1, 'ns'), np.timedelta64(resolution))
+
+    return t, interpolate_forecast(future_t, future_occupation_t, t)
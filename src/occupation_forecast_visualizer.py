@@ -1,4 +1,4 @@
-from occupation_forecast import evaluate_occupation_forecast
+from occupation_forecast import evaluate_occupation_forecast, forecasters
 from datetime import datetime
 import argparse
 
@@ -11,6 +11,7 @@ def main():
     parser.add_argument("-np", "--num_history_days", type=int, required=True)
     parser.add_argument("-nf", "--num_predicted_days", type=int, required=True)
     parser.add_argument("-t", "--t", type=datetime.fromisoformat, required=True)
+    parser.add_argument("-e", "--engine", choices=sorted(forecasters))
 
     args = parser.parse_args()
 
@@ -20,6 +21,7 @@ def main():
         args.num_history_days,
         args.num_predicted_days,
         args.t,
+        engine=args.engine,
         debug=True,
         num_past_days_in_plot=12,
         num_future_days_in_plot=3,
@@ -0,0 +1,368 @@
+from db import create_db_connection
+from measurements import fetch_basket_ids, measurement_store_kind, FETCH_BATCH_SIZE
+from occupation import evaluate_occupation, evaluate_occupation_for_baskets, to_epoch_ns, to_datetime, OCCUPATION_WINDOW
+from metrics import counter
+import numpy as np
+from datetime import datetime, timedelta
+import argparse
+import logging
+import os
+import time
+
+
+logger = logging.getLogger("occupation_rollup")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# Whether the occupation history is read from the rollup table instead of being evaluated from the measurements
+rollup_enabled = os.environ.get('ROLLUP_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# The rollup table lives in the MySQL DB, next to the measurements
+if rollup_enabled and measurement_store_kind != 'mysql':
+    logger.warning(f"The occupation rollup is only available with the mysql measurement store, not {measurement_store_kind}: disabling it")
+    rollup_enabled = False
+
+# The number of seconds measurements may take to reach the DB. Buckets are rolled up only once the occupation window
+# plus this margin has passed, so that their measurements are all there
+rollup_ingestion_lag = int(os.environ.get('ROLLUP_INGESTION_LAG', 60 * 5))
+
+ROLLUP_STEP = timedelta(minutes=30)
+ROLLUP_STEP_NS = ROLLUP_STEP // timedelta(microseconds=1) * 1000
+
+# The number of days evaluated at once while rolling up a long range
+ROLLUP_CHUNK_DAYS = 30
+
+rollup_samples = counter('occupation_history_samples_total', "Samples of the occupation history, by whether they were read from the rollup or evaluated from the measurements", ('source',))
+rollup_off_grid_samples = counter('occupation_rollup_off_grid_samples_total', "Samples of the occupation history evaluated from the measurements because they aren't on the grid of the rollup")
+
+
+def ensure_rollup_schema(db_connection):
+    db_cursor = db_connection.cursor()
+
+    db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS occupation_rollup (
+            basket_id BIGINT NOT NULL,
+            timestamp DATETIME NOT NULL,
+            occupation DOUBLE NOT NULL,
+            PRIMARY KEY (basket_id, timestamp)
+        )
+    """)
+
+    # The latest bucket rolled up for every basket
+    db_cursor.execute("""
+        CREATE TABLE IF NOT EXISTS occupation_rollup_watermark (
+            basket_id BIGINT NOT NULL PRIMARY KEY,
+            watermark DATETIME NOT NULL
+        )
+    """)
+
+    db_cursor.close()
+    db_connection.commit()
+
+
+def truncate_to_step(t: datetime) -> datetime:
+    since_midnight = t - t.replace(hour=0, minute=0, second=0, microsecond=0)
+    return t - since_midnight % ROLLUP_STEP
+
+
+def sealed_until(now: datetime = None) -> datetime:
+    """
+    Returns:
+        The latest bucket whose occupation can't change anymore, since its occupation window and ingestion lag
+        have passed.
+    """
+
+    now = now or datetime.utcnow()
+    return truncate_to_step(now - timedelta(seconds=OCCUPATION_WINDOW + rollup_ingestion_lag))
+
+
+def fetch_rollup_watermarks(db_connection):
+    db_cursor = db_connection.cursor()
+    db_cursor.execute("SELECT basket_id, watermark FROM occupation_rollup_watermark")
+    watermarks = dict(db_cursor.fetchall())
+    db_cursor.close()
+
+    return watermarks
+
+
+def roll_up(basket_ids=None, initial_days: int = 365, now: datetime = None):
+    """
+    Bring the rollup table up to date: for every basket, evaluate the occupation of the buckets sealed since its
+    watermark (or in the last `initial_days` days if it has never been rolled up) and store them.
+
+    Parameters:
+        - `basket_ids`: The baskets to roll up. If not given, all the baskets having measurements are.
+        - `initial_days`: The number of days rolled up for a basket that has never been rolled up.
+        - `now`: The current instant, defaults to the current UTC time.
+
+    Returns:
+        The number of stored buckets.
+    """
+
+    db_connection = create_db_connection()
+
+    try:
+        ensure_rollup_schema(db_connection)
+
+        until = sealed_until(now)
+        watermarks = fetch_rollup_watermarks(db_connection)
+
+        if basket_ids is None:
+            basket_ids = fetch_basket_ids()
+
+        # Baskets sharing the same watermark - usually all of them, once rolled up the first time - are evaluated
+        # together with a single query
+        baskets_by_start = {}
+        for basket_id in basket_ids:
+            watermark = watermarks.get(basket_id)
+            start = watermark + ROLLUP_STEP if watermark is not None else until - timedelta(days=initial_days)
+            if start <= until:
+                baskets_by_start.setdefault(start, []).append(basket_id)
+
+        num_buckets = 0
+
+        for start, start_basket_ids in baskets_by_start.items():
+            chunk_start = start
+            while chunk_start <= until and start_basket_ids:
+                chunk_end = min(chunk_start + timedelta(days=ROLLUP_CHUNK_DAYS) - ROLLUP_STEP, until)
+
+                num_buckets += roll_up_range(db_connection, start_basket_ids, chunk_start, chunk_end, watermarks)
+
+                # The baskets rewound meanwhile are rolled up from their new watermark on the next run
+                start_basket_ids = [basket_id for basket_id in start_basket_ids if watermarks.get(basket_id) == chunk_end]
+
+                chunk_start = chunk_end + ROLLUP_STEP
+
+        return num_buckets
+
+    finally:
+        db_connection.close()
+
+
+def roll_up_range(db_connection, basket_ids, t_from: datetime, t_to: datetime, watermarks: dict):
+    """
+    Evaluate and store the occupation of the buckets in [`t_from`, `t_to`] for the given baskets, moving their
+    watermark to `t_to`.
+
+    The watermark of every basket is expected to still be the one in `watermarks` (missing if it has never been rolled
+    up), which is updated. The buckets of a basket whose watermark has moved meanwhile, e.g. rewound by late
+    measurements (see `rewind_rollup`), are dropped, since they may have been evaluated without those measurements.
+
+    Returns:
+        The number of stored buckets.
+    """
+
+    t = np.arange(np.datetime64(t_from, 'ns'), np.datetime64(t_to, 'ns') + np.timedelta64(1, 'ns'), np.timedelta64(ROLLUP_STEP))
+    t_rows = t.astype('datetime64[us]').tolist()
+
+    logger.info(f"Rolling up {len(t)} bucket(s) from {t_from} to {t_to} for {len(basket_ids)} basket(s)")
+
+    occupations = evaluate_occupation_for_baskets(basket_ids, t)
+
+    num_buckets = 0
+
+    for basket_id, o_t in occupations.items():
+        o_t = np.atleast_1d(o_t).tolist()
+
+        db_cursor = db_connection.cursor()
+
+        # Lock the watermark until the buckets are stored, so that it can't be rewound in between
+        db_cursor.execute("""
+            SELECT watermark FROM occupation_rollup_watermark
+            WHERE basket_id = %s
+            FOR UPDATE
+        """, (basket_id,))
+        rows = db_cursor.fetchall()
+
+        if (rows[0][0] if rows else None) != watermarks.get(basket_id):
+            db_cursor.close()
+            db_connection.rollback()
+
+            logger.info(f"The rollup watermark of basket {basket_id} moved while rolling it up, dropping its buckets from {t_from} to {t_to}")
+            continue
+
+        db_cursor.executemany("""
+            INSERT INTO occupation_rollup
+                (basket_id, timestamp, occupation)
+            VALUES
+                (%s, %s, %s)
+            ON DUPLICATE KEY UPDATE
+                occupation = VALUES(occupation)
+        """, [(basket_id, t_row, o) for t_row, o in zip(t_rows, o_t)])
+
+        db_cursor.execute("""
+            INSERT INTO occupation_rollup_watermark
+                (basket_id, watermark)
+            VALUES
+                (%s, %s)
+            ON DUPLICATE KEY UPDATE
+                watermark = VALUES(watermark)
+        """, (basket_id, t_to,))
+
+        db_cursor.close()
+        db_connection.commit()
+
+        watermarks[basket_id] = t_to
+        num_buckets += len(t)
+
+    return num_buckets
+
+
+def rewind_rollup(basket_id: int, from_t):
+    """
+    Move the watermark of a basket back before `from_t`, the instant of the earliest measurement just ingested for the
+    basket, and delete the buckets following it, so that their occupation is evaluated from the measurements until
+    they're rolled up again. Measurements ingested in time don't affect any rolled up bucket and are ignored.
+
+    Returns:
+        Whether the rollup has been rewound.
+    """
+
+    if not rollup_enabled:
+        return False
+
+    from_t = to_datetime(to_epoch_ns(from_t)[0])
+    if from_t > sealed_until():
+        return False
+
+    # The first bucket whose occupation window may include the measurement is at or after `from_t`
+    watermark = truncate_to_step(from_t) - ROLLUP_STEP
+
+    try:
+        db_connection = create_db_connection()
+        try:
+            db_cursor = db_connection.cursor()
+            # A basket being rolled up for the first time gets a watermark too, so that the roll-up notices it
+            db_cursor.execute("""
+                INSERT INTO occupation_rollup_watermark
+                    (basket_id, watermark)
+                VALUES
+                    (%s, %s)
+                ON DUPLICATE KEY UPDATE
+                    watermark = LEAST(watermark, VALUES(watermark))
+            """, (basket_id, watermark,))
+            db_cursor.execute("""
+                DELETE FROM occupation_rollup
+                WHERE
+                    basket_id = %s AND
+                    timestamp > %s
+            """, (basket_id, watermark,))
+            db_cursor.close()
+            db_connection.commit()
+        finally:
+            db_connection.close()
+    except Exception as e:
+        logger.warning(f"Couldn't rewind the occupation rollup of basket {basket_id} to {watermark}: {e}")
+        return False
+
+    logger.info(f"Late measurements of basket {basket_id}: rewound its occupation rollup to {watermark}")
+
+    return True
+
+
+def fetch_rollup(basket_id: int, t_from: datetime, t_to: datetime, db_connection=None):
+    """
+    Fetch the rolled up occupation of a basket in the range [`t_from`, `t_to`].
+
+    Returns:
+        A 2d-tuple containing the sorted `int64` array of the buckets, expressed as nanoseconds since the UNIX epoch,
+        and the array of their occupation.
+    """
+
+    own_connection = db_connection is None
+    if own_connection:
+        db_connection = create_db_connection()
+
+    db_cursor = db_connection.cursor()
+    db_cursor.execute("""
+        SELECT CAST(UNIX_TIMESTAMP(timestamp) * 1000000 AS SIGNED), occupation FROM occupation_rollup
+        WHERE
+            basket_id = %s AND
+            timestamp BETWEEN %s AND %s
+        ORDER BY
+            timestamp ASC
+    """, (basket_id, t_from, t_to,))
+
+    batches = []
+    while True:
+        rows = db_cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not rows:
+            break
+        batches.append(np.array(rows, dtype=np.float64))
+
+    db_cursor.close()
+    if own_connection:
+        db_connection.close()
+
+    rows = np.concatenate(batches) if batches else np.empty((0, 2), dtype=np.float64)
+
+    return rows[:, 0].astype(np.int64) * 1000, rows[:, 1]
+
+
+def evaluate_occupation_history(basket_id: int, t):
+    """
+    Evaluate the occupation of a basket at the past instants `t`, like `evaluate_occupation` does. When
+    `ROLLUP_ENABLED`, the instants already rolled up are read from the rollup table and only the remaining ones
+    (usually the most recent) are evaluated from the measurements.
+
+    Returns:
+        The array of occupations at the instants `t`
+    """
+
+    if not rollup_enabled:
+        return np.atleast_1d(evaluate_occupation(basket_id, t))
+
+    t_ns = to_epoch_ns(t)
+
+    # Only the instants on the grid of the buckets can be read from the rollup
+    num_off_grid = np.count_nonzero(t_ns % ROLLUP_STEP_NS)
+    if num_off_grid > 0:
+        rollup_off_grid_samples.inc(num_off_grid)
+        logger.info(f"{num_off_grid} instant(s) of the history of basket {basket_id} aren't multiples of {ROLLUP_STEP}, evaluating them from the measurements")
+    o_t = np.zeros(len(t_ns))
+
+    try:
+        rollup_t_ns, rollup_o_t = fetch_rollup(basket_id, to_datetime(np.amin(t_ns)), to_datetime(np.amax(t_ns)))
+    except Exception as e:
+        logger.warning(f"Couldn't read the occupation rollup of basket {basket_id}: {e}")
+        rollup_t_ns, rollup_o_t = np.empty(0, dtype=np.int64), np.empty(0)
+
+    # Match the instants with the rolled up buckets
+    idx = np.minimum(np.searchsorted(rollup_t_ns, t_ns), max(len(rollup_t_ns) - 1, 0))
+    rolled_up = rollup_t_ns[idx] == t_ns if len(rollup_t_ns) > 0 else np.zeros(len(t_ns), dtype=bool)
+
+    o_t[rolled_up] = rollup_o_t[idx[rolled_up]]
+
+    missing = ~rolled_up
+    if np.any(missing):
+        o_t[missing] = evaluate_occupation(basket_id, t_ns[missing].astype('datetime64[ns]'))
+
+    rollup_samples.inc(np.count_nonzero(rolled_up), source='rollup')
+    rollup_samples.inc(np.count_nonzero(missing), source='measurements')
+
+    logger.debug(f"Read {np.count_nonzero(rolled_up)} occupation sample(s) from the rollup, evaluated {np.count_nonzero(missing)}")
+
+    return o_t
+
+
+def main():
+    parser = argparse.ArgumentParser(description="")
+
+    parser.add_argument("-b", "--basket", type=int, action='append')
+    parser.add_argument("-d", "--initial_days", type=int, default=365)
+    parser.add_argument("-i", "--interval", type=int)
+
+    args = parser.parse_args()
+
+    while True:
+        num_buckets = roll_up(args.basket, args.initial_days)
+        print(f"Rolled up {num_buckets} bucket(s)")
+
+        if args.interval is None:
+            break
+
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
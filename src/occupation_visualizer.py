@@ -1,6 +1,5 @@
 from datetime import datetime, timedelta
-import pytz
-from db import create_db_connection
+from measurements import fetch_measurements
 import numpy as np
 from math import *
 import matplotlib.pyplot as plt
@@ -22,50 +21,23 @@ def main():
     from_date = args.from_date
     to_date = args.to_date
 
-    db_connection = create_db_connection()
-    db_cursor = db_connection.cursor()
-
-    # Retrieve AccelerometerData
-    db_cursor.execute("""
-        SELECT timestamp FROM accelerometer_data
-        WHERE
-            basket_id = %s AND
-            timestamp BETWEEN %s AND %s
-    """, (basket_id, from_date, to_date,))
-    accelerometer_data = np.array([row[0] for row in db_cursor.fetchall()])
-
-    # Retrieve BasketData
-    db_cursor.execute("""
-        SELECT timestamp FROM score_data
-        WHERE
-            basket_id = %s AND
-            timestamp BETWEEN %s AND %s
-    """, (basket_id, from_date, to_date,))
-    basket_data = np.array([row[0] for row in db_cursor.fetchall()])
-
-    # Retrieve PeopleDetectedData
-    db_cursor.execute("""
-        SELECT timestamp FROM people_detected_data
-        WHERE
-            basket_id = %s AND
-            timestamp BETWEEN %s AND %s
-    """, (basket_id, from_date, to_date,))
-    people_detected_data = np.array([row[0] for row in db_cursor.fetchall()])
-
-    db_cursor.close()
-    db_connection.close()
+    measurements = fetch_measurements(basket_id, from_date, to_date)
+
+    accelerometer_data = measurements['accelerometer_data'].astype('datetime64[ns]')
+    basket_data = measurements['score_data'].astype('datetime64[ns]')
+    people_detected_data = measurements['people_detected_data'].astype('datetime64[ns]')
 
     # Plot
     fig, ax = plt.subplots(nrows=2, figsize=(16, 6), sharex=True)
 
-    pd.DataFrame(np.array([accelerometer_data, np.full(len(accelerometer_data), 0.75)]).transpose()) \
-        .plot.scatter(ax=ax[0], x=0, y=1, c='r', edgecolor='black', label="Accelerometer data")
+    pd.DataFrame({'t': accelerometer_data, 'y': np.full(len(accelerometer_data), 0.75)}) \
+        .plot.scatter(ax=ax[0], x='t', y='y', c='r', edgecolor='black', label="Accelerometer data")
 
-    pd.DataFrame(np.array([basket_data, np.full(len(basket_data), 0.5)]).transpose()) \
-        .plot.scatter(ax=ax[0], x=0, y=1, c='g', edgecolor='black', label="Basket data")
+    pd.DataFrame({'t': basket_data, 'y': np.full(len(basket_data), 0.5)}) \
+        .plot.scatter(ax=ax[0], x='t', y='y', c='g', edgecolor='black', label="Basket data")
 
-    pd.DataFrame(np.array([people_detected_data, np.full(len(people_detected_data), 0.25)]).transpose()) \
-        .plot.scatter(ax=ax[0], x=0, y=1, c='b', edgecolor='black', label="People detection")
+    pd.DataFrame({'t': people_detected_data, 'y': np.full(len(people_detected_data), 0.25)}) \
+        .plot.scatter(ax=ax[0], x='t', y='y', c='b', edgecolor='black', label="People detection")
 
     ax[0].legend(loc='upper left')
 
@@ -73,11 +45,11 @@ def main():
     ax[0].set_xlabel("Time")
     ax[0].set_ylim(0, 1)
 
-    t = pd.date_range(from_date, to_date, periods=1028).to_pydatetime()
+    t = pd.date_range(from_date, to_date, periods=1028).to_numpy(dtype='datetime64[ns]')
     occupation_t = evaluate_occupation(basket_id, t)
 
-    pd.DataFrame(np.array([t, occupation_t]).transpose()) \
-        .plot(ax=ax[1], x=0, y=1)
+    pd.DataFrame({'t': t, 'occupation': occupation_t}) \
+        .plot(ax=ax[1], x='t', y='occupation')
 
     ax[1].set_title("Occupation probability")
     ax[1].set_xlabel("Time")
@@ -0,0 +1,137 @@
+from metrics import stage_observers
+from datetime import datetime
+import cProfile
+import logging
+import os
+import pstats
+import threading
+import time
+
+
+logger = logging.getLogger("profiling")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# Whether requests can ask to be profiled (see `RequestProfile`). Profiling costs nothing unless enabled
+profiling_enabled = os.environ.get('PROFILING_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+
+# The directory the full profiles are saved to, in the `pstats` format, besides being summarized in the responses. Not saved if empty
+profiling_dir = os.environ.get('PROFILING_DIR', '')
+
+# The number of functions reported in the summary of a profile
+profiling_top_functions = int(os.environ.get('PROFILING_TOP_FUNCTIONS', 20))
+
+
+# The profile of the request handled by the current thread, if any
+_active = threading.local()
+
+# Only a request at a time is profiled, since Python 3.12 allows a single profiler at once
+_profiler_lock = threading.Lock()
+
+
+class RequestProfile:
+    """
+    The cProfile profile of a single request, together with the spans of the stages timed while it was handled (see
+    `metrics.stage_timer`).
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.spans = []
+
+        self.start = None
+        self.end = None
+
+    def add_span(self, stage: str, start: float, end: float):
+        self.spans.append((stage, start, end))
+
+    def summary(self, num_functions: int = None) -> dict:
+        """
+        Returns:
+            A dict holding the wall time of the request, the spans of its stages, the time spent per stage and the
+            functions that took the most time, excluding the functions they called.
+        """
+
+        num_functions = num_functions or profiling_top_functions
+
+        stages = {}
+        for stage, start, end in self.spans:
+            stages[stage] = stages.get(stage, 0) + (end - start) * 1000
+
+        functions = sorted(pstats.Stats(self.profiler).stats.items(), key=lambda item: item[1][2], reverse=True)
+
+        return {
+            'wall_ms': (self.end - self.start) * 1000,
+            'spans': [
+                {
+                    'stage': stage,
+                    'start_ms': (start - self.start) * 1000,
+                    'duration_ms': (end - start) * 1000,
+                }
+                for stage, start, end in sorted(self.spans, key=lambda span: span[1])
+            ],
+            'stages_ms': stages,
+            'functions': [
+                {
+                    'function': f"{filename}:{line}({function})",
+                    'calls': num_calls,
+                    'self_ms': self_time * 1000,
+                    'cumulative_ms': cumulative_time * 1000,
+                }
+                for (filename, line, function), (_, num_calls, self_time, cumulative_time, _) in functions[:num_functions]
+            ],
+        }
+
+    def save(self, path: str) -> str:
+        """
+        Save the profile in the `pstats` format to the directory `path`, e.g. to explore it with `snakeviz`.
+
+        Returns:
+            The path of the saved file.
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        file_path = os.path.join(path, f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S%f')}-{self.name}.prof")
+        self.profiler.dump_stats(file_path)
+
+        return file_path
+
+
+def start_profile(name: str):
+    """
+    Start profiling the current thread.
+
+    Returns:
+        The started `RequestProfile`, or `None` if another request is being profiled.
+    """
+
+    if not _profiler_lock.acquire(blocking=False):
+        return None
+
+    profile = RequestProfile(name)
+    _active.profile = profile
+
+    profile.start = time.perf_counter()
+    profile.profiler.enable()
+
+    return profile
+
+
+def stop_profile(profile: RequestProfile):
+    profile.profiler.disable()
+    profile.end = time.perf_counter()
+
+    _active.profile = None
+    _profiler_lock.release()
+
+
+def observe_stage(stage: str, start: float, end: float):
+    profile = getattr(_active, 'profile', None)
+    if profile is not None:
+        profile.add_span(stage, start, end)
+
+
+if profiling_enabled:
+    stage_observers.append(observe_stage)
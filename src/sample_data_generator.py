@@ -1,10 +1,12 @@
 from datetime import datetime, timedelta
-from math import *
 import numpy as np
 import numpy.typing
 import matplotlib.pyplot as plt
-from db import create_db_connection
+from measurements import measurement_store, bulk_insert_measurements, delete_measurements, MEASUREMENT_COLUMNS
+from calendar_features import busy_days, day_features
 from weather import is_unplayable_day
+import argparse
+import time
 
 
 NUM_DAY_SAMPLES = 24 * 60
@@ -14,7 +16,24 @@ MOCK_BASKET_ID = 0x23232323
 
 
 def gaussian(x, mu, var):
-    return (1 / sqrt(2 * pi * var)) * exp(-((x - mu) ** 2 / (2 * var)))
+    return (1 / np.sqrt(2 * np.pi * var)) * np.exp(-((x - mu) ** 2 / (2 * var)))
+
+
+def draw_samples(distribution: np.ndarray, num_samples: int, num_days: int, rng: np.random.Generator):
+    """
+    Draw the samples of `num_days` days at once from a distribution over `DAY_SAMPLES`, the number of samples of every
+    day varying by 20% around `num_samples`.
+
+    Returns:
+        A 2d-tuple containing the index of the day of every sample and the minute of the day it happened at.
+    """
+
+    n = np.maximum(np.round(num_samples + num_samples * rng.normal(scale=0.2, size=num_days)), 0).astype(np.int64)
+
+    day_idx = np.repeat(np.arange(num_days), n)
+    minutes = np.round(rng.choice(DAY_SAMPLES, np.sum(n), p=distribution) * 60).astype(np.int64)
+
+    return day_idx, minutes
 
 
 # ------------------------------------------------------------------------------------------------
@@ -36,20 +55,19 @@ class DayType:
     def __init__(self):
         pass
 
-    def draw_accelerometer_data_samples(self):
-        n = round(self.num_accelerometer_data_samples + self.num_accelerometer_data_samples * np.random.normal(scale=0.2))
-        accelerometer_data_samples = np.random.choice(DAY_SAMPLES, n, p=self.accelerometer_data_distribution)
-        return accelerometer_data_samples
+    def draw_samples(self, num_days: int, rng: np.random.Generator):
+        """
+        Draw the samples of every measurement source for `num_days` days of this type.
 
-    def draw_basket_samples(self):
-        n = round(self.num_basket_samples + self.num_basket_samples * np.random.normal(scale=0.2))
-        basket_samples = np.random.choice(DAY_SAMPLES, n, p=self.basket_distribution)
-        return basket_samples
+        Returns:
+            A dict mapping every measurement source to the 2d-tuple returned by `draw_samples`.
+        """
 
-    def draw_people_detected_samples(self):
-        n = round(self.num_people_detected_samples + self.num_people_detected_samples * np.random.normal(scale=0.2))
-        people_detected_samples = np.random.choice(DAY_SAMPLES, n, p=self.people_detected_distribution)
-        return people_detected_samples
+        return {
+            'accelerometer_data': draw_samples(self.accelerometer_data_distribution, self.num_accelerometer_data_samples, num_days, rng),
+            'score_data': draw_samples(self.basket_distribution, self.num_basket_samples, num_days, rng),
+            'people_detected_data': draw_samples(self.people_detected_distribution, self.num_people_detected_samples, num_days, rng),
+        }
 
 
 # ------------------------------------------------------------------------------------------------
@@ -78,7 +96,7 @@ class UnplayableDay(DayType):
         mu = (14.5 + 17) / 2
         var = 50
 
-        distr = np.vectorize(lambda x: gaussian(x, mu, var))(DAY_SAMPLES)
+        distr = gaussian(DAY_SAMPLES, mu, var)
         distr /= np.sum(distr)
 
         return distr
@@ -88,7 +106,7 @@ class UnplayableDay(DayType):
         mu = (14.5 + 17) / 2
         var = 50
 
-        distr = np.vectorize(lambda x: gaussian(x, mu, var))(DAY_SAMPLES)
+        distr = gaussian(DAY_SAMPLES, mu, var)
         distr /= np.sum(distr)
 
         return distr
@@ -98,7 +116,7 @@ class UnplayableDay(DayType):
         mu = (8 + 21) / 2
         var = 10
 
-        distr = np.vectorize(lambda x: gaussian(x, mu, var))(DAY_SAMPLES)
+        distr = gaussian(DAY_SAMPLES, mu, var)
         distr /= np.sum(distr)
 
         return distr
@@ -133,7 +151,7 @@ class BusyDay(DayType):
         mu = (17.5 + 19.5) / 2
         var = 29
 
-        distr = np.vectorize(lambda x: gaussian(x, mu, var))(DAY_SAMPLES)
+        distr = gaussian(DAY_SAMPLES, mu, var)
         distr /= np.sum(distr)
 
         return distr
@@ -143,7 +161,7 @@ class BusyDay(DayType):
         mu = (17.5 + 19.5) / 2
         var = 1
 
-        distr = np.vectorize(lambda x: gaussian(x, mu, var))(DAY_SAMPLES)
+        distr = gaussian(DAY_SAMPLES, mu, var)
         distr /= np.sum(distr)
 
         return distr
@@ -153,19 +171,15 @@ class BusyDay(DayType):
         mu = (8 + 21) / 2
         var = 20
 
-        distr = np.vectorize(lambda x: gaussian(x, mu, var))(DAY_SAMPLES)
+        distr = gaussian(DAY_SAMPLES, mu, var)
         distr /= np.sum(distr)
 
         return distr
 
     @staticmethod
     def is_(date: datetime):
-        busy = True
-        busy &= (1 <= date.month <= 5) or (9 <= date.month <= 12) # January to May OR September to December
-        busy &= not date.weekday() == 6 # Sunday
-        busy &= not (date.month == 12 and 23 <= date.day <= 31) # Christmas holiday
-        busy &= not (date.month == 1 and 1 <= date.day <= 6)
-        return busy
+        # The rule is shared with the features the forecast is fitted on
+        return bool(busy_days(np.datetime64(date, 'D'))[0])
 
 
 # ------------------------------------------------------------------------------------------------
@@ -199,8 +213,8 @@ class PlayableDay(DayType):
         var2 = 100
         peak2 = 3
 
-        distr = np.vectorize(lambda x: peak1 * gaussian(x, mu1, var1))(DAY_SAMPLES) + \
-            np.vectorize(lambda x: peak2 * gaussian(x, mu2, var2))(DAY_SAMPLES)
+        distr = peak1 * gaussian(DAY_SAMPLES, mu1, var1) + \
+            peak2 * gaussian(DAY_SAMPLES, mu2, var2)
 
         distr /= np.sum(distr)
 
@@ -216,8 +230,8 @@ class PlayableDay(DayType):
         var2 = 1
         peak2 = 3
 
-        distr = np.vectorize(lambda x: peak1 * gaussian(x, mu1, var1))(DAY_SAMPLES) + \
-            np.vectorize(lambda x: peak2 * gaussian(x, mu2, var2))(DAY_SAMPLES)
+        distr = peak1 * gaussian(DAY_SAMPLES, mu1, var1) + \
+            peak2 * gaussian(DAY_SAMPLES, mu2, var2)
 
         distr /= np.sum(distr)
 
@@ -233,8 +247,8 @@ class PlayableDay(DayType):
         var2 = 6
         peak2 = 5
 
-        distr = np.vectorize(lambda x: peak1 * gaussian(x, mu1, var1))(DAY_SAMPLES) + \
-            np.vectorize(lambda x: peak2 * gaussian(x, mu2, var2))(DAY_SAMPLES)
+        distr = peak1 * gaussian(DAY_SAMPLES, mu1, var1) + \
+            peak2 * gaussian(DAY_SAMPLES, mu2, var2)
 
         distr /= np.sum(distr)
 
@@ -253,122 +267,82 @@ busy_day = BusyDay()
 playable_day = PlayableDay()
 
 
-def sample_measurements_for_day(db_connection, date: datetime, verbose=True):
-    day_type = None
-
-    if UnplayableDay.is_(date):
-        day_type = unplayable_day
-    elif BusyDay.is_(date):
-        day_type = busy_day
-    else: # PlayableDay
-        day_type = playable_day
-
-    print(f"{date.strftime('%d %B %Y')} ({date.strftime('%A')}) → {day_type.name}")
-
-    accelerator_data_samples = day_type.draw_accelerometer_data_samples()
-    basket_samples = day_type.draw_basket_samples()
-    people_detected_samples = day_type.draw_people_detected_samples()
-
-    if verbose and date.month == 8:
-        fig, ax = plt.subplots(nrows=3)
-
-        fig.suptitle(f"{date.strftime('%d %B %Y')} ({date.strftime('%A')}) → {day_type.name}")
-
-        ax[0].bar(basket_samples, np.full(len(basket_samples), 1), color='r', width=0.1)
-        ax[0].set_xlim([0, 24])
-        ax[0].set_ylim([0, 2])
-        ax[0].set_xticks(range(24))
-        ax[0].set_title("Baskets")
-        
-        ax[1].bar(accelerator_data_samples, np.full(len(accelerator_data_samples), 1), color='b', width=0.1)
-        ax[1].set_xlim([0, 24])
-        ax[1].set_ylim([0, 2])
-        ax[1].set_xticks(range(24))
-        ax[1].set_title("Accelerometer data")
-
-        ax[2].bar(people_detected_samples, np.full(len(people_detected_samples), 1), color='g', width=0.1)
-        ax[2].set_xlim([0, 24])
-        ax[2].set_ylim([0, 2])
-        ax[2].set_xticks(range(24))
-        ax[2].set_title("People detected")
-
-        fig.tight_layout()
-
-        plt.show()
-
-    db_cursor = db_connection.cursor()
-
-    # Insert AccelerometerData
-    db_cursor.executemany("""
-        INSERT INTO accelerometer_data
-            (basket_id,
-                accel_x, accel_y, accel_z,
-                gyro_x, gyro_y, gyro_z,
-                temperature,
-                timestamp)
-        VALUES
-            (%(basket_id)s, %(accel_x)s, %(accel_y)s, %(accel_z)s, %(gyro_x)s, %(gyro_y)s, %(gyro_z)s, %(temperature)s, %(timestamp)s)
-    """, [
-        { 'basket_id': MOCK_BASKET_ID,
-            'accel_x': 23, 'accel_y': 23, 'accel_z': 23,
-            'gyro_x': 23, 'gyro_y': 23, 'gyro_z': 23,
-            'temperature': 23,
-            'timestamp': date + timedelta(minutes=round(day_t * 60))
-        } for day_t in accelerator_data_samples
-    ])
-
-    # Insert Basket
-    db_cursor.executemany("""
-        INSERT INTO score_data
-            (basket_id, timestamp)
-        VALUES
-            (%(basket_id)s, %(timestamp)s)
-    """, [
-        { 'basket_id': MOCK_BASKET_ID,
-            'timestamp': date + timedelta(minutes=round(day_t * 60))
-        } for day_t in basket_samples
-    ])
-
-    # Insert PeopleDetected
-    db_cursor.executemany("""
-        INSERT INTO people_detected_data
-            (basket_id, timestamp)
-        VALUES
-            (%(basket_id)s, %(timestamp)s)
-    """, [
-        { 'basket_id': MOCK_BASKET_ID,
-            'timestamp': date + timedelta(minutes=round(day_t * 60))
-        } for day_t in people_detected_samples
-    ])
-
-    db_cursor.close()
-
-    return (
-        accelerator_data_samples,
-        basket_samples,
-        people_detected_samples,
-    )
-
-
-def sample_measurements_between(from_date: datetime, to_date: datetime, verbose=True):
-    # Delete the old measurements referred to the mock basket
-    db_connection = create_db_connection()
-
-    db_cursor = db_connection.cursor()
-    
-    db_cursor.execute("DELETE FROM accelerometer_data WHERE basket_id=%s", (MOCK_BASKET_ID,))
-    db_cursor.execute("DELETE FROM score_data WHERE basket_id=%s", (MOCK_BASKET_ID,))
-    db_cursor.execute("DELETE FROM people_detected_data WHERE basket_id=%s", (MOCK_BASKET_ID,))
+def sample_measurements(days: np.ndarray, rng: np.random.Generator):
+    """
+    Generate the measurements of a basket for all the given days at once.
+
+    Parameters:
+        - `days`: The `datetime64[D]` array of the days.
+        - `rng`: The random generator the samples are drawn from.
+
+    Returns:
+        A dict mapping every measurement source to the sorted `int64` array of the instants of its measurements, as
+        nanoseconds since the UNIX epoch.
+    """
+
+    # See "How a day is classified?" in the docs
+    features = day_features(days)
+    day_types = np.where(features['unplayable'], 0, np.where(features['busy'], 1, 2))
+
+    samples = {}
+
+    for day_type_idx, day_type in enumerate((unplayable_day, busy_day, playable_day)):
+        type_days = days[day_types == day_type_idx].astype('datetime64[ns]').astype(np.int64)
+
+        for source, (day_idx, minutes) in day_type.draw_samples(len(type_days), rng).items():
+            samples.setdefault(source, []).append(type_days[day_idx] + minutes * 60 * 10**9)
+
+    return {source: np.sort(np.concatenate(t_ns)) for source, t_ns in samples.items()}
+
+
+def sample_measurements_between(from_date: datetime, to_date: datetime, basket_ids=(MOCK_BASKET_ID,), seed: int = None):
+    """
+    Replace the measurements of every basket of `basket_ids` with sample ones, generated for every day between
+    `from_date` and `to_date`, and report the throughput of the generation and of the insertion.
+
+    Returns:
+        The number of inserted measurements.
+    """
 
-    db_cursor.close()
+    rng = np.random.default_rng(seed)
+    days = np.arange(np.datetime64(from_date, 'D'), np.datetime64(to_date, 'D') + 1)
 
-    date = from_date
-    while (date <= to_date):
-        sample_measurements_for_day(db_connection, date, verbose)
-        date += timedelta(days=1)
+    num_rows = 0
+    generation_time = 0.
+    insertion_time = 0.
 
-    db_connection.commit()
-    db_connection.close()
+    db_connection = measurement_store.connect()
+
+    try:
+        for basket_id in basket_ids:
+            start = time.perf_counter()
+            measurements = sample_measurements(days, rng)
+            generation_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+
+            # Delete the old measurements referred to the basket
+            delete_measurements(basket_id, db_connection)
+
+            basket_num_rows = 0
+            for source, t_ns in measurements.items():
+                # The accelerometer readings aren't used by the occupation, so they're constant
+                values = {column: 23 for column in MEASUREMENT_COLUMNS[source]}
+                basket_num_rows += bulk_insert_measurements(source, basket_id, t_ns, values, db_connection)
+
+            db_connection.commit()
+            insertion_time += time.perf_counter() - start
+
+            num_rows += basket_num_rows
+            print(f"Basket {basket_id}: {basket_num_rows} measurement(s) over {len(days)} day(s)")
+
+    finally:
+        db_connection.close()
+
+    print(f"Generated {num_rows} measurement(s) in {generation_time:.2f}s ({num_rows / max(generation_time, 1e-9):.0f} rows/s)")
+    print(f"Inserted {num_rows} measurement(s) in {insertion_time:.2f}s ({num_rows / max(insertion_time, 1e-9):.0f} rows/s)")
+
+    return num_rows
 
 
 def show_day_type_distributions(day_type: DayType, **kwargs):
@@ -396,17 +370,34 @@ def show_day_type_distributions(day_type: DayType, **kwargs):
     plt.show()
 
 
-if __name__ == "__main__":
-    verbose=False
+def main():
+    parser = argparse.ArgumentParser(description="")
 
-    try:
-        if verbose:
-            show_day_type_distributions(unplayable_day)
-            show_day_type_distributions(busy_day)
-            show_day_type_distributions(playable_day)
+    parser.add_argument("-f", "--from_date", type=datetime.fromisoformat, default=datetime(2015, 1, 1))
+    parser.add_argument("-t", "--to_date", type=datetime.fromisoformat, default=datetime(2016, 12, 31))
+    parser.add_argument("-b", "--basket", type=int, action='append')
+    parser.add_argument("-n", "--num_baskets", type=int)
+    parser.add_argument("-s", "--seed", type=int)
+    parser.add_argument("-v", "--verbose", action='store_true')
+
+    args = parser.parse_args()
 
-        sample_measurements_between(datetime(2015, 1, 1), datetime(2016, 12, 31), verbose=verbose)
+    if args.verbose:
+        show_day_type_distributions(unplayable_day)
+        show_day_type_distributions(busy_day)
+        show_day_type_distributions(playable_day)
 
+    # A fleet of baskets gets consecutive IDs starting from the mock basket
+    if args.num_baskets is not None:
+        basket_ids = range(MOCK_BASKET_ID, MOCK_BASKET_ID + args.num_baskets)
+    else:
+        basket_ids = args.basket or [MOCK_BASKET_ID]
+
+    try:
+        sample_measurements_between(args.from_date, args.to_date, basket_ids, args.seed)
     except KeyboardInterrupt as _:
         pass
 
+
+if __name__ == "__main__":
+    main()
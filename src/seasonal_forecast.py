@@ -0,0 +1,93 @@
+import numpy as np
+import json
+
+
+# The occupation is sampled every 30min, so a week is made of 7 * 48 slots. Slot 0 starts on Monday at 00:00
+NUM_WEEK_SLOTS = 7 * 24 * 2
+
+SLOT_NS = 30 * 60 * 10**9
+WEEK_NS = 7 * 24 * 60 * 60 * 10**9
+
+
+def week_slots(t_ns: np.ndarray) -> np.ndarray:
+    """
+    Returns:
+        The slot of the week every instant of `t_ns`, expressed as nanoseconds since the UNIX epoch, falls in.
+    """
+
+    # 1970-01-01 was a Thursday, i.e. 3 days after the beginning of the week
+    return (t_ns // SLOT_NS + 3 * 24 * 2) % NUM_WEEK_SLOTS
+
+
+class SeasonalProfile:
+    """
+    The occupation of a basket on every slot of the week, together with how much it's reduced on unplayable days.
+    """
+
+    profile: np.ndarray  # float64, one item per slot of the week
+    unplayable_factor: float
+
+    def __init__(self, profile, unplayable_factor):
+        self.profile = profile
+        self.unplayable_factor = unplayable_factor
+
+    def predict(self, t_ns: np.ndarray, unplayable: np.ndarray) -> np.ndarray:
+        """
+        Parameters:
+            - `t_ns`: The instants to predict the occupation at, as nanoseconds since the UNIX epoch.
+            - `unplayable`: Whether every instant of `t_ns` falls in an unplayable day.
+
+        Returns:
+            The predicted occupation at every instant of `t_ns`.
+        """
+
+        return self.profile[week_slots(t_ns)] * np.where(unplayable, self.unplayable_factor, 1.0)
+
+    def to_json(self) -> str:
+        return json.dumps({
+            'profile': self.profile.tolist(),
+            'unplayable_factor': self.unplayable_factor,
+        })
+
+    @staticmethod
+    def from_json(model_json: str) -> 'SeasonalProfile':
+        model = json.loads(model_json)
+        return SeasonalProfile(np.array(model['profile'], dtype=np.float64), model['unplayable_factor'])
+
+
+def fit_seasonal_profile(t_ns: np.ndarray, occupation: np.ndarray, unplayable: np.ndarray, present_ns: int, half_life_weeks: float) -> SeasonalProfile:
+    """
+    Fit the weekly profile of the occupation of a basket, averaging every slot of the week over the playable days of
+    the history. The weeks are weighted exponentially, so that recent habits prevail over older ones.
+
+    Parameters:
+        - `t_ns`: The instants of the history, as nanoseconds since the UNIX epoch.
+        - `occupation`: The occupation at every instant of `t_ns`.
+        - `unplayable`: Whether every instant of `t_ns` falls in an unplayable day.
+        - `present_ns`: The instant the weeks are counted back from.
+        - `half_life_weeks`: The number of weeks after which the weight of the history is halved.
+
+    Returns:
+        The fitted `SeasonalProfile`.
+    """
+
+    age_weeks = (present_ns - t_ns) // WEEK_NS
+    weights = 0.5 ** (age_weeks / half_life_weeks)
+
+    slots = week_slots(t_ns)
+    playable = ~unplayable
+
+    weight_sums = np.bincount(slots[playable], weights=weights[playable], minlength=NUM_WEEK_SLOTS)
+    occupation_sums = np.bincount(slots[playable], weights=(weights * occupation)[playable], minlength=NUM_WEEK_SLOTS)
+
+    # The slots never observed on a playable day get the average occupation
+    mean_occupation = np.sum(occupation_sums) / np.sum(weight_sums) if np.sum(weight_sums) > 0 else 0.0
+    profile = np.full(NUM_WEEK_SLOTS, mean_occupation)
+    np.divide(occupation_sums, weight_sums, out=profile, where=weight_sums > 0)
+
+    # How much of the usual occupation is left on unplayable days
+    expected = np.sum((weights * profile[slots])[unplayable])
+    observed = np.sum((weights * occupation)[unplayable])
+    unplayable_factor = float(np.clip(observed / expected, 0, 1)) if expected > 0 else 1.0
+
+    return SeasonalProfile(profile, unplayable_factor)
@@ -11,38 +11,293 @@ import os
 logging.basicConfig(level=getattr(logging, os.environ.get('LOG_LEVEL', "WARNING").upper(), None))
 
 
-from flask import Flask, request
-from datetime import datetime
-from occupation import evaluate_occupation
-from occupation_forecast import evaluate_occupation_forecast
+from flask import Flask, g, make_response, request
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from occupation import (
+    evaluate_occupation,
+    evaluate_occupation_for_baskets,
+    invalidate_cached_occupation,
+    occupation_cache,
+    occupation_generation,
+    occupation_sealed_until,
+    to_epoch_ns,
+)
+from occupation_forecast import (
+    evaluate_occupation_forecast,
+    evaluate_occupation_forecast_at,
+    evaluate_occupation_forecast_horizon,
+    forecast_cache,
+    forecast_engine,
+    forecasters,
+    warm_forecast_cache,
+)
+from db import db_pool_stats
+from forecast_jobs import forecast_jobs, TooManyJobsError
+from concurrent.futures import wait, TimeoutError as FutureTimeoutError
+from measurements import insert_measurements, measurement_store, MEASUREMENT_SOURCES, MEASUREMENT_COLUMNS
+from live_occupation import live_occupation, live_occupation_enabled
+from weekly_profile import weekly_profiles, weekly_profile_max_days
+from occupation_rollup import rewind_rollup
+from metrics import collected, counter, histogram, registry
+from profiling import profiling_dir, profiling_enabled, start_profile, stop_profile
+import hashlib
+import json
+import time
 
 
 app = Flask(__name__)
 
+# The number of seconds the occupation at sealed instants can be cached by HTTP clients before revalidating it. Kept
+# short, since measurements written to the DB out of band change it without the webservice noticing
+occupation_http_max_age = int(os.environ.get('OCCUPATION_HTTP_MAX_AGE', 60))
+
+# The largest batch of occupations a request can ask for: the measurements of every basket are fetched over the whole
+# span of the instants at once, so the number of baskets and the span bound the memory a request takes
+occupation_batch_max_baskets = int(os.environ.get('OCCUPATION_BATCH_MAX_BASKETS', 1000))
+occupation_batch_max_instants = int(os.environ.get('OCCUPATION_BATCH_MAX_INSTANTS', 10000))
+occupation_batch_max_span = timedelta(seconds=int(os.environ.get('OCCUPATION_BATCH_MAX_SPAN', 7 * 24 * 60 * 60)))
+
+
+request_duration = histogram('http_request_duration_seconds', "Time spent serving the requests, by route", ('route', 'method'))
+requests_served = counter('http_requests_total', "Requests served, by route and status", ('route', 'method', 'status'))
+
+collected('db_pool_connections_in_use', "Connections of the DB pool checked out", 'gauge', lambda: db_pool_stats()['in_use'])
+collected('db_pool_waiting', "Threads waiting for a connection of the DB pool", 'gauge', lambda: db_pool_stats()['waiting'])
+collected('live_occupation_measurements', "Measurements held in memory to serve the current occupation", 'gauge', lambda: live_occupation.stats()['measurements'])
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request(response):
+    # Label by the route pattern rather than the path, so that e.g. every forecast job shares the same series
+    route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+    request_duration.observe(time.perf_counter() - g.request_start, route=route, method=request.method)
+    requests_served.inc(route=route, method=request.method, status=str(response.status_code))
+
+    return response
+
+
+# The profiling hooks are only registered when enabled, so that requests don't pay for them otherwise
+if profiling_enabled:
+    @app.before_request
+    def start_request_profile():
+        g.profile_requested = request.headers.get('X-Profile', '').lower() in ('1', 'true', 'yes')
+        g.profile = start_profile(request.endpoint or 'unmatched') if g.profile_requested else None
+
+    @app.after_request
+    def attach_request_profile(response):
+        if not g.get('profile_requested'):
+            return response
+
+        profile = g.profile
+        if profile is None:
+            summary = { 'error': "Another request is being profiled", }
+        else:
+            stop_profile(profile)
+            summary = profile.summary()
+
+            if profiling_dir:
+                summary['file'] = profile.save(profiling_dir)
+
+        # The profile is returned alongside the fields of JSON objects, other responses only save it
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body['profile'] = summary
+            response.set_data(json.dumps(body))
+
+        return response
+
+    @app.teardown_request
+    def discard_request_profile(_):
+        # Stop the profiler of the requests that failed before their profile could be attached
+        profile = g.get('profile')
+        if profile is not None and profile.end is None:
+            stop_profile(profile)
+
 
 def require_field(name: str):
     if not name in request.args:
         raise ValueError({ 'error': f"Missing required field: \"{name}\"", }, 400)
 
 
+def require_json_field(body, name: str):
+    if not isinstance(body, dict) or not name in body:
+        raise ValueError({ 'error': f"Missing required field: \"{name}\"", }, 400)
+
+
+def bad_request(e: Exception):
+    """
+    Returns:
+        The response to a request whose fields are missing or malformed.
+    """
+
+    # The `require_*` helpers raise the response itself, parsing a malformed field raises a plain error
+    if len(e.args) == 2 and isinstance(e.args[0], dict):
+        return e.args
+
+    return { 'error': f"Invalid request: {e}", }, 400
+
+
+def require_forecast_engine(fields) -> str:
+    engine = fields.get('engine', forecast_engine)
+    if not engine in forecasters:
+        raise ValueError({ 'error': f"Unknown forecast engine: \"{engine}\"", }, 400)
+    return engine
+
+
+def parse_instant(value) -> datetime:
+    """
+    Returns:
+        The ISO 8601 instant `value` as a naive UTC `datetime`, like the instants the measurements are stored with.
+    """
+
+    t = datetime.fromisoformat(value)
+    if t.tzinfo is not None:
+        t = t.astimezone(timezone.utc).replace(tzinfo=None)
+    return t
+
+
 @app.route("/api/occupation", methods=['GET'])
 def occupation():
     try:
         require_field('basket')
-        require_field('t')
-    except Exception as e:
-        return e.args
 
-    basket_id = int(request.args['basket'])
-    t = datetime.fromisoformat(request.args['t'])
+        basket_id = int(request.args['basket'])
+        t = parse_instant(request.args['t']) if 't' in request.args else None
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    if t is not None:
+        o_t = evaluate_occupation(basket_id, t)
+
+        # The occupation at a sealed instant only changes if late measurements are ingested, which bumps the generation
+        # of the basket, hence its ETag
+        if to_epoch_ns(t)[0] <= occupation_sealed_until():
+            response = make_response({
+                'occupation': o_t,
+                't': t.isoformat(),
+            }, 200)
+
+            generation = occupation_generation(basket_id)
+            response.set_etag(hashlib.sha1(f"{basket_id}:{generation}:{t.isoformat()}:{float(o_t)!r}".encode()).hexdigest())
+            response.cache_control.private = True
+            response.cache_control.max_age = occupation_http_max_age
+
+            return response.make_conditional(request)
+    else:
+        # The current occupation, served from the in-memory measurements if possible
+        t = datetime.utcnow()
+        if live_occupation_enabled:
+            o_t = live_occupation.evaluate(basket_id, np.datetime64(t, 'ns').astype(np.int64))
+        else:
+            o_t = evaluate_occupation(basket_id, t)
 
-    o_t = evaluate_occupation(basket_id, t)
     return {
         'occupation': o_t,
         't': t.isoformat(),
+    }, 200, {'Cache-Control': 'no-cache'}
+
+
+@app.route("/api/occupation_batch", methods=['POST'])
+def occupation_batch():
+    body = request.get_json(silent=True)
+
+    try:
+        require_json_field(body, 'baskets')
+        require_json_field(body, 't')
+
+        basket_ids = [int(basket_id) for basket_id in body['baskets']]
+        t = [parse_instant(t) for t in body['t']]
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    if not basket_ids or not t:
+        return { 'occupation': {}, 't': [], }, 200
+
+    if len(set(basket_ids)) > occupation_batch_max_baskets:
+        return { 'error': f"At most {occupation_batch_max_baskets} baskets can be requested at once", }, 400
+    if len(t) > occupation_batch_max_instants:
+        return { 'error': f"At most {occupation_batch_max_instants} instants can be requested at once", }, 400
+    if max(t) - min(t) > occupation_batch_max_span:
+        return { 'error': f"The instants must span at most {occupation_batch_max_span}", }, 400
+
+    o_t = evaluate_occupation_for_baskets(basket_ids, np.array(t, dtype='datetime64[ns]'))
+    return {
+        'occupation': {
+            str(basket_id): np.atleast_1d(basket_o_t).tolist() for basket_id, basket_o_t in o_t.items()
+        },
+        't': [t.isoformat() for t in t],
     }, 200
 
 
+@app.route("/api/measurements", methods=['POST'])
+def measurements():
+    body = request.get_json(silent=True)
+    body = body if isinstance(body, list) else [body]
+
+    rows_by_source = {source: [] for source in MEASUREMENT_SOURCES}
+
+    try:
+        for measurement in body:
+            require_json_field(measurement, 'basket')
+            require_json_field(measurement, 'source')
+            require_json_field(measurement, 't')
+
+            source = measurement['source']
+            if source not in MEASUREMENT_SOURCES:
+                raise ValueError({ 'error': f"Unknown measurement source: \"{source}\"", }, 400)
+
+            for column in MEASUREMENT_COLUMNS[source]:
+                require_json_field(measurement, column)
+
+            rows_by_source[source].append({
+                'basket_id': int(measurement['basket']),
+                'timestamp': parse_instant(measurement['t']),
+                **{
+                    column: float(measurement[column]) if measurement[column] is not None else None
+                    for column in MEASUREMENT_COLUMNS[source]
+                },
+            })
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    # Late measurements change the occupation at instants that may have already been cached
+    earliest_by_basket = {}
+    for rows in rows_by_source.values():
+        for row in rows:
+            earliest_by_basket[row['basket_id']] = min(row['timestamp'], earliest_by_basket.get(row['basket_id'], row['timestamp']))
+
+    # Write through to the DB first, so that the in-memory state never holds measurements that weren't stored
+    db_connection = measurement_store.connect()
+    try:
+        for source, rows in rows_by_source.items():
+            if rows:
+                insert_measurements(source, rows, db_connection)
+        db_connection.commit()
+    finally:
+        db_connection.close()
+
+    for basket_id, earliest in earliest_by_basket.items():
+        invalidate_cached_occupation(basket_id, earliest)
+        weekly_profiles.invalidate(basket_id, earliest)
+        rewind_rollup(basket_id, earliest)
+
+    if live_occupation_enabled:
+        for source, rows in rows_by_source.items():
+            for row in rows:
+                live_occupation.add_measurements(row['basket_id'], source, [np.datetime64(row['timestamp'], 'ns').astype(np.int64)])
+
+    return {
+        'inserted': sum(len(rows) for rows in rows_by_source.values()),
+    }, 201
+
+
 @app.route("/api/forecast_occupation", methods=["GET"])
 def forecast_occupation():
     try:
@@ -51,29 +306,219 @@ def forecast_occupation():
         require_field('present')
         require_field('num_history_days')
         require_field('num_predicted_days')
-    except Exception as e:
-        return e.args
+        engine = require_forecast_engine(request.args)
 
-    basket_id = int(request.args['basket'])
-    present = datetime.fromisoformat(request.args['present'])
-    num_history_days = int(request.args['num_history_days'])
-    num_predicted_days = int(request.args['num_predicted_days'])
-    t = datetime.fromisoformat(request.args['t'])
+        basket_id = int(request.args['basket'])
+        present = parse_instant(request.args['present'])
+        num_history_days = int(request.args['num_history_days'])
+        num_predicted_days = int(request.args['num_predicted_days'])
+        t = parse_instant(request.args['t'])
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    try:
+        o_t = evaluate_occupation_forecast(
+            basket_id,
+            present,
+            num_history_days,
+            num_predicted_days,
+            t,
+            engine=engine
+        )
+    except FutureTimeoutError:
+        return { 'error': "Timed out waiting for the forecast fitted by a concurrent request", }, 504
 
-    o_t = evaluate_occupation_forecast(
-        basket_id,
-        present,
-        num_history_days,
-        num_predicted_days,
-        t
-    )
     return {
         'occupation': o_t,
         't': t.isoformat(),
     }, 200
 
 
+@app.route("/api/forecast_occupation_series", methods=["GET"])
+def forecast_occupation_series():
+    try:
+        require_field('basket')
+        require_field('present')
+        require_field('num_history_days')
+        require_field('num_predicted_days')
+        engine = require_forecast_engine(request.args)
+
+        basket_id = int(request.args['basket'])
+        present = parse_instant(request.args['present'])
+        num_history_days = int(request.args['num_history_days'])
+        num_predicted_days = int(request.args['num_predicted_days'])
+
+        t = None
+        if 't' in request.args:
+            t = np.array([parse_instant(t) for t in request.args.getlist('t')], dtype='datetime64[ns]')
+
+        resolution = timedelta(minutes=int(request.args.get('resolution', 30)))
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    try:
+        if t is not None:
+            o_t = evaluate_occupation_forecast_at(
+                basket_id,
+                present,
+                num_history_days,
+                num_predicted_days,
+                t,
+                engine=engine
+            )
+        else:
+            if resolution <= timedelta(0):
+                return { 'error': "\"resolution\" must be positive", }, 400
+
+            t, o_t = evaluate_occupation_forecast_horizon(
+                basket_id,
+                present,
+                num_history_days,
+                num_predicted_days,
+                resolution,
+                engine=engine
+            )
+    except FutureTimeoutError:
+        return { 'error': "Timed out waiting for the forecast fitted by a concurrent request", }, 504
+
+    return {
+        'occupation': o_t.tolist(),
+        't': np.datetime_as_string(t, unit='s').tolist(),
+    }, 200
+
+
+@app.route("/api/weekly_profile", methods=["GET"])
+def weekly_profile():
+    try:
+        require_field('basket')
+
+        basket_id = int(request.args['basket'])
+        num_days = int(request.args.get('num_days', 90))
+        resolution = int(request.args.get('resolution', 60))
+        utc_offset = int(request.args.get('utc_offset', 0))
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    if not 0 < num_days <= weekly_profile_max_days:
+        return { 'error': f"\"num_days\" must be between 1 and {weekly_profile_max_days}", }, 400
+    if resolution <= 0 or resolution % 30 != 0 or (24 * 60) % resolution != 0:
+        return { 'error': "\"resolution\" must be a multiple of 30 dividing a day", }, 400
+    if utc_offset % 30 != 0:
+        return { 'error': "\"utc_offset\" must be a multiple of 30", }, 400
+
+    t_from_ns, t_to_ns, profile, counts = weekly_profiles.profile(
+        basket_id,
+        num_days,
+        resolution // 30,
+        utc_offset * 60 * 10**9
+    )
+
+    return {
+        'occupation': [[None if np.isnan(o) else o for o in day] for day in profile.tolist()],
+        'samples': counts.tolist(),
+        'resolution': resolution,
+        'from': np.datetime_as_string(np.datetime64(t_from_ns, 'ns'), unit='s'),
+        'to': np.datetime_as_string(np.datetime64(t_to_ns, 'ns'), unit='s'),
+    }, 200
+
+
+@app.route("/api/forecast_jobs", methods=["POST"])
+def submit_forecast_job():
+    body = request.get_json(silent=True)
+
+    try:
+        require_json_field(body, 'basket')
+        require_json_field(body, 'present')
+        require_json_field(body, 'num_history_days')
+        require_json_field(body, 'num_predicted_days')
+        engine = require_forecast_engine(body)
+
+        basket_id = int(body['basket'])
+        present = parse_instant(body['present'])
+        num_history_days = int(body['num_history_days'])
+        num_predicted_days = int(body['num_predicted_days'])
+
+        t = None
+        if 't' in body:
+            t = np.array([parse_instant(t) for t in body['t']], dtype='datetime64[ns]')
+
+        resolution = timedelta(minutes=int(body.get('resolution', 30)))
+    except (KeyError, ValueError, TypeError) as e:
+        return bad_request(e)
+
+    if resolution <= timedelta(0):
+        return { 'error': "\"resolution\" must be positive", }, 400
+
+    try:
+        job = forecast_jobs.submit(
+            basket_id,
+            present,
+            num_history_days,
+            num_predicted_days,
+            t,
+            resolution,
+            engine
+        )
+    except TooManyJobsError as e:
+        return { 'error': str(e), }, 503
+
+    return {
+        'job': job.id,
+        'status': job.status,
+    }, 202
+
+
+@app.route("/api/forecast_jobs/<job_id>", methods=["GET"])
+def forecast_job(job_id: str):
+    job = forecast_jobs.get(job_id)
+    if job is None:
+        return { 'error': f"Unknown job: \"{job_id}\"", }, 404
+
+    if 'wait' in request.args:
+        try:
+            timeout = min(float(request.args['wait']), 60)
+        except ValueError as e:
+            return bad_request(e)
+
+        wait([job.future], timeout=timeout)
+
+    response = {
+        'job': job.id,
+        'status': job.status,
+    }
+
+    if job.status == 'done':
+        t, o_t = job.result()
+        response['occupation'] = o_t.tolist()
+        response['t'] = np.datetime_as_string(t, unit='s').tolist()
+    elif job.status == 'failed':
+        response['error'] = str(job.future.exception())
+
+    return response, 200
+
+
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    return {
+        'db_pool': db_pool_stats(),
+        'forecast_cache': forecast_cache.stats(),
+        'occupation_cache': occupation_cache.stats(),
+        'weekly_profiles': weekly_profiles.stats(),
+        'live_occupation': live_occupation.stats(),
+        'forecast_jobs': forecast_jobs.stats(),
+    }, 200
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return registry.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
 if __name__ == '__main__':
+    # Serve the forecasts fitted before the last restart without fitting them again. Not done on import, since the
+    # spawned forecast job workers import this module again
+    warm_forecast_cache()
+
     app.run(
         host=os.environ["WEBSERVICE_HOST"],
         port=os.environ["WEBSERVICE_PORT"],
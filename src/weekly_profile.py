@@ -0,0 +1,170 @@
+from occupation import occupation_sealed_until, to_epoch_ns
+from occupation_rollup import evaluate_occupation_history
+from seasonal_forecast import NUM_WEEK_SLOTS, SLOT_NS, week_slots
+from cache import LRUCache
+from metrics import collected, stage_timer
+from datetime import datetime
+import numpy as np
+import logging
+import os
+import threading
+
+
+logger = logging.getLogger("weekly_profile")
+#logger.setLevel(getattr(logging, os.environ['LOG_LEVEL'].upper(), None))
+
+
+# The longest history, in days, a weekly profile can be averaged over
+weekly_profile_max_days = int(os.environ.get('WEEKLY_PROFILE_MAX_DAYS', 365))
+
+# The number of baskets whose occupation history is kept in memory to refresh their weekly profile
+weekly_profile_cache_max_entries = int(os.environ.get('WEEKLY_PROFILE_CACHE_MAX_ENTRIES', 1024))
+
+SAMPLES_PER_DAY = 24 * 2
+
+
+def weekly_profile(t_ns: np.ndarray, occupation: np.ndarray, slots_per_bucket: int = 1, utc_offset_ns: int = 0):
+    """
+    Average the occupation over every bucket of the week.
+
+    Parameters:
+        - `t_ns`: The instants of the occupation samples, as nanoseconds since the UNIX epoch.
+        - `occupation`: The occupation at every instant of `t_ns`.
+        - `slots_per_bucket`: The number of 30min slots merged in a bucket, e.g. `2` for a 7x24 profile.
+        - `utc_offset_ns`: The offset of the timezone the week is split in, so that buckets follow local days.
+
+    Returns:
+        A 2d-tuple containing the average occupation and the number of samples of every bucket, as arrays with a row
+        per day of the week starting from Monday. Buckets without samples have a `NaN` occupation.
+    """
+
+    num_buckets = NUM_WEEK_SLOTS // slots_per_bucket
+    buckets = week_slots(t_ns + utc_offset_ns) // slots_per_bucket
+
+    counts = np.bincount(buckets, minlength=num_buckets)
+    sums = np.bincount(buckets, weights=occupation, minlength=num_buckets)
+
+    profile = np.full(num_buckets, np.nan)
+    np.divide(sums, counts, out=profile, where=counts > 0)
+
+    return profile.reshape(7, -1), counts.reshape(7, -1)
+
+
+class OccupationSamples:
+    """
+    The occupation of a basket every 30min, over a contiguous range of sealed instants starting at `first_ns`.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.first_ns = 0
+        self.occupation = np.empty(0)
+
+    @property
+    def last_ns(self) -> int:
+        return self.first_ns + (len(self.occupation) - 1) * SLOT_NS
+
+
+class WeeklyProfiles:
+    """
+    Serves the weekly profile of the occupation of the baskets, keeping their occupation history in memory so that
+    refreshing a profile only evaluates the instants sealed since the last refresh.
+    """
+
+    def __init__(self, max_entries: int, max_days: int):
+        self.max_days = max_days
+
+        self._lock = threading.Lock()
+        self._samples = LRUCache(max_entries=max_entries)
+
+    def history(self, basket_id: int, num_days: int, now: datetime = None):
+        """
+        Returns:
+            A 2d-tuple containing the `int64` array of the sealed instants of the last `num_days` days, every 30min,
+            as nanoseconds since the UNIX epoch, and the array of the occupation at those instants.
+        """
+
+        end_ns = occupation_sealed_until(now) // SLOT_NS * SLOT_NS
+        start_ns = end_ns - (num_days * SAMPLES_PER_DAY - 1) * SLOT_NS
+
+        samples = self._get_samples(basket_id)
+
+        with samples.lock:
+            if len(samples.occupation) == 0 or start_ns > samples.last_ns + SLOT_NS or end_ns < samples.first_ns - SLOT_NS:
+                samples.first_ns = start_ns
+                samples.occupation = self._evaluate(basket_id, start_ns, end_ns)
+            else:
+                before = self._evaluate(basket_id, start_ns, samples.first_ns - SLOT_NS)
+                after = self._evaluate(basket_id, samples.last_ns + SLOT_NS, end_ns)
+
+                samples.first_ns -= len(before) * SLOT_NS
+                samples.occupation = np.concatenate([before, samples.occupation, after])
+
+            # Forget the instants older than the longest history
+            num_dropped = max(0, (max(end_ns, samples.last_ns) - samples.first_ns) // SLOT_NS + 1 - self.max_days * SAMPLES_PER_DAY)
+            if num_dropped > 0:
+                samples.first_ns += num_dropped * SLOT_NS
+                samples.occupation = samples.occupation[num_dropped:]
+
+            begin = (start_ns - samples.first_ns) // SLOT_NS
+            occupation = samples.occupation[begin:begin + num_days * SAMPLES_PER_DAY]
+
+        return start_ns + np.arange(len(occupation), dtype=np.int64) * SLOT_NS, occupation
+
+    def profile(self, basket_id: int, num_days: int, slots_per_bucket: int = 1, utc_offset_ns: int = 0, now: datetime = None):
+        """
+        Returns:
+            A 4d-tuple containing the first and the last instant of the history, as nanoseconds since the UNIX epoch,
+            and the average occupation and the number of samples of every bucket of the week (see `weekly_profile`).
+        """
+
+        t_ns, occupation = self.history(basket_id, num_days, now)
+        profile, counts = weekly_profile(t_ns, occupation, slots_per_bucket, utc_offset_ns)
+
+        return int(t_ns[0]), int(t_ns[-1]), profile, counts
+
+    def invalidate(self, basket_id: int, from_t):
+        """
+        Forget the occupation of a basket at the instants following `from_t`, the instant of the earliest measurement
+        just ingested for the basket, so that it's evaluated again on the next refresh.
+        """
+
+        from_ns = int(to_epoch_ns(from_t)[0])
+
+        # Measurements ingested in time only contribute to instants that haven't been sealed, hence evaluated, yet
+        if from_ns > occupation_sealed_until():
+            return
+
+        samples = self._samples.get(int(basket_id))
+        if samples is None:
+            return
+
+        with samples.lock:
+            num_kept = max(0, -(-(from_ns - samples.first_ns) // SLOT_NS))
+            samples.occupation = samples.occupation[:num_kept]
+
+    def stats(self):
+        return self._samples.stats()
+
+    def _get_samples(self, basket_id: int) -> OccupationSamples:
+        with self._lock:
+            samples = self._samples.get(int(basket_id))
+            if samples is None:
+                samples = OccupationSamples()
+                self._samples.put(int(basket_id), samples)
+            return samples
+
+    def _evaluate(self, basket_id: int, from_ns: int, to_ns: int) -> np.ndarray:
+        if from_ns > to_ns:
+            return np.empty(0)
+
+        t = (from_ns + np.arange((to_ns - from_ns) // SLOT_NS + 1, dtype=np.int64) * SLOT_NS).astype('datetime64[ns]')
+
+        with stage_timer('weekly_profile_history'):
+            return evaluate_occupation_history(basket_id, t)
+
+
+weekly_profiles = WeeklyProfiles(weekly_profile_cache_max_entries, weekly_profile_max_days)
+
+collected('weekly_profile_cache_hits_total', "Weekly profiles refreshed from the occupation history kept in memory", 'counter', lambda: weekly_profiles.stats()['hits'])
+collected('weekly_profile_cache_entries', "Baskets whose occupation history is kept in memory for their weekly profile", 'gauge', lambda: weekly_profiles.stats()['entries'])
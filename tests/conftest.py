@@ -0,0 +1,18 @@
+import os
+import sys
+import tempfile
+
+
+# The modules read their configuration from the environment when imported: run them against a throwaway SQLite
+# store, whatever the local `.env` says, with every optional component disabled
+os.environ['MEASUREMENT_STORE'] = 'sqlite'
+os.environ['MEASUREMENT_STORE_PATH'] = os.path.join(tempfile.mkdtemp(prefix='occupation-tests-'), 'measurements.sqlite3')
+os.environ['EVENT_ARCHIVE_DIR'] = ''
+os.environ['FORECAST_STORE_DIR'] = ''
+os.environ['LIVE_OCCUPATION_ENABLED'] = 'false'
+os.environ['ROLLUP_ENABLED'] = 'false'
+os.environ['PRECOMPUTED_FORECAST_ENABLED'] = 'false'
+os.environ['PROFILING_ENABLED'] = 'false'
+
+# The modules live flat in `src` and import each other by name
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,155 @@
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import threading
+
+import pytest
+
+from cache import LRUCache, SingleFlight
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(max_entries=2)
+
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+
+    cache.put('c', 3)
+
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_lru_expires_entries():
+    cache = LRUCache(max_entries=8, ttl=60)
+
+    cache.put('fresh', 1)
+    cache.put('stale', 2, age=61)
+
+    assert cache.get('fresh') == 1
+    assert cache.get('stale', 'missing') == 'missing'
+    assert cache.stats()['expirations'] == 1
+
+
+def test_lru_byte_cap():
+    cache = LRUCache(max_entries=8, max_bytes=10, sizeof=len)
+
+    cache.put('a', 'xxxx')
+    cache.put('b', 'xxxx')
+    cache.put('c', 'xxxx')
+
+    assert cache.get('a') is None
+    assert cache.stats()['bytes'] == 8
+
+    # An entry larger than the whole cache isn't cached, and doesn't evict the others
+    cache.put('d', 'x' * 11)
+
+    assert cache.get('d') is None
+    assert cache.get('b') == 'xxxx'
+    assert cache.get('c') == 'xxxx'
+
+
+def test_lru_replaces_entry():
+    cache = LRUCache(max_entries=8, max_bytes=10, sizeof=len)
+
+    cache.put('a', 'xxxx')
+    cache.put('a', 'xx')
+
+    assert cache.get('a') == 'xx'
+    assert cache.stats()['bytes'] == 2
+
+
+def test_lru_invalidate():
+    cache = LRUCache(max_entries=8)
+
+    for key in range(4):
+        cache.put(key, key)
+
+    assert cache.invalidate(lambda key: key % 2 == 0) == 2
+    assert cache.get(0) is None
+    assert cache.get(1) == 1
+
+
+def test_single_flight_coalesces_concurrent_calls():
+    flight = SingleFlight()
+
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def compute():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    with ThreadPoolExecutor(4) as executor:
+        leader = executor.submit(flight.do, 'key', compute)
+        started.wait(5)
+
+        followers = [executor.submit(flight.do, 'key', compute) for _ in range(3)]
+        while flight.stats()['coalesced'] < 3:
+            threading.Event().wait(0.01)
+
+        release.set()
+
+        assert leader.result(5) == ('result', False)
+        assert [follower.result(5) for follower in followers] == [('result', True)] * 3
+
+    assert len(calls) == 1
+    assert flight.stats()['in_flight'] == 0
+
+
+def test_single_flight_shares_exception():
+    flight = SingleFlight()
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("fit failed")
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(flight.do, 'key', fail)
+        started.wait(5)
+
+        follower = executor.submit(flight.do, 'key', fail)
+        while flight.stats()['coalesced'] < 1:
+            threading.Event().wait(0.01)
+
+        release.set()
+
+        with pytest.raises(RuntimeError, match="fit failed"):
+            leader.result(5)
+        with pytest.raises(RuntimeError, match="fit failed"):
+            follower.result(5)
+
+    # The key is free again once the computation is over
+    assert flight.do('key', lambda: 'again') == ('again', False)
+
+
+def test_single_flight_timeout():
+    flight = SingleFlight()
+
+    started = threading.Event()
+    release = threading.Event()
+
+    def compute():
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    with ThreadPoolExecutor(1) as executor:
+        leader = executor.submit(flight.do, 'key', compute)
+        started.wait(5)
+
+        with pytest.raises(FutureTimeoutError):
+            flight.do('key', compute, timeout=0.01)
+
+        release.set()
+        assert leader.result(5) == ('result', False)
+
+    assert flight.stats()['timeouts'] == 1
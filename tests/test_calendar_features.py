@@ -0,0 +1,53 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+
+from calendar_features import busy_days, day_features, unplayable_days
+from weather import is_unplayable_day
+
+
+@pytest.mark.parametrize('day, busy', [
+    ('2016-10-03', True),  # Monday
+    ('2016-10-08', True),  # Saturday
+    ('2016-10-09', False),  # Sunday
+    ('2016-07-12', False),  # Summer
+    ('2016-12-22', True),
+    ('2016-12-23', False),  # Christmas holidays
+    ('2017-01-06', False),
+    ('2017-01-09', True),
+])
+def test_busy_days(day, busy):
+    assert busy_days(day)[0] == busy
+
+
+def test_unplayable_days_match_weather():
+    days = [date(2015, 12, 1) + timedelta(days=i) for i in range(800)]
+
+    np.testing.assert_array_equal(unplayable_days(days), [is_unplayable_day(day) for day in days])
+
+
+def test_day_features():
+    features = day_features(np.array(['2016-12-31', '2017-01-09', '2016-12-31'], dtype='datetime64[D]'))
+
+    np.testing.assert_array_equal(features['weekday'], [5, 0, 5])
+    np.testing.assert_array_equal(features['busy'], [False, True, False])
+
+    # The memoized calendar isn't affected by the callers
+    features['busy'][:] = True
+
+    assert not day_features('2016-12-31')['busy'][0]
+
+
+def test_day_features_of_no_day():
+    features = day_features(np.empty(0, dtype='datetime64[D]'))
+
+    assert all(len(values) == 0 for values in features.values())
+
+
+def test_sample_data_follows_the_busy_days():
+    sample_data_generator = pytest.importorskip('sample_data_generator')
+
+    days = [date(2016, 12, 1) + timedelta(days=i) for i in range(60)]
+
+    assert [sample_data_generator.BusyDay.is_(day) for day in days] == busy_days(days).tolist()
@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+
+from event_archive import DAY_NS, EventArchive
+
+
+SOURCES = ('a', 'b')
+
+FIRST_DAY = np.datetime64('2016-08-01', 'D')
+
+
+def day_ns(day: int, hour: float) -> int:
+    return int((FIRST_DAY.astype(np.int64) + day) * DAY_NS + hour * 60 * 60 * 10**9)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    archive = EventArchive(str(tmp_path), SOURCES)
+
+    archive.append_days(1, FIRST_DAY, 2, {
+        'a': np.array([day_ns(0, 1), day_ns(0, 23), day_ns(1, 12)]),
+        'b': np.array([day_ns(1, 0)]),
+    })
+    archive.append_days(1, FIRST_DAY + 2, 1, {
+        'a': np.array([day_ns(2, 6)]),
+        'b': np.empty(0, dtype=np.int64),
+    })
+
+    return archive
+
+
+def test_round_trip(archive):
+    assert archive.archived_days(1) == (FIRST_DAY, FIRST_DAY + 3)
+
+    lo_ns, hi_ns, measurements = archive.read(1, day_ns(-1, 0), day_ns(5, 0))
+
+    assert (lo_ns, hi_ns) == (day_ns(0, 0), day_ns(3, 0))
+    np.testing.assert_array_equal(measurements['a'], [day_ns(0, 1), day_ns(0, 23), day_ns(1, 12), day_ns(2, 6)])
+    np.testing.assert_array_equal(measurements['b'], [day_ns(1, 0)])
+
+
+def test_read_range(archive):
+    lo_ns, hi_ns, measurements = archive.read(1, day_ns(0, 23), day_ns(1, 12))
+
+    assert (lo_ns, hi_ns) == (day_ns(0, 23), day_ns(1, 12) + 1)
+    np.testing.assert_array_equal(measurements['a'], [day_ns(0, 23), day_ns(1, 12)])
+    np.testing.assert_array_equal(measurements['b'], [day_ns(1, 0)])
+
+
+def test_read_outside_archive(archive):
+    assert archive.read(1, day_ns(3, 0), day_ns(4, 0)) is None
+    assert archive.read(2, day_ns(0, 0), day_ns(1, 0)) is None
+    assert archive.archived_days(2) is None
+
+
+def test_append_must_be_contiguous(archive):
+    with pytest.raises(ValueError):
+        archive.append_days(1, FIRST_DAY + 4, 1, {source: np.empty(0, dtype=np.int64) for source in SOURCES})
+
+
+def test_interrupted_append_is_ignored(archive, tmp_path):
+    # A partially written row of the day index
+    with open(tmp_path / '1' / 'days.bin', 'ab') as f:
+        f.write(np.array([FIRST_DAY.astype(np.int64) + 3], dtype='<i8').tobytes())
+
+    assert archive.archived_days(1) == (FIRST_DAY, FIRST_DAY + 3)
+
+    archive.append_days(1, FIRST_DAY + 3, 1, {'a': np.array([day_ns(3, 1)]), 'b': np.empty(0, dtype=np.int64)})
+
+    _, _, measurements = archive.read(1, day_ns(2, 0), day_ns(4, 0))
+    np.testing.assert_array_equal(measurements['a'], [day_ns(2, 6), day_ns(3, 1)])
+
+
+def test_delete(archive):
+    archive.delete(1)
+
+    assert archive.archived_days(1) is None
+
+
+def test_archived_store_serves_archive_and_recent_days(tmp_path):
+    from datetime import datetime
+
+    from event_archive import archive_baskets
+    from measurements import MEASUREMENT_SOURCES, ArchivedMeasurementStore, SQLiteMeasurementStore
+
+    store = SQLiteMeasurementStore(str(tmp_path / 'measurements.sqlite3'))
+    archive = EventArchive(str(tmp_path / 'archive'), MEASUREMENT_SOURCES)
+
+    t_ns = np.datetime64('2016-08-01T00:00', 'ns').astype(np.int64) + np.arange(0, 5 * DAY_NS, 7 * 60 * 10**9, dtype=np.int64)
+    store.bulk_insert_measurements('score_data', 1, t_ns)
+
+    # The first 3 days are sealed
+    assert archive_baskets(archive, store, [1], initial_days=3, now=datetime(2016, 8, 4, 6)) == np.count_nonzero(t_ns < day_ns(3, 0))
+    assert archive.archived_days(1) == (FIRST_DAY, FIRST_DAY + 3)
+
+    archived_store = ArchivedMeasurementStore(store, archive)
+
+    measurements = archived_store.fetch_measurements_for_baskets([1], datetime(2016, 8, 1, 12), datetime(2016, 8, 4, 12))
+    expected = store.fetch_measurements_for_baskets([1], datetime(2016, 8, 1, 12), datetime(2016, 8, 4, 12))
+
+    for source in MEASUREMENT_SOURCES:
+        np.testing.assert_array_equal(measurements[1][source], expected[1][source])
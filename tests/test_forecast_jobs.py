@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+import time
+
+import pytest
+
+import forecast_jobs
+from forecast_jobs import ForecastJobs, TooManyJobsError
+from occupation_forecast import forecast_cache
+
+
+PRESENT = datetime(2016, 8, 1, 17)
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    monkeypatch.setattr(forecast_jobs, 'forecast_job_workers', 1)
+
+    jobs = ForecastJobs()
+    yield jobs
+
+    if jobs._executor is not None:
+        jobs._executor.shutdown(cancel_futures=True)
+    forecast_cache.invalidate()
+
+
+def test_job_fits_forecast(jobs):
+    job = jobs.submit(701, PRESENT, 14, 1, resolution=timedelta(hours=1), engine='seasonal')
+    same = jobs.submit(701, PRESENT + timedelta(minutes=10), 14, 1, engine='seasonal')
+
+    # Jobs for the same forecast share its fit
+    assert same.future is job.future
+
+    job.future.result(timeout=60)
+
+    assert jobs.get(job.id) is job
+    assert job.status == 'done'
+
+    t, o_t = job.result()
+    assert len(t) == len(o_t) == 24
+
+    # Served from the cache from now on, once the job is over
+    deadline = time.monotonic() + 10
+    while jobs._fitting and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    cached = jobs.submit(701, PRESENT, 14, 1, engine='seasonal')
+    assert cached.future is not job.future and cached.future.done()
+
+
+def test_too_many_jobs(jobs, monkeypatch):
+    monkeypatch.setattr(forecast_jobs, 'forecast_job_max_pending', 0)
+
+    with pytest.raises(TooManyJobsError):
+        jobs.submit(703, PRESENT, 14, 1, engine='seasonal')
+
+
+def test_pool_is_replaced_when_a_worker_dies(jobs):
+    jobs.submit(704, PRESENT, 14, 1, engine='seasonal').future.result(timeout=60)
+
+    for process in list(jobs._executor._processes.values()):
+        process.kill()
+        process.join()
+
+    # Let the pool notice that its worker died
+    deadline = time.monotonic() + 10
+    while not jobs._executor._broken and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    job = jobs.submit(705, PRESENT, 14, 1, engine='seasonal')
+    job.future.result(timeout=60)
+
+    assert job.status == 'done'
@@ -0,0 +1,119 @@
+from datetime import datetime, timedelta
+import os
+
+import numpy as np
+
+from cache import LRUCache
+import forecast_store
+import occupation_forecast
+
+
+T = np.arange('2016-08-01T00:00', '2016-08-02T00:00', np.timedelta64(30, 'm'), dtype='datetime64[ns]')
+
+
+def save(store_dir, basket_id: int, age: float, model_json: str = '{}'):
+    meta = {
+        'basket_id': basket_id,
+        'present': datetime(2016, 8, 1),
+        'num_history_days': 90,
+        'num_predicted_days': 1,
+        'config': {'engine': 'seasonal'},
+        'fit_time': datetime.utcnow() - timedelta(seconds=age),
+        'data_watermark': datetime(2016, 7, 31, 23, 59),
+    }
+    forecast_store.save_forecast(str(store_dir), meta, T, np.linspace(0, 1, len(T)), model_json)
+
+    return meta
+
+
+def test_round_trip(tmp_path):
+    meta = save(tmp_path, 1, 0, '{"profile": [1, 2]}')
+
+    (loaded_meta, t, occupation, load_model_json, model_json_nbytes), = forecast_store.load_forecasts(str(tmp_path))
+
+    assert loaded_meta == meta
+    np.testing.assert_array_equal(t, T)
+    np.testing.assert_array_equal(occupation, np.linspace(0, 1, len(T)))
+    assert load_model_json() == '{"profile": [1, 2]}'
+    assert model_json_nbytes == len('{"profile": [1, 2]}')
+
+
+def test_save_replaces_previous_version(tmp_path):
+    save(tmp_path, 1, 0, '{"version": 1}')
+    save(tmp_path, 1, 0, '{"version": 2}')
+
+    loaded = list(forecast_store.load_forecasts(str(tmp_path)))
+
+    assert len(loaded) == 1
+    assert loaded[0][3]() == '{"version": 2}'
+
+
+def test_expired_forecasts_are_skipped_and_kept(tmp_path):
+    save(tmp_path, 1, 10)
+    save(tmp_path, 2, 2 * 60 * 60)
+
+    loaded = list(forecast_store.load_forecasts(str(tmp_path), max_age=60 * 60))
+
+    assert [meta['basket_id'] for meta, *_ in loaded] == [1]
+    assert len(list(forecast_store.load_forecasts(str(tmp_path)))) == 2
+
+
+def test_forecasts_are_deleted_after_retention(tmp_path):
+    save(tmp_path, 1, 2 * 60 * 60)
+    save(tmp_path, 2, 10 * 24 * 60 * 60)
+
+    assert list(forecast_store.load_forecasts(str(tmp_path), max_age=60 * 60, retention=7 * 24 * 60 * 60)) == []
+
+    assert [meta['basket_id'] for meta, *_ in forecast_store.load_forecasts(str(tmp_path))] == [1]
+
+
+def test_other_formats_are_skipped(tmp_path, monkeypatch):
+    save(tmp_path, 1, 0)
+
+    monkeypatch.setattr(forecast_store, 'FORMAT_VERSION', forecast_store.FORMAT_VERSION + 1)
+
+    assert list(forecast_store.load_forecasts(str(tmp_path))) == []
+
+
+def test_missing_store():
+    assert list(forecast_store.load_forecasts('/nonexistent/forecast-store')) == []
+
+
+def test_warm_forecast_cache(tmp_path, monkeypatch):
+    save(tmp_path, 1, 10, '{"profile": [0.5]}')
+    save(tmp_path, 2, 2 * 60 * 60)
+
+    cache = LRUCache(max_entries=8, ttl=60 * 60, sizeof=lambda forecast: forecast.nbytes)
+    monkeypatch.setattr(occupation_forecast, 'forecast_cache', cache)
+    monkeypatch.setattr(occupation_forecast, 'forecast_store_dir', str(tmp_path))
+
+    assert occupation_forecast.warm_forecast_cache() == 1
+
+    forecast = cache.get(occupation_forecast.forecast_cache_key(1, datetime(2016, 8, 1), 90, 1, {'engine': 'seasonal'}))
+
+    assert forecast is not None
+    np.testing.assert_array_equal(forecast.t, T)
+
+    # The model isn't read from disk, but its size is charged to the cache
+    assert forecast._model is None
+    assert cache.stats()['bytes'] == T.nbytes * 2 + len('{"profile": [0.5]}')
+
+    # The stale forecast is still on disk
+    assert len(os.listdir(tmp_path / '2')) == 1
+
+
+def test_warm_forecast_cache_disabled(monkeypatch):
+    monkeypatch.setattr(occupation_forecast, 'forecast_store_dir', '')
+
+    assert occupation_forecast.warm_forecast_cache() == 0
+
+
+def test_lru_age_counts_towards_ttl():
+    cache = LRUCache(max_entries=8, ttl=60)
+
+    cache.put('restored', 1, age=59)
+    assert cache.get('restored') == 1
+
+    cache.put('restored', 1, age=61)
+    assert cache.get('restored') is None
+
@@ -0,0 +1,83 @@
+from datetime import datetime
+
+import numpy as np
+
+import live_occupation
+from live_occupation import LiveOccupation
+from measurements import insert_measurements
+from occupation import evaluate_occupation_from_measurements
+
+
+NOW_NS = int(np.datetime64('2016-08-01T17:00', 'ns').astype(np.int64))
+
+MINUTE_NS = 60 * 10**9
+
+
+def empty_measurements():
+    return {source: np.empty(0, dtype=np.int64) for source in live_occupation.MEASUREMENT_SOURCES}
+
+
+def expected_occupation(**measurements):
+    return evaluate_occupation_from_measurements(
+        np.array([NOW_NS], dtype=np.int64),
+        {**empty_measurements(), **{source: np.array(t_ns, dtype=np.int64) for source, t_ns in measurements.items()}},
+    )[0]
+
+
+def test_window_is_loaded_from_the_store():
+    insert_measurements('score_data', [
+        {'basket_id': 801, 'timestamp': datetime(2016, 8, 1, 16, 50)},
+        {'basket_id': 801, 'timestamp': datetime(2016, 8, 1, 15, 0)},
+    ])
+
+    occupation = LiveOccupation().evaluate(801, NOW_NS)
+
+    assert occupation > 0
+    assert occupation == expected_occupation(score_data=[NOW_NS - 10 * MINUTE_NS])
+
+
+def test_added_measurements_are_evaluated():
+    live = LiveOccupation()
+
+    # Not loaded yet: read from the store when needed
+    live.add_measurements(802, 'score_data', [NOW_NS - 5 * MINUTE_NS])
+    assert live.stats() == {'baskets': 0, 'measurements': 0}
+
+    insert_measurements('people_detected_data', [{'basket_id': 802, 'timestamp': datetime(2016, 8, 1, 16, 40)}])
+    live.evaluate(802, NOW_NS)
+
+    live.add_measurements(802, 'score_data', [NOW_NS - 5 * MINUTE_NS, NOW_NS - 15 * MINUTE_NS])
+    live.add_measurements(802, 'score_data', [NOW_NS + MINUTE_NS])
+
+    # Measurements after the evaluated instant don't count
+    assert live.evaluate(802, NOW_NS) == expected_occupation(
+        people_detected_data=[NOW_NS - 20 * MINUTE_NS],
+        score_data=[NOW_NS - 15 * MINUTE_NS, NOW_NS - 5 * MINUTE_NS],
+    )
+    assert live.stats() == {'baskets': 1, 'measurements': 4}
+
+
+def test_measurements_added_while_loading_are_merged(monkeypatch):
+    live = LiveOccupation()
+
+    committed = NOW_NS - 10 * MINUTE_NS
+    not_committed = NOW_NS - 5 * MINUTE_NS
+
+    def fetch_measurements(basket_id, t_from, t_to):
+        # Ingested concurrently: the first one is committed before the read, the second one after
+        live.add_measurements(803, 'score_data', [committed])
+        live.add_measurements(803, 'score_data', [not_committed])
+
+        return {**empty_measurements(), 'score_data': np.array([NOW_NS - 20 * MINUTE_NS, committed], dtype=np.int64)}
+
+    monkeypatch.setattr(live_occupation, 'fetch_measurements', fetch_measurements)
+
+    assert live.evaluate(803, NOW_NS) == expected_occupation(score_data=[NOW_NS - 20 * MINUTE_NS, committed, not_committed])
+    assert live.stats() == {'baskets': 1, 'measurements': 3}
+
+
+def test_idle_baskets_are_forgotten():
+    live = LiveOccupation()
+
+    assert live.evaluate(804, NOW_NS) == 0
+    assert live.stats() == {'baskets': 0, 'measurements': 0}
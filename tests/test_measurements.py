@@ -0,0 +1,77 @@
+from datetime import datetime
+
+import numpy as np
+import pytest
+
+from measurements import MEASUREMENT_SOURCES, SQLiteMeasurementStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteMeasurementStore(str(tmp_path / 'measurements.sqlite3'))
+
+
+def test_sqlite_round_trip(store):
+    store.insert_measurements('score_data', [
+        {'basket_id': 1, 'timestamp': datetime(2016, 8, 1, 17, 0, 0, 250)},
+        {'basket_id': 1, 'timestamp': datetime(2016, 8, 1, 16, 0)},
+        {'basket_id': 2, 'timestamp': datetime(2016, 8, 1, 16, 30)},
+    ])
+    store.insert_measurements('accelerometer_data', [
+        {'basket_id': 1, 'timestamp': datetime(2016, 8, 1, 16, 45), 'accel_x': 1, 'accel_y': 2, 'accel_z': 3, 'gyro_x': 4, 'gyro_y': 5, 'gyro_z': 6, 'temperature': 20},
+    ])
+
+    measurements = store.fetch_measurements_for_baskets([1, 2, 3], datetime(2016, 8, 1), datetime(2016, 8, 2))
+
+    assert set(measurements) == {1, 2, 3}
+    assert set(measurements[1]) == set(MEASUREMENT_SOURCES)
+
+    # Sorted, in nanoseconds since the UNIX epoch
+    np.testing.assert_array_equal(
+        measurements[1]['score_data'],
+        np.array(['2016-08-01T16:00', '2016-08-01T17:00:00.000250'], dtype='datetime64[ns]').astype(np.int64),
+    )
+    np.testing.assert_array_equal(
+        measurements[1]['accelerometer_data'],
+        np.array(['2016-08-01T16:45'], dtype='datetime64[ns]').astype(np.int64),
+    )
+    assert len(measurements[1]['people_detected_data']) == 0
+    assert len(measurements[2]['score_data']) == 1
+    assert all(len(measurement_ns) == 0 for measurement_ns in measurements[3].values())
+
+    assert store.fetch_basket_ids() == [1, 2]
+    assert store.fetch_basket_ids(datetime(2016, 8, 1, 16, 40)) == [1]
+
+    assert store.fetch_latest_measurement(1, datetime(2016, 8, 1, 16, 50)) == datetime(2016, 8, 1, 16, 45)
+    assert store.fetch_latest_measurement(1, datetime(2016, 7, 1)) is None
+
+
+def test_sqlite_range_is_inclusive(store):
+    store.insert_measurements('people_detected_data', [
+        {'basket_id': 1, 'timestamp': datetime(2016, 8, 1, 16, 0)},
+        {'basket_id': 1, 'timestamp': datetime(2016, 8, 1, 17, 0)},
+        {'basket_id': 1, 'timestamp': datetime(2016, 8, 1, 17, 1)},
+    ])
+
+    measurements = store.fetch_measurements_for_baskets([1], datetime(2016, 8, 1, 16, 0), datetime(2016, 8, 1, 17, 0))
+
+    assert len(measurements[1]['people_detected_data']) == 2
+
+
+def test_sqlite_bulk_insert_and_delete(store):
+    t_ns = np.datetime64('2016-08-01T00:00', 'ns').astype(np.int64) + np.arange(5000, dtype=np.int64) * 60 * 10**9
+
+    assert store.bulk_insert_measurements('accelerometer_data', 7, t_ns, {'temperature': 21.5}) == 5000
+
+    measurements = store.fetch_measurements_for_baskets([7], datetime(2016, 7, 1), datetime(2016, 9, 1))
+    np.testing.assert_array_equal(measurements[7]['accelerometer_data'], t_ns)
+
+    store.delete_measurements(7)
+
+    measurements = store.fetch_measurements_for_baskets([7], datetime(2016, 7, 1), datetime(2016, 9, 1))
+    assert len(measurements[7]['accelerometer_data']) == 0
+
+
+def test_sqlite_unknown_source(store):
+    with pytest.raises(ValueError):
+        store.insert_measurements('unknown_data', [{'basket_id': 1, 'timestamp': datetime(2016, 8, 1)}])
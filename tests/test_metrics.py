@@ -0,0 +1,67 @@
+import pytest
+
+import metrics
+from metrics import CollectedMetric, Counter, Histogram, Registry, stage_seconds, stage_timer
+
+
+def test_counter():
+    counter = Counter('requests_total', "Requests", ('route',))
+
+    counter.inc(route='/a')
+    counter.inc(2, route='/a')
+    counter.inc(route='/b"')
+
+    assert counter.render() == [
+        '# HELP requests_total Requests',
+        '# TYPE requests_total counter',
+        'requests_total{route="/a"} 3',
+        'requests_total{route="/b\\""} 1',
+    ]
+
+    with pytest.raises(ValueError):
+        counter.inc(status=200)
+
+
+def test_histogram():
+    histogram = Histogram('latency_seconds', "Latency", buckets=(0.1, 1))
+
+    for value in (0.05, 0.5, 0.7, 5):
+        histogram.observe(value)
+
+    assert histogram.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 6.25',
+        'latency_seconds_count 4',
+    ]
+
+
+def test_collected_metric():
+    assert CollectedMetric('entries', "Entries", 'gauge', lambda: 7).render()[-1] == 'entries 7'
+
+    # A failing component doesn't break the rendering
+    assert len(CollectedMetric('entries', "Entries", 'gauge', lambda: 1 / 0).render()) == 2
+
+
+def test_registry():
+    registry = Registry()
+    registry.register(Counter('a_total', "A")).inc()
+
+    with pytest.raises(ValueError):
+        registry.register(Counter('a_total', "A"))
+
+    assert registry.render() == '# HELP a_total A\n# TYPE a_total counter\na_total 1\n'
+
+
+def test_stage_timer(monkeypatch):
+    spans = []
+    monkeypatch.setattr(metrics, 'stage_observers', [lambda stage, start, end: spans.append((stage, end - start))])
+
+    with pytest.raises(RuntimeError):
+        with stage_timer('test_stage'):
+            raise RuntimeError()
+
+    # Timed even if the stage fails
+    assert [stage for stage, _ in spans] == ['test_stage']
+    assert sum(stage_seconds._values[('test_stage',)][:-1]) == 1
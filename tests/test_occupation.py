@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+import occupation
+from occupation import OCCUPATION_WINDOW, accumulate_occupation_contribution
+
+
+def reference_contribution(t_ns, measurement_ns, p, d):
+    window_ns = int(min(d, OCCUPATION_WINDOW) * 1_000_000_000)
+
+    o_t = np.zeros(len(t_ns))
+    for i, t in enumerate(t_ns):
+        for t0 in measurement_ns:
+            if t - window_ns <= t0 <= t:
+                x = (t - t0) / 1_000_000_000
+                o_t[i] += max(p - p / d**2 * x**2, 0)
+
+    return o_t
+
+
+@pytest.mark.parametrize('p, d', [(0.5, 600), (0.1, 60 * 60), (1, 90)])
+def test_kernel_matches_reference_loop(p, d):
+    rng = np.random.default_rng(42)
+
+    start_ns = 1_470_000_000 * 10**9
+    measurement_ns = np.sort(start_ns + rng.integers(0, 6 * 60 * 60 * 10**9, 500))
+    t_ns = np.sort(start_ns + rng.integers(-60 * 10**9, 7 * 60 * 60 * 10**9, 200))
+
+    o_t = np.zeros(len(t_ns))
+    accumulate_occupation_contribution(t_ns, measurement_ns, p, d, o_t)
+
+    np.testing.assert_allclose(o_t, reference_contribution(t_ns, measurement_ns, p, d))
+
+
+def test_kernel_in_chunks(monkeypatch):
+    rng = np.random.default_rng(7)
+
+    measurement_ns = np.sort(rng.integers(0, 60 * 60 * 10**9, 300))
+    t_ns = np.arange(0, 2 * 60 * 60 * 10**9, 60 * 10**9)
+
+    expected = reference_contribution(t_ns, measurement_ns, 0.3, 900)
+
+    # Few rows per chunk, so that the time samples are spread over many chunks
+    monkeypatch.setattr(occupation, 'OCCUPATION_KERNEL_CHUNK_SIZE', 256)
+
+    o_t = np.zeros(len(t_ns))
+    accumulate_occupation_contribution(t_ns, measurement_ns, 0.3, 900, o_t)
+
+    np.testing.assert_allclose(o_t, expected)
+
+
+def test_kernel_accumulates():
+    t_ns = np.array([10 * 10**9, 20 * 10**9])
+
+    o_t = np.ones(2)
+    accumulate_occupation_contribution(t_ns, np.array([10 * 10**9]), 0.5, 100, o_t)
+
+    np.testing.assert_allclose(o_t, [1.5, 1 + 0.5 - 0.5 / 100**2 * 10**2])
+
+
+def test_kernel_without_measurements():
+    o_t = np.zeros(3)
+    accumulate_occupation_contribution(np.arange(3, dtype=np.int64), np.empty(0, dtype=np.int64), 0.5, 100, o_t)
+
+    assert not np.any(o_t)
@@ -0,0 +1,52 @@
+from datetime import datetime
+
+import numpy as np
+
+from occupation_forecast import OccupationForecast, fit_occupation_forecast, truncate_present
+
+
+def make_forecast(model, model_nbytes=0):
+    t = np.arange('2016-08-01T00:00', '2016-08-02T00:00', np.timedelta64(30, 'm'), dtype='datetime64[ns]')
+
+    return OccupationForecast(1, datetime(2016, 8, 1), 90, 1, {'engine': 'seasonal'}, t, np.zeros(len(t)), model, datetime(2016, 8, 1), None, model_nbytes)
+
+
+class Model:
+    def __init__(self):
+        self.profile = np.zeros(1000)
+
+
+def test_nbytes_of_loaded_model():
+    forecast = make_forecast(Model())
+
+    assert forecast.nbytes == forecast.t.nbytes + forecast.occupation.nbytes + 8000
+
+
+def test_nbytes_of_lazy_model():
+    calls = []
+
+    def load():
+        calls.append(1)
+        return Model()
+
+    forecast = make_forecast(load, model_nbytes=5000)
+
+    # The estimate is charged without loading the model
+    assert forecast.nbytes == forecast.t.nbytes + forecast.occupation.nbytes + 5000
+    assert not calls
+
+    assert isinstance(forecast.model, Model)
+    assert forecast.model is forecast.model
+    assert len(calls) == 1
+
+
+def test_truncate_present():
+    assert truncate_present(datetime(2016, 8, 1, 17, 47, 12)) == datetime(2016, 8, 1, 17, 30)
+    assert truncate_present(datetime(2016, 8, 1, 17, 30)) == datetime(2016, 8, 1, 17, 30)
+
+
+def test_fit_logs_instead_of_printing(capsys):
+    forecast = fit_occupation_forecast(1, datetime(2016, 8, 1, 17), 14, 1, engine='seasonal')
+
+    assert len(forecast.t) == 48
+    assert capsys.readouterr().out == ''
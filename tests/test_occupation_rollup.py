@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import occupation_rollup
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.rows = []
+
+    def execute(self, query, params=()):
+        query = ' '.join(query.split())
+        self.connection.statements.append((query, params))
+
+        if query.startswith('SELECT watermark FROM occupation_rollup_watermark'):
+            watermark = self.connection.watermarks.get(params[0])
+            self.rows = [(watermark,)] if watermark is not None else []
+
+    def executemany(self, query, rows):
+        self.connection.statements.append((' '.join(query.split()), rows))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """
+    Records the statements executed against the rollup tables, answering the watermark reads from `watermarks`.
+    """
+
+    def __init__(self, watermarks=None):
+        self.watermarks = watermarks or {}
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        pass
+
+    def inserted_buckets(self):
+        return [rows for query, rows in self.statements if query.startswith('INSERT INTO occupation_rollup (')]
+
+
+@pytest.fixture
+def rollup_enabled(monkeypatch):
+    monkeypatch.setattr(occupation_rollup, 'rollup_enabled', True)
+
+
+@pytest.fixture
+def occupations(monkeypatch):
+    monkeypatch.setattr(
+        occupation_rollup,
+        'evaluate_occupation_for_baskets',
+        lambda basket_ids, t: {basket_id: np.full(len(t), 0.5) for basket_id in basket_ids},
+    )
+
+
+def test_roll_up_range_moves_watermark(occupations):
+    connection = FakeConnection({1: datetime(2016, 8, 1, 16, 30)})
+    watermarks = {1: datetime(2016, 8, 1, 16, 30)}
+
+    num_buckets = occupation_rollup.roll_up_range(connection, [1, 2], datetime(2016, 8, 1, 17), datetime(2016, 8, 1, 18), watermarks)
+
+    assert num_buckets == 6
+    assert watermarks == {1: datetime(2016, 8, 1, 18), 2: datetime(2016, 8, 1, 18)}
+    assert [len(rows) for rows in connection.inserted_buckets()] == [3, 3]
+    assert connection.commits == 2
+
+
+def test_roll_up_range_drops_rewound_basket(occupations):
+    # Rewound by late measurements while the chunk was being evaluated
+    connection = FakeConnection({1: datetime(2016, 8, 1, 12), 2: datetime(2016, 8, 1, 16, 30)})
+    watermarks = {1: datetime(2016, 8, 1, 16, 30), 2: datetime(2016, 8, 1, 16, 30)}
+
+    num_buckets = occupation_rollup.roll_up_range(connection, [1, 2], datetime(2016, 8, 1, 17), datetime(2016, 8, 1, 18), watermarks)
+
+    assert num_buckets == 3
+    assert watermarks == {1: datetime(2016, 8, 1, 16, 30), 2: datetime(2016, 8, 1, 18)}
+    assert [rows[0][0] for rows in connection.inserted_buckets()] == [2]
+    assert connection.rollbacks == 1
+
+
+def test_rewind_rollup(rollup_enabled, monkeypatch):
+    connection = FakeConnection()
+    monkeypatch.setattr(occupation_rollup, 'create_db_connection', lambda: connection)
+
+    assert occupation_rollup.rewind_rollup(1, datetime(2016, 8, 1, 17, 47))
+
+    (upsert, upsert_params), (delete, delete_params) = connection.statements
+    assert 'LEAST(watermark' in upsert and upsert_params == (1, datetime(2016, 8, 1, 17))
+    assert delete.startswith('DELETE FROM occupation_rollup') and delete_params == (1, datetime(2016, 8, 1, 17))
+    assert connection.commits == 1
+
+
+def test_rewind_rollup_ignores_measurements_in_time(rollup_enabled, monkeypatch):
+    monkeypatch.setattr(occupation_rollup, 'create_db_connection', lambda: pytest.fail("No statement expected"))
+
+    assert not occupation_rollup.rewind_rollup(1, datetime.utcnow() - timedelta(minutes=1))
+
+
+def test_rewind_rollup_disabled(monkeypatch):
+    monkeypatch.setattr(occupation_rollup, 'rollup_enabled', False)
+    monkeypatch.setattr(occupation_rollup, 'create_db_connection', lambda: pytest.fail("No statement expected"))
+
+    assert not occupation_rollup.rewind_rollup(1, datetime(2016, 8, 1))
+
+
+def test_history_reads_rollup_and_evaluates_the_rest(rollup_enabled, monkeypatch):
+    t = np.array(['2016-08-01T17:00', '2016-08-01T17:30', '2016-08-01T17:45', '2016-08-01T18:00'], dtype='datetime64[ns]')
+
+    monkeypatch.setattr(occupation_rollup, 'fetch_rollup', lambda basket_id, t_from, t_to: (t[[0, 1]].astype(np.int64), np.array([0.25, 0.5])))
+
+    evaluated = []
+
+    def evaluate_occupation(basket_id, t):
+        evaluated.append(t)
+        return np.ones(len(t))
+
+    monkeypatch.setattr(occupation_rollup, 'evaluate_occupation', evaluate_occupation)
+
+    off_grid = occupation_rollup.rollup_off_grid_samples._values.get((), 0)
+
+    np.testing.assert_array_equal(occupation_rollup.evaluate_occupation_history(1, t), [0.25, 0.5, 1, 1])
+
+    # The instant off the grid and the one not rolled up yet are evaluated from the measurements
+    np.testing.assert_array_equal(evaluated[0], t[[2, 3]])
+    assert occupation_rollup.rollup_off_grid_samples._values[()] == off_grid + 1
@@ -0,0 +1,55 @@
+import os
+import time
+
+from profiling import observe_stage, start_profile, stop_profile
+
+
+def busy_wait(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+def test_profile_summary():
+    profile = start_profile('test')
+
+    start = time.perf_counter()
+    busy_wait(0.01)
+    observe_stage('first', start, time.perf_counter())
+
+    stop_profile(profile)
+
+    # Stages observed after the profile was stopped aren't part of it
+    observe_stage('second', start, time.perf_counter())
+
+    summary = profile.summary(num_functions=3)
+
+    assert summary['wall_ms'] >= 10
+    assert [span['stage'] for span in summary['spans']] == ['first']
+    assert summary['stages_ms']['first'] == summary['spans'][0]['duration_ms']
+    assert len(summary['functions']) == 3
+    assert any('busy_wait' in function['function'] for function in summary['functions'])
+
+
+def test_single_profile_at_a_time():
+    profile = start_profile('first')
+
+    try:
+        assert start_profile('second') is None
+    finally:
+        stop_profile(profile)
+
+    profile = start_profile('third')
+    assert profile is not None
+    stop_profile(profile)
+
+
+def test_profile_is_saved(tmp_path):
+    profile = start_profile('saved')
+    stop_profile(profile)
+
+    file_path = profile.save(str(tmp_path / 'profiles'))
+
+    assert os.path.dirname(file_path) == str(tmp_path / 'profiles')
+    assert file_path.endswith('-saved.prof')
+    assert os.path.getsize(file_path) > 0
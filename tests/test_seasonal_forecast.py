@@ -0,0 +1,82 @@
+import numpy as np
+
+from calendar_features import unplayable_days
+from occupation_forecast import forecasters
+from seasonal_forecast import NUM_WEEK_SLOTS, SLOT_NS, WEEK_NS, SeasonalProfile, fit_seasonal_profile, week_slots
+
+
+# A Monday
+MONDAY_NS = int(np.datetime64('2016-08-01T00:00', 'ns').astype(np.int64))
+
+
+def test_week_slots():
+    assert week_slots(np.array([MONDAY_NS, MONDAY_NS + SLOT_NS - 1, MONDAY_NS + SLOT_NS, MONDAY_NS - SLOT_NS, MONDAY_NS + WEEK_NS])).tolist() == [0, 0, 1, NUM_WEEK_SLOTS - 1, 0]
+
+
+def test_fit_repeats_the_week():
+    t_ns = MONDAY_NS + np.arange(3 * NUM_WEEK_SLOTS, dtype=np.int64) * SLOT_NS
+    week = np.linspace(0, 1, NUM_WEEK_SLOTS)
+    occupation = np.tile(week, 3)
+
+    model = fit_seasonal_profile(t_ns, occupation, np.zeros(len(t_ns), dtype=bool), t_ns[-1], 4)
+
+    np.testing.assert_allclose(model.profile, week)
+    assert model.unplayable_factor == 1
+
+    np.testing.assert_allclose(model.predict(t_ns[:NUM_WEEK_SLOTS] + 5 * WEEK_NS, np.zeros(NUM_WEEK_SLOTS, dtype=bool)), week)
+
+
+def test_fit_weights_recent_weeks():
+    t_ns = MONDAY_NS + np.arange(2 * NUM_WEEK_SLOTS, dtype=np.int64) * SLOT_NS
+    occupation = np.repeat([0.0, 1.0], NUM_WEEK_SLOTS)
+
+    model = fit_seasonal_profile(t_ns, occupation, np.zeros(len(t_ns), dtype=bool), t_ns[-1], 1)
+
+    # The last week weighs twice as much as the one before it
+    np.testing.assert_allclose(model.profile, 2 / 3)
+
+
+def test_fit_unplayable_factor():
+    t_ns = MONDAY_NS + np.arange(2 * NUM_WEEK_SLOTS, dtype=np.int64) * SLOT_NS
+    unplayable = np.zeros(len(t_ns), dtype=bool)
+    unplayable[NUM_WEEK_SLOTS:NUM_WEEK_SLOTS + 48] = True  # The second Monday
+
+    occupation = np.full(len(t_ns), 0.8)
+    occupation[unplayable] = 0.2
+
+    model = fit_seasonal_profile(t_ns, occupation, unplayable, t_ns[-1], 4)
+
+    # Unplayable days don't shape the profile, but tell how much of it is left
+    np.testing.assert_allclose(model.profile, 0.8)
+    assert np.isclose(model.unplayable_factor, 0.25)
+    np.testing.assert_allclose(model.predict(t_ns[:2], np.array([False, True])), [0.8, 0.2])
+
+
+def test_fit_without_history():
+    model = fit_seasonal_profile(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0, dtype=bool), MONDAY_NS, 4)
+
+    assert not np.any(model.profile)
+
+
+def test_json_round_trip():
+    model = SeasonalProfile(np.linspace(0, 1, NUM_WEEK_SLOTS), 0.5)
+
+    loaded = SeasonalProfile.from_json(model.to_json())
+
+    np.testing.assert_array_equal(loaded.profile, model.profile)
+    assert loaded.unplayable_factor == 0.5
+
+
+def test_seasonal_forecaster():
+    forecaster = forecasters['seasonal']
+
+    t = np.arange('2016-07-04T00:00', '2016-08-01T00:00', np.timedelta64(30, 'm'), dtype='datetime64[ns]')
+    occupation = np.tile(np.linspace(0, 1, NUM_WEEK_SLOTS), 4)
+    days = np.arange(np.datetime64('2016-07-04'), np.datetime64('2016-08-03'))
+
+    model, predicted_t, predicted_occupation = forecaster.fit(forecaster.config(28), t, occupation, days, unplayable_days(days), 2)
+
+    # The history followed by 2 days
+    assert len(predicted_t) == len(predicted_occupation) == len(t) + 2 * 48
+    assert predicted_t[len(t)] == np.datetime64('2016-08-01T00:00')
+    assert forecaster.model_from_json(forecaster.model_to_json(model)).unplayable_factor == model.unplayable_factor
@@ -0,0 +1,202 @@
+import pytest
+
+from webservice import app
+
+
+ACCELEROMETER = {'accel_x': 0.1, 'accel_y': 0.2, 'accel_z': 9.8, 'gyro_x': 0, 'gyro_y': 0, 'gyro_z': 0, 'temperature': 21}
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize('query', [
+    '',
+    'basket=1&present=2016-08-01T17:00:00&num_history_days=90&num_predicted_days=x',
+    'basket=1&present=2016-08-01T17:00:00&num_history_days=90&num_predicted_days=14&engine=unknown',
+    'basket=1&present=2016-08-01T17:00:00&num_history_days=90&num_predicted_days=14&resolution=0',
+    'basket=1&present=2016-08-01T17:00:00&num_history_days=90&num_predicted_days=14&t=yesterday',
+])
+def test_forecast_occupation_series_bad_request(client, query):
+    assert client.get(f'/api/forecast_occupation_series?{query}').status_code == 400
+
+
+def test_forecast_occupation_series(client):
+    query = 'basket=1&present=2016-08-01T17:00:00&num_history_days=14&num_predicted_days=1&engine=seasonal'
+
+    horizon = client.get(f'/api/forecast_occupation_series?{query}&resolution=60').get_json()
+
+    assert len(horizon['t']) == len(horizon['occupation']) == 24
+    assert horizon['t'][0] == '2016-08-01T17:30:00'
+    assert all(0 <= o <= 1 for o in horizon['occupation'])
+
+    at = client.get(f'/api/forecast_occupation_series?{query}&t=2016-08-01T18:30:00&t=2016-08-02T08:30:00').get_json()
+
+    assert at['t'] == ['2016-08-01T18:30:00', '2016-08-02T08:30:00']
+    assert at['occupation'] == [horizon['occupation'][1], horizon['occupation'][15]]
+
+
+@pytest.mark.parametrize('query', ['', 'basket=x', 'basket=1&t=yesterday'])
+def test_occupation_bad_request(client, query):
+    assert client.get(f'/api/occupation?{query}').status_code == 400
+
+
+def test_sealed_occupation_is_revalidated(client):
+    query = 'basket=903&t=2016-08-01T17:10:00'
+
+    response = client.get(f'/api/occupation?{query}')
+
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] in ('private, max-age=60', 'max-age=60, private')
+    assert client.get(f'/api/occupation?{query}', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+    # Late measurements of the basket change its ETag, even at the instants whose occupation they don't change
+    client.post('/api/measurements', json=[{'basket': 903, 'source': 'score_data', 't': '2016-08-01T17:20:00'}])
+
+    revalidated = client.get(f'/api/occupation?{query}', headers={'If-None-Match': response.headers['ETag']})
+
+    assert revalidated.status_code == 200
+    assert revalidated.get_json() == response.get_json()
+    assert revalidated.headers['ETag'] != response.headers['ETag']
+
+
+def test_current_occupation_is_not_cached(client):
+    response = client.get('/api/occupation?basket=1')
+
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert 'ETag' not in response.headers
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {'baskets': [1]},
+    {'t': ['2016-08-01T17:00:00']},
+    {'baskets': ['x'], 't': ['2016-08-01T17:00:00']},
+    {'baskets': [1], 't': ['yesterday']},
+    {'baskets': 1, 't': ['2016-08-01T17:00:00']},
+])
+def test_occupation_batch_bad_request(client, body):
+    assert client.post('/api/occupation_batch', json=body).status_code == 400
+
+
+def test_occupation_batch_limits(client, monkeypatch):
+    import webservice
+
+    monkeypatch.setattr(webservice, 'occupation_batch_max_baskets', 2)
+    monkeypatch.setattr(webservice, 'occupation_batch_max_instants', 3)
+
+    t = ['2016-08-01T17:00:00', '2016-08-01T17:30:00']
+
+    assert client.post('/api/occupation_batch', json={'baskets': [1, 2, 3], 't': t}).status_code == 400
+    assert client.post('/api/occupation_batch', json={'baskets': [1], 't': t * 2}).status_code == 400
+    assert client.post('/api/occupation_batch', json={'baskets': [1], 't': ['2016-08-01T17:00:00', '2017-08-01T17:00:00']}).status_code == 400
+
+    # Repeated baskets count once
+    response = client.post('/api/occupation_batch', json={'baskets': [1, 2, 1], 't': t})
+
+    assert response.status_code == 200
+    assert response.get_json() == {'occupation': {'1': [0, 0], '2': [0, 0]}, 't': t}
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {},
+    {'basket': 1, 'source': 'score_data'},
+    {'basket': 1, 't': '2016-08-01T17:00:00'},
+    {'basket': 1, 'source': 'unknown_data', 't': '2016-08-01T17:00:00'},
+    {'basket': 'x', 'source': 'score_data', 't': '2016-08-01T17:00:00'},
+    {'basket': 1, 'source': 'score_data', 't': 'yesterday'},
+    {'basket': 1, 'source': 'score_data', 't': 12},
+    {'basket': 1, 'source': 'accelerometer_data', 't': '2016-08-01T17:00:00'},
+    {'basket': 1, 'source': 'accelerometer_data', 't': '2016-08-01T17:00:00', **ACCELEROMETER, 'accel_x': [1]},
+    {'basket': 1, 'source': 'accelerometer_data', 't': '2016-08-01T17:00:00', **ACCELEROMETER, 'temperature': 'hot'},
+    [{'basket': 1, 'source': 'score_data', 't': '2016-08-01T17:00:00'}, 'measurement'],
+])
+def test_measurements_bad_request(client, body):
+    response = client.post('/api/measurements', json=body)
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_measurements(client):
+    response = client.post('/api/measurements', json=[
+        {'basket': 901, 'source': 'score_data', 't': '2016-08-01T17:00:00'},
+        {'basket': 901, 'source': 'accelerometer_data', 't': '2016-08-01T17:01:00', **ACCELEROMETER, 'temperature': None},
+    ])
+
+    assert response.status_code == 201
+    assert response.get_json() == {'inserted': 2}
+
+
+def test_late_measurements_with_offsets(client):
+    query = 'basket=902&t=2016-08-01T17:10:00'
+
+    assert client.get(f'/api/occupation?{query}').get_json()['occupation'] == 0
+
+    # Mixed naive and offset instants, the earliest one having an offset
+    response = client.post('/api/measurements', json=[
+        {'basket': 902, 'source': 'score_data', 't': '2016-08-01T17:30:00'},
+        {'basket': 902, 'source': 'score_data', 't': '2016-08-01T19:05:00+02:00'},
+    ])
+    assert response.status_code == 201
+
+    # The occupation cached before the late measurements isn't served anymore
+    assert client.get(f'/api/occupation?{query}').get_json()['occupation'] > 0
+
+
+@pytest.mark.parametrize('body', [
+    None,
+    {'basket': 1, 'present': '2016-08-01T17:00:00', 'num_history_days': 90},
+    {'basket': 1, 'present': 'yesterday', 'num_history_days': 90, 'num_predicted_days': 14},
+    {'basket': 1, 'present': '2016-08-01T17:00:00', 'num_history_days': 90, 'num_predicted_days': 14, 'engine': 'unknown'},
+    {'basket': 1, 'present': '2016-08-01T17:00:00', 'num_history_days': 90, 'num_predicted_days': 14, 'resolution': 0},
+    {'basket': 1, 'present': '2016-08-01T17:00:00', 'num_history_days': 90, 'num_predicted_days': 14, 't': ['yesterday']},
+])
+def test_forecast_jobs_bad_request(client, body):
+    assert client.post('/api/forecast_jobs', json=body).status_code == 400
+
+
+def test_forecast_job_not_found(client):
+    assert client.get('/api/forecast_jobs/unknown').status_code == 404
+
+
+def test_metrics(client):
+    client.get('/api/occupation?basket=x')
+
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert b'http_requests_total{route="/api/occupation",method="GET",status="400"}' in response.data
+    assert b'occupation_stage_seconds_bucket' in response.data
+
+
+@pytest.mark.parametrize('query', [
+    '',
+    'basket=x',
+    'basket=1&num_days=0',
+    'basket=1&num_days=100000',
+    'basket=1&resolution=45',
+    'basket=1&resolution=0',
+    'basket=1&utc_offset=15',
+    'basket=1&utc_offset=x',
+])
+def test_weekly_profile_bad_request(client, query):
+    assert client.get(f'/api/weekly_profile?{query}').status_code == 400
+
+
+def test_weekly_profile(client):
+    response = client.get('/api/weekly_profile?basket=904&num_days=1&resolution=120')
+
+    assert response.status_code == 200
+
+    body = response.get_json()
+    assert body['resolution'] == 120
+    assert len(body['occupation']) == len(body['samples']) == 7
+    assert all(len(day) == 12 for day in body['occupation'])
+    assert sum(map(sum, body['samples'])) == 48
+    # Only the buckets of the last day have samples
+    assert sum(o is not None for day in body['occupation'] for o in day) in (12, 13)
@@ -0,0 +1,117 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import weekly_profile as weekly_profile_module
+from occupation import occupation_sealed_until
+from seasonal_forecast import NUM_WEEK_SLOTS, SLOT_NS
+from weekly_profile import SAMPLES_PER_DAY, WeeklyProfiles, weekly_profile
+
+
+# A Monday
+MONDAY_NS = int(np.datetime64('2016-08-01T00:00', 'ns').astype(np.int64))
+
+NOW = datetime(2016, 8, 15, 12)
+
+
+def test_weekly_profile_averages_buckets():
+    t_ns = MONDAY_NS + np.arange(2 * NUM_WEEK_SLOTS, dtype=np.int64) * SLOT_NS
+    occupation = np.tile(np.arange(NUM_WEEK_SLOTS, dtype=float), 2)
+    occupation[NUM_WEEK_SLOTS:] += 1
+
+    profile, counts = weekly_profile(t_ns, occupation, slots_per_bucket=2)
+
+    assert profile.shape == counts.shape == (7, 24)
+    assert (counts == 4).all()
+    # Every bucket merges 2 slots of 2 weeks
+    assert profile[0, 0] == (0 + 1 + 1 + 2) / 4
+    assert profile[6, 23] == (NUM_WEEK_SLOTS - 2 + NUM_WEEK_SLOTS - 1) / 2 + 0.5
+
+
+def test_weekly_profile_of_empty_buckets():
+    profile, counts = weekly_profile(np.array([MONDAY_NS], dtype=np.int64), np.array([0.5]))
+
+    assert profile[0, 0] == 0.5 and counts[0, 0] == 1
+    assert np.isnan(profile).sum() == NUM_WEEK_SLOTS - 1
+    assert counts.sum() == 1
+
+
+def test_weekly_profile_utc_offset():
+    # Monday at 00:00 UTC is Monday at 02:00 at UTC+2, and Sunday at 22:00 at UTC-2
+    t_ns = np.array([MONDAY_NS], dtype=np.int64)
+    hour_ns = 60 * 60 * 10**9
+
+    assert weekly_profile(t_ns, np.ones(1), 2, 2 * hour_ns)[1][0, 2] == 1
+    assert weekly_profile(t_ns, np.ones(1), 2, -2 * hour_ns)[1][6, 22] == 1
+
+
+@pytest.fixture
+def evaluated(monkeypatch):
+    evaluated = []
+
+    def evaluate_occupation_history(basket_id, t):
+        t_ns = t.astype(np.int64)
+        evaluated.append(len(t_ns))
+        # The occupation tells the instant it has been evaluated at
+        return (t_ns - MONDAY_NS) / SLOT_NS
+
+    monkeypatch.setattr(weekly_profile_module, 'evaluate_occupation_history', evaluate_occupation_history)
+
+    return evaluated
+
+
+def expected_history(t_ns):
+    return (t_ns - MONDAY_NS) / SLOT_NS
+
+
+def test_history_is_refreshed_incrementally(evaluated):
+    profiles = WeeklyProfiles(max_entries=4, max_days=7)
+
+    t_ns, occupation = profiles.history(1, 2, NOW)
+
+    assert len(t_ns) == 2 * SAMPLES_PER_DAY
+    assert t_ns[-1] == occupation_sealed_until(NOW) // SLOT_NS * SLOT_NS
+    np.testing.assert_array_equal(occupation, expected_history(t_ns))
+    assert evaluated == [2 * SAMPLES_PER_DAY]
+
+    # Only the instants sealed since, and the days before the cached ones, are evaluated
+    t_ns, occupation = profiles.history(1, 3, NOW + timedelta(hours=1))
+
+    assert len(t_ns) == 3 * SAMPLES_PER_DAY
+    np.testing.assert_array_equal(occupation, expected_history(t_ns))
+    assert evaluated == [2 * SAMPLES_PER_DAY, SAMPLES_PER_DAY - 2, 2]
+
+
+def test_history_is_bounded(evaluated):
+    profiles = WeeklyProfiles(max_entries=4, max_days=2)
+
+    profiles.history(1, 2, NOW)
+    t_ns, occupation = profiles.history(1, 2, NOW + timedelta(days=1))
+
+    np.testing.assert_array_equal(occupation, expected_history(t_ns))
+    assert len(profiles._samples.get(1).occupation) == 2 * SAMPLES_PER_DAY
+
+
+def test_invalidated_history_is_evaluated_again(evaluated):
+    profiles = WeeklyProfiles(max_entries=4, max_days=7)
+
+    t_ns, _ = profiles.history(1, 2, NOW)
+
+    profiles.invalidate(1, np.datetime64(int(t_ns[-10]) + 1, 'ns'))
+    profiles.invalidate(2, np.datetime64(int(t_ns[0]), 'ns'))
+
+    t_ns, occupation = profiles.history(1, 2, NOW)
+
+    np.testing.assert_array_equal(occupation, expected_history(t_ns))
+    assert evaluated == [2 * SAMPLES_PER_DAY, 9]
+
+
+def test_profile(evaluated):
+    profiles = WeeklyProfiles(max_entries=4, max_days=14)
+
+    t_from_ns, t_to_ns, profile, counts = profiles.profile(1, 14, 2, now=NOW)
+
+    assert (t_to_ns - t_from_ns) // SLOT_NS + 1 == 14 * SAMPLES_PER_DAY
+    assert profile.shape == (7, 24)
+    assert (counts == 4).all()